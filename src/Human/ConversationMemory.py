@@ -0,0 +1,126 @@
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+sys.path.append('../LLM')
+sys.path.append('../Serialization')
+
+from LLM import LanguageModel
+from RateLimiter import count_tokens
+from Serialize import RegisteredSerializable
+
+# The memory is off (the whole conversation goes into every prompt) unless HUMAN_MEMORY_MAX_TOKENS is set in the .env file
+MEMORY_MAX_TOKENS: Optional[int] = int(os.getenv('HUMAN_MEMORY_MAX_TOKENS')) if os.getenv('HUMAN_MEMORY_MAX_TOKENS') else None
+MEMORY_RECENT_TURNS: int = int(os.getenv('HUMAN_MEMORY_RECENT_TURNS', 6))
+MEMORY_SUMMARIZE_EVERY: int = int(os.getenv('HUMAN_MEMORY_SUMMARIZE_EVERY', 4))
+
+
+def _render(statements: List[Dict[str, str]]) -> str:
+    # same format as Human.list_to_string
+    return ''.join(f"{key}: {value}" for statement in statements for key, value in statement.items())
+
+
+class ConversationMemory(RegisteredSerializable):
+    '''
+    How much of the conversation a Human puts in its prompts.
+    While the conversation fits in max_tokens it is used verbatim. Past that, the prompts get a running summary
+    of the older statements plus the most recent statements verbatim. The summary is extended every summarize_every
+    statements, so a prompt holds at most recent_turns + summarize_every - 1 verbatim statements and its size stays flat.
+    Statements are counted with tiktoken once, when they are first seen.
+
+    Args:
+        max_tokens (int, optional): token budget of the conversation in a prompt, None to always use the whole conversation
+        recent_turns (int): number of most recent statements always kept verbatim
+        summarize_every (int): number of statements added to the summary at once
+        model (str): the model whose tokenizer measures the budget
+    '''
+    def __init__(self, max_tokens: Optional[int] = MEMORY_MAX_TOKENS, recent_turns: int = MEMORY_RECENT_TURNS,
+                 summarize_every: int = MEMORY_SUMMARIZE_EVERY, model: str = 'gpt-4') -> None:
+        self.max_tokens: Optional[int] = max_tokens
+        self.recent_turns: int = recent_turns
+        self.summarize_every: int = max(1, summarize_every)
+        self.model: str = model
+        # state of the conversation being remembered
+        self.first_statement: Optional[Dict[str, str]] = None
+        self.statement_tokens: List[int] = []
+        self.total_tokens: int = 0
+        self.summary: str = ''
+        self.summarized_turns: int = 0
+
+    def _sync(self, history: List[Dict[str, str]]) -> None:
+        '''
+        Counts the tokens of the statements not seen yet. Starts over if this is another conversation.
+        '''
+        if not history or history[0] != self.first_statement or len(history) < len(self.statement_tokens):
+            self.first_statement = history[0] if history else None
+            self.statement_tokens, self.total_tokens, self.summary, self.summarized_turns = [], 0, '', 0
+        for statement in history[len(self.statement_tokens):]:
+            self.statement_tokens.append(count_tokens(_render([statement]), self.model))
+            self.total_tokens += self.statement_tokens[-1]
+
+    def over_budget(self, history: Optional[List[Dict[str, str]]]) -> bool:
+        if self.max_tokens is None or not history:
+            return False
+        self._sync(history)
+        return self.total_tokens > self.max_tokens
+
+    def _pending_summary(self, history: List[Dict[str, str]]) -> Optional[Tuple[int, str]]:
+        '''
+        The number of statements the summary should cover now and the prompt to extend it, or None if it is up to date.
+        '''
+        if not self.over_budget(history):
+            return None
+        older_turns = max(0, len(history) - self.recent_turns)
+        target = older_turns - older_turns % self.summarize_every
+        if target <= self.summarized_turns:
+            return None
+        new_statements = _render(history[self.summarized_turns:target])
+        if self.summary:
+            prompt = f"""Here is a summary of the beginning of a conversation: {self.summary}
+Here are the statements that followed: {new_statements}
+Write a short summary of the conversation so far that keeps every offer, agreement, commitment, number and piece of information the participants shared. Respond with the summary only."""
+        else:
+            prompt = f"""Here are the first statements of a conversation: {new_statements}
+Write a short summary of the conversation so far that keeps every offer, agreement, commitment, number and piece of information the participants shared. Respond with the summary only."""
+        return target, prompt
+
+    @staticmethod
+    def _summarizer(LLM: LanguageModel) -> LanguageModel:
+        # summaries are made at temperature 0, so the agents of a conversation share them through the response cache
+        return LanguageModel(family=LLM.family, model=LLM.model, temperature=0)
+
+    def refresh(self, history: Optional[List[Dict[str, str]]], LLM: LanguageModel) -> None:
+        '''
+        Extends the summary if it is due. Call before building a prompt with render.
+        '''
+        pending = self._pending_summary(history)
+        if pending is not None:
+            target, prompt = pending
+            self.summary = self._summarizer(LLM).call_llm(prompt).strip()
+            self.summarized_turns = target
+
+    async def arefresh(self, history: Optional[List[Dict[str, str]]], LLM: LanguageModel) -> None:
+        '''
+        Async version of refresh.
+        '''
+        pending = self._pending_summary(history)
+        if pending is not None:
+            target, prompt = pending
+            self.summary = (await self._summarizer(LLM).acall_llm(prompt)).strip()
+            self.summarized_turns = target
+
+    def render(self, history: Optional[List[Dict[str, str]]]) -> Optional[str]:
+        '''
+        The conversation as it should appear in a prompt, or None to use the whole conversation as before.
+        '''
+        if not self.over_budget(history):
+            return None
+        budget = self.max_tokens - count_tokens(self.summary, self.model)
+        start = self.summarized_turns
+        # statements not in the summary yet are dropped oldest first if they don't fit, keeping at least the last one
+        while start < len(history) - 1 and sum(self.statement_tokens[start:]) > budget:
+            start += 1
+        recent = _render(history[start:])
+        if not self.summary:
+            return recent
+        return f"(summary of the earlier conversation: {self.summary}) {recent}"
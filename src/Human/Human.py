@@ -3,6 +3,7 @@ import time
 import inspect 
 import functools
 import json
+import re
 
 from collections import namedtuple
 
@@ -10,7 +11,10 @@ sys.path.append('../LLM')
 sys.path.append('../Serialization')
 
 from LLM import LanguageModel
+from JsonRepair import repair_json
 from Serialize import RegisteredSerializable
+from Transcript import Transcript
+from ConversationMemory import ConversationMemory
 
 def dict_to_string(d):
     s = []
@@ -24,6 +28,9 @@ def list_to_string(lst):
     # Check if lst is None and return an empty string
     if lst is None:
         return ""
+    # a Transcript has the string already rendered
+    if isinstance(lst, Transcript):
+        return lst.text
     
     strings = []
     for d in lst:
@@ -35,6 +42,13 @@ def list_to_string(lst):
 MemoryInput = namedtuple("MemoryInput", "args kwargs time")
 MemoryRecord = namedtuple("MemoryRecord", "function inputs output time")
 
+# cheap local signs that a statement closes the conversation, used to decide when to run the continue check
+FAREWELL_CUES = re.compile(r"\b(good ?bye|bye|farewell|take care|have a (nice|good|great) (day|evening|one)|see you|nice (talking|meeting|doing business)|pleasure (talking|doing business)|thank you for the conversation|it'?s a deal|we have a deal)\b", re.IGNORECASE)
+
+def said_farewell(statement):
+    """Returns True if the statement looks like someone ending the conversation"""
+    return FAREWELL_CUES.search(statement) is not None
+
 def is_yes(str):
     """Returns True if the string is some form of a yes""" 
     return "yes" in str.lower() in str.lower()
@@ -56,10 +70,7 @@ def remember(*memory_types):
     
     """
     def actual_decorator(func):
-        @functools.wraps(func)
-        def wrapper(self, *args, **kwargs):
-            inputs = MemoryInput(args, kwargs, time.time())
-            result = func(self, *args, **kwargs)
+        def store(self, inputs, result):
             record = MemoryRecord(func.__name__, inputs, result, time.time())
             
             for memory_type in memory_types:
@@ -69,7 +80,22 @@ def remember(*memory_types):
                     setattr(self.memory_locations, memory_type, memory_list)
                 else: 
                     raise ValueError("Invalid memory type. Refactor MemoryLocations class.")
-                
+
+        # coroutines are remembered once they have been awaited, not when the coroutine object is created
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                inputs = MemoryInput(args, kwargs, time.time())
+                result = await func(self, *args, **kwargs)
+                store(self, inputs, result)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            inputs = MemoryInput(args, kwargs, time.time())
+            result = func(self, *args, **kwargs)
+            store(self, inputs, result)
             return result
         return wrapper
     return actual_decorator
@@ -84,6 +110,8 @@ class Human(RegisteredSerializable):
         self.name = attributes['your name']
         #Memory of all things that an agent has said or another agent has said to it
         self.memory_locations = MemoryLocation()
+        # how much of the conversation goes into the prompts, see ConversationMemory
+        self.memory = ConversationMemory()
         try:
             _ = self._goal  # check to see if goal is defined
         except AttributeError:
@@ -93,9 +121,13 @@ class Human(RegisteredSerializable):
     def call_llm(self):
         raise NotImplementedError("This method gets implemented when you add an LLM")
 
+    async def acall_llm(self, prompt):
+        raise NotImplementedError("This method gets implemented when you add an LLM")
+
     def add_LLM(self, LLM):
         self.LLM = LLM
         self.call_llm = self.LLM.call_llm
+        self.acall_llm = self.LLM.acall_llm
 
     @staticmethod
     def public_knowledge(counterparty):
@@ -109,19 +141,25 @@ class Human(RegisteredSerializable):
             counterparty.attributes.items() if key in ["your role is", "your name"]]
 
     
+    def conversation_text(self, history = None):
+        '''
+        The conversation as it goes into the prompts: all of it, or a summary and the last statements once it is over the memory budget.
+        '''
+        remembered = self.memory.render(history)
+        return list_to_string(history) if remembered is None else remembered
+
     # @remember('complete')
     def current_context(self, history = None):
-        context = f"""In this conversation you are {self.attributes['your role is']} named {self.attributes['your name']} with the following characteristics: {dict_to_string(self.attributes)}.Here is the conversation in the scenario so far: {list_to_string(history)}.
+        context = f"""In this conversation you are {self.attributes['your role is']} named {self.attributes['your name']} with the following characteristics: {dict_to_string(self.attributes)}.Here is the conversation in the scenario so far: {self.conversation_text(history)}.
         """
         return context 
     
     @remember('complete')
     def final_context(self, group_knowledge, scenario_description, history):
         return f"""        
-        You are person with the following characteristics: {dict_to_string(self.attributes)}.You have just participated in this conversation: {list_to_string(history)}.  which was a simulation of this scenario {scenario_description}, and was with these other people: {group_knowledge}. During the conversation your goal was: "{self._goal}" and you had the following constraint: {self._constraint}
+        You are person with the following characteristics: {dict_to_string(self.attributes)}.You have just participated in this conversation: {self.conversation_text(history)}.  which was a simulation of this scenario {scenario_description}, and was with these other people: {group_knowledge}. During the conversation your goal was: "{self._goal}" and you had the following constraint: {self._constraint}
         """
-    @remember('complete')
-    def survey(self, counterparties, scenario_description, question, history, EXDOGENOUS, VARIABLE, OPERATIONALIZATION):
+    def survey_prompt(self, counterparties, scenario_description, question, history, EXDOGENOUS, VARIABLE, OPERATIONALIZATION):
         group_knowledge = [self.public_knowledge(counterparty) for counterparty in counterparties]
         context = self.final_context(group_knowledge, scenario_description, history)
         
@@ -134,16 +172,66 @@ class Human(RegisteredSerializable):
         Format your response as a json in this form and make sure that all keys and items are in double quotes correctly:{{"explanation": "short explanation for choice”, "answer": "your answer to the question do get the data for the analysis."}}.
         """
         # an auction for a single contract with many bidders
-        
+        return prompt
+
+    @remember('complete')
+    def survey(self, counterparties, scenario_description, question, history, EXDOGENOUS, VARIABLE, OPERATIONALIZATION):
+        self.memory.refresh(history, self.LLM)
+        prompt = self.survey_prompt(counterparties, scenario_description, question, history, EXDOGENOUS, VARIABLE, OPERATIONALIZATION)
         return self.call_llm(prompt)
 
+    @remember('complete')
+    async def asurvey(self, counterparties, scenario_description, question, history, EXDOGENOUS, VARIABLE, OPERATIONALIZATION):
+        await self.memory.arefresh(history, self.LLM)
+        prompt = self.survey_prompt(counterparties, scenario_description, question, history, EXDOGENOUS, VARIABLE, OPERATIONALIZATION)
+        return await self.acall_llm(prompt)
+
+
+    def multi_survey_prompt(self, counterparties, scenario_description, questions, history, EXDOGENOUS, OPERATIONALIZATION):
+        """Asks all the questions of questions ({question id: (question, variable)}) at once, so the context is sent once"""
+        group_knowledge = [self.public_knowledge(counterparty) for counterparty in counterparties]
+        context = self.final_context(group_knowledge, scenario_description, history)
+        question_texts = {question_id: question for question_id, (question, _) in questions.items()}
+        variables = {question_id: variable for question_id, (_, variable) in questions.items()}
+        
+        prompt = f"""{context}
+        Your task is to answer each of the following questions, keyed by id: {json.dumps(question_texts)}
+        When answering the questions, please keep the following things in mid:
+        1. You should base you answers frist on your personal characteristics provided to you and the past interactions you had in the simulated conversation.
+        2. This simulated conversation was run as an experiment to test the effects of changing different attributes on the {EXDOGENOUS}.
+        Your answer to each question will be directly used to operaionalize the measurement of a variable for data data analysis. These are the variables measured by the questions, keyed by id: {json.dumps(variables)}, which we originally chose to operationalize like this: {OPERATIONALIZATION}
+        You should try as hard as possibly to accurately answer each question within the context of your characteristics, conversation, and usage for analyzing the simulation, but if you truly cannot answer a question, you can say that you don't know.
+        Format your response as a json with one item per question id in this form and make sure that all keys and items are in double quotes correctly:{{"question id": {{"explanation": "short explanation for choice”, "answer": "your answer to the question do get the data for the analysis."}}}}.
+        """
+        return prompt
+
+    @remember('complete')
+    async def asurvey_many(self, counterparties, scenario_description, questions, history, EXDOGENOUS, OPERATIONALIZATION):
+        await self.memory.arefresh(history, self.LLM)
+        prompt = self.multi_survey_prompt(counterparties, scenario_description, questions, history, EXDOGENOUS, OPERATIONALIZATION)
+        return self.parse_survey_answers(await self.acall_llm(prompt, json_mode=True), questions)
+
+    @staticmethod
+    def parse_survey_answers(response, question_ids):
+        """
+        Splits the answer to several questions into one answer per question id, in the format of survey.
+        The questions missing from the response (or all of them, if it is not json) are left out.
+        """
+        try:
+            answers = json.loads(response)
+        except json.JSONDecodeError:
+            answers, _ = repair_json(response)
+        if not isinstance(answers, dict):
+            return {}
+        return {question_id: json.dumps(answers[question_id]) for question_id in question_ids
+                if isinstance(answers.get(question_id), dict) and 'answer' in answers[question_id]}
 
     def is_rational(self, statement, history= None):
         # return True
         pass
 
 
-    def make_public_statement(self, counterparties, scenario_description, round, n_left, history = None):
+    def public_statement_prompt(self, counterparties, scenario_description, round, n_left, history = None, decide_end = False):
         group_knowledge = [self.public_knowledge(counterparty) for counterparty in counterparties]
         # prompt = f"""
         # {self.current_context()}
@@ -165,19 +253,60 @@ Please remember that all information that you wish to communicate must be stated
 You should be concise and focus on accomplishing your goal within your constraints in the conversation with a minimal number of words.
 Provide your natural response to this conversation without any other text:
         """
-        
+        if decide_end:
+            # the speaker also says whether its statement ends the conversation, instead of a separate to_continue_or_to_finish call
+            prompt = prompt.replace("Provide your natural response to this conversation without any other text:", """Provide your natural response to this conversation, and decide whether the conversation is complete after your statement. The conversation is complete if the people are saying goodbye to each other and it is reasonable to end it like a normal conversation would end, otherwise it should continue.
+Format your response as a json in this form and make sure that all keys and items are in double quotes correctly: {"statement": "your natural response to the conversation", "conversation_complete": "yes or no"}""")
+        return prompt
+
+    def make_public_statement(self, counterparties, scenario_description, round, n_left, history = None):
+        self.memory.refresh(history, self.LLM)
+        prompt = self.public_statement_prompt(counterparties, scenario_description, round, n_left, history)
         # print("<<<<>>>>>", prompt)
         statement = self.call_llm(prompt)
         # is_rational = self.is_rational(statement, history)
         # return {'statement':statement, 'is_rational': is_rational}
         return {'statement':statement}
 
+    async def amake_public_statement(self, counterparties, scenario_description, round, n_left, history = None):
+        await self.memory.arefresh(history, self.LLM)
+        prompt = self.public_statement_prompt(counterparties, scenario_description, round, n_left, history)
+        statement = await self.acall_llm(prompt)
+        return {'statement':statement}
 
-    def to_continue_or_to_finish(self, scenario, agents,ENDOGENOUS_VARIABLES, OPERATIONALIZATION, history=None):
+    @staticmethod
+    def parse_statement_and_decision(response):
+        """Reads the statement and the end decision of make_public_statement_and_decision, a response that is not json is the statement"""
+        try:
+            decision = json.loads(response)
+        except json.JSONDecodeError:
+            decision, _ = repair_json(response)
+        if not isinstance(decision, dict) or 'statement' not in decision:
+            return {'statement': response.strip(), 'conversation_complete': False}
+        complete = decision.get('conversation_complete', False)
+        if not isinstance(complete, bool):
+            complete = str(complete).strip().lower() in ('yes', 'true', 'complete', '1')
+        return {'statement': str(decision['statement']), 'conversation_complete': complete}
+
+    def make_public_statement_and_decision(self, counterparties, scenario_description, round, n_left, history = None):
+        self.memory.refresh(history, self.LLM)
+        prompt = self.public_statement_prompt(counterparties, scenario_description, round, n_left, history, decide_end=True)
+        return self.parse_statement_and_decision(self.call_llm(prompt, json_mode=True))
+
+    async def amake_public_statement_and_decision(self, counterparties, scenario_description, round, n_left, history = None):
+        await self.memory.arefresh(history, self.LLM)
+        prompt = self.public_statement_prompt(counterparties, scenario_description, round, n_left, history, decide_end=True)
+        return self.parse_statement_and_decision(await self.acall_llm(prompt, json_mode=True))
+
+    def continue_or_finish_prompt(self, scenario, agents,ENDOGENOUS_VARIABLES, OPERATIONALIZATION, history=None):
         group_knowledge = [self.public_knowledge(agent) for agent in agents]
         prompt = f"""
         You are are a social scientist running a simulation of the following scenario: {scenario}. You are studying the behavior of these agents: {group_knowledge}. Here is the conversation between the agents so far: {history}. You must determine whether to continue or not based on what makes the most sense given the conversation so far.For example, if the agents seem like they are both mid-conversation, you should say continue. Conversely, if the agents are saying goodby to each other and it seems like it's reasonable to end the conversation like a normal conversation would end, then you should complete the conversation. Determine whether the conversation should continue or if is complete. Format your response as a json in this form and make sure that all keys and items are in double quotes correctly: {{"explanation": "short explanation for whether the simulation is complete or if it should continue","choice": "complete or continue"}}
         """
+        return prompt
+
+    def to_continue_or_to_finish(self, scenario, agents,ENDOGENOUS_VARIABLES, OPERATIONALIZATION, history=None):
+        prompt = self.continue_or_finish_prompt(scenario, agents, ENDOGENOUS_VARIABLES, OPERATIONALIZATION, history)
         
         response = self.call_llm(prompt)
         print(response)
@@ -186,6 +315,12 @@ Provide your natural response to this conversation without any other text:
         else:
             return False 
 
+    async def ato_continue_or_to_finish(self, scenario, agents,ENDOGENOUS_VARIABLES, OPERATIONALIZATION, history=None):
+        prompt = self.continue_or_finish_prompt(scenario, agents, ENDOGENOUS_VARIABLES, OPERATIONALIZATION, history)
+        response = await self.acall_llm(prompt)
+        print(response)
+        return "continue" in response.lower()
+
     
     def how_to_you_think_other_person_will_respond(self, question):
         pass
@@ -5,12 +5,12 @@ import random
 sys.path.append('./src/LLM')
 sys.path.append('./src/Serialization')
 
-from LLM import LanguageModel
+from LLM import LanguageModel, default_family
 from Serialize import RegisteredSerializable
 from Prompting import PromptMixin
 
 params = {
-    "family":"openai",
+    "family": default_family(),
     "model": "gpt-4", #"gpt-3.5-turbo", 
     "temperature":0.7   
 }
@@ -0,0 +1,218 @@
+import os
+import sys
+import asyncio
+import inspect
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+sys.path.append('./src/LLM')
+sys.path.append('./src/Serialization')
+sys.path.append('./src/Question')
+
+from LLM import LanguageModel, default_family
+from Human import Human, said_farewell
+from Transcript import Transcript
+from Interaction import SocialInteraction
+
+# How a Simulation decides that the conversation is over:
+# two-call: after every statement, a separate LLM call reads the conversation and says whether to continue
+# combined: the speaker returns its statement and whether the conversation is complete in one call
+# periodic: the separate call only runs every check_every turns, or right after a statement that says goodbye
+TURN_MODES = ["two-call", "combined", "periodic"]
+# Number of simulations LockstepRunner advances together, defaults to the number of async LLM calls allowed in flight
+BATCH_WINDOW: int = int(os.getenv('SIMULATION_BATCH_WINDOW', os.getenv('LLM_MAX_CONCURRENCY', 100)))
+
+
+class Simulation:
+    '''
+    The conversation of one design cell, advanced one statement at a time with step (or astep), until done.
+    The first step makes the opening statement, each following step makes one statement and decides whether
+    the conversation goes on, which ends it after max_interactions statements at most.
+
+    Args:
+        agentsInfo (dict): the attributes of each agent of the design cell, by agent type
+        order_dict (dict): the speaking order, see SocialInteraction.gen_func_dispatch
+        scenario (str): the scenario description
+        interaction_type (str): how the next speaker is picked, a key of SocialInteraction.gen_func_dispatch
+        ENDOGENOUS_VARIABLES (list): the outcome variables, passed on to the continue check
+        OPERATIONALIZATION (str, optional): how the variables are measured, passed on to the continue check
+        max_interactions (int): maximum number of statements
+        temp_subject (float): temperature of the agents' LLM
+        turn_mode (str): how the end of the conversation is decided, see TURN_MODES
+        check_every (int): in the 'periodic' turn mode, the number of turns between two continue checks
+    '''
+    def __init__(self, agentsInfo: Dict[str, Dict], order_dict: Dict, scenario: str, interaction_type: str,
+                 ENDOGENOUS_VARIABLES: List[str], OPERATIONALIZATION: Optional[str] = None, max_interactions: int = 20,
+                 temp_subject: float = 0.3, turn_mode: str = "two-call", check_every: int = 3) -> None:
+        if turn_mode not in TURN_MODES:
+            raise ValueError(f"Unknown turn mode {turn_mode}, choose one of {TURN_MODES}.")
+        LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_subject)
+
+        self.agents: Dict[str, Human] = {}
+        self.agent_list: List[Human] = []
+        for agent_type, attributes in agentsInfo.items():
+            agent = Human(attributes)
+            agent.add_LLM(LLM)
+            self.agents[agent_type] = agent
+            self.agent_list.append(agent)
+
+        self.scenario = scenario
+        self.ENDOGENOUS_VARIABLES = ENDOGENOUS_VARIABLES
+        self.OPERATIONALIZATION = OPERATIONALIZATION
+        self.max_interactions = max_interactions
+        self.turn_mode = turn_mode
+        self.check_every = max(1, check_every)
+        # renders each statement once for the prompts of the following turns
+        self.history = Transcript()
+
+        # intialize the Interaction
+        self.interaction = SocialInteraction(self.agent_list, scenario=scenario)
+        self.interaction.add_LLM(LLM)
+        self.generator = self.interaction.gen_func_dispatch[interaction_type](order_dict)
+        # determine the order
+        self.speaker: Human = self.agents[next(self.generator)]
+        self.next_speaker: Human = self.agents[next(self.generator)]
+        self.interactions = 0
+        self.n_left = max_interactions
+        self.started = False
+        self.done = False
+
+    def _others(self) -> List[Human]:
+        return [agent for agent in self.agent_list if agent != self.speaker]
+
+    def _opening_args(self) -> tuple:
+        self.started = True
+        return self._others(), self.scenario, self.interactions, self.n_left, self.history
+
+    def _turn_args(self) -> tuple:
+        self.interactions += 1
+        self.n_left -= 1
+        self.speaker = self.next_speaker
+        return self._others(), self.scenario, self.interactions, self.n_left, self.history
+
+    def _say(self, statement: Dict) -> None:
+        print(f"No.{self.interactions}", self.speaker.name, ":", statement['statement'])
+        self.interaction.statements.append({self.speaker.name: statement['statement']})
+        self.history.append({self.speaker.name: statement['statement']})
+
+    def _needs_check(self, statement: Dict) -> bool:
+        '''
+        Whether the separate continue-or-finish call has to run after this statement.
+        '''
+        if self.turn_mode == "combined":
+            return False
+        if self.turn_mode == "periodic":
+            return self.interactions % self.check_every == 0 or said_farewell(statement['statement'])
+        return True
+
+    def _check_args(self) -> tuple:
+        return self.scenario, self.agent_list, self.ENDOGENOUS_VARIABLES, self.OPERATIONALIZATION, self.history
+
+    def _end_turn(self, to_continue: bool) -> None:
+        # Determine the ending condition
+        if not to_continue:
+            print('Ending condition is reached!')
+            self.done = True
+        elif self.interactions >= self.max_interactions - 1:
+            self.done = True
+
+    def step(self) -> None:
+        '''
+        Makes the next statement of the conversation.
+        '''
+        if not self.started:
+            ## Make first statement
+            self._say(self.speaker.make_public_statement(*self._opening_args()))
+            return
+        # the speaker changes in _turn_args, so the arguments come first
+        args = self._turn_args()
+        if self.turn_mode == "combined":
+            statement = self.speaker.make_public_statement_and_decision(*args)
+        else:
+            statement = self.speaker.make_public_statement(*args)
+        self.next_speaker = self.agents[next(self.generator)]
+        self._say(statement)
+        if self._needs_check(statement):
+            to_continue = self.speaker.to_continue_or_to_finish(*self._check_args())
+        else:
+            to_continue = not statement.get('conversation_complete', False)
+        self._end_turn(to_continue)
+
+    async def astep(self) -> None:
+        '''
+        Async version of step.
+        '''
+        if not self.started:
+            self._say(await self.speaker.amake_public_statement(*self._opening_args()))
+            return
+        # the speaker changes in _turn_args, so the arguments come first
+        args = self._turn_args()
+        if self.turn_mode == "combined":
+            statement = await self.speaker.amake_public_statement_and_decision(*args)
+        else:
+            statement = await self.speaker.amake_public_statement(*args)
+        # the oracle interaction types call the LLM to pick the next speaker, off the event loop
+        self.next_speaker = self.agents[await asyncio.to_thread(next, self.generator)]
+        self._say(statement)
+        if self._needs_check(statement):
+            to_continue = await self.speaker.ato_continue_or_to_finish(*self._check_args())
+        else:
+            to_continue = not statement.get('conversation_complete', False)
+        self._end_turn(to_continue)
+
+    def run(self) -> Transcript:
+        '''
+        Runs the conversation to its end and returns its history.
+        '''
+        while not self.done:
+            self.step()
+        return self.history
+
+
+class LockstepRunner:
+    '''
+    Runs many simulations in one process: every tick advances each active simulation by one statement, with the
+    LLM calls of the tick in flight together on one event loop. Finished simulations are retired and queued ones
+    admitted, so window conversations are always in progress and throughput follows the API quota rather than
+    the number of worker processes.
+
+    Args:
+        window (int): number of simulations in progress at once
+    '''
+    def __init__(self, window: int = BATCH_WINDOW) -> None:
+        if window < 1:
+            raise ValueError("The simulation window must be at least 1.")
+        self.window = window
+
+    async def arun(self, combined_dicts: List[Dict], on_done: Optional[Callable[[int, Transcript], None]] = None,
+                   **params) -> List[Transcript]:
+        '''
+        Simulates every design cell and returns the histories in the order of combined_dicts.
+
+        Args:
+            combined_dicts (list): the agentsInfo of each design cell
+            on_done (callable, optional): called with the index and history of each simulation when it ends, awaited if it returns an awaitable
+            **params: the other arguments of Simulation, the same for every design cell
+        '''
+        queue = deque(enumerate(combined_dicts))
+        active: Dict[int, Simulation] = {}
+        histories: List[Optional[Transcript]] = [None] * len(combined_dicts)
+        while queue or active:
+            while queue and len(active) < self.window:
+                index, agentsInfo = queue.popleft()
+                active[index] = Simulation(agentsInfo, **params)
+            await asyncio.gather(*(simulation.astep() for simulation in active.values()))
+            for index in [index for index, simulation in active.items() if simulation.done]:
+                histories[index] = active.pop(index).history
+                if on_done is not None:
+                    result = on_done(index, histories[index])
+                    if inspect.isawaitable(result):
+                        await result
+        return histories
+
+    def run(self, combined_dicts: List[Dict], on_done: Optional[Callable[[int, Transcript], None]] = None,
+            **params) -> List[Transcript]:
+        '''
+        Runs arun on a new event loop.
+        '''
+        return asyncio.run(self.arun(combined_dicts, on_done=on_done, **params))
@@ -0,0 +1,72 @@
+from typing import Dict, Iterable
+
+
+class Transcript(list):
+    '''
+    The conversation history of a simulation: a list of {speaker: statement} dicts that renders each statement once.
+    Prompts need the whole conversation every turn, both as the "speaker: statement" text used by Human.current_context
+    and as the list itself interpolated into prompts. Both renderings are extended when a statement is appended,
+    so a turn only renders its new statement instead of the whole history.
+    Any other change to the list (insert, item assignment, removal, sorting) re-renders it from scratch.
+
+    Args:
+        statements (iterable, optional): the statements to start with
+    '''
+    def __init__(self, statements: Iterable[Dict[str, str]] = ()) -> None:
+        super().__init__()
+        self._text: str = ''
+        self._repr_body: str = ''
+        self.extend(statements)
+
+    def append(self, statement: Dict[str, str]) -> None:
+        super().append(statement)
+        rendered = ''.join(f"{key}: {value}" for key, value in statement.items())
+        self._text += rendered
+        self._repr_body += repr(statement) if len(self) == 1 else ', ' + repr(statement)
+
+    def extend(self, statements: Iterable[Dict[str, str]]) -> None:
+        for statement in statements:
+            self.append(statement)
+
+    def __iadd__(self, statements: Iterable[Dict[str, str]]) -> 'Transcript':
+        self.extend(statements)
+        return self
+
+    @property
+    def text(self) -> str:
+        '''
+        The conversation as "speaker: statement" strings joined together, same as Human.list_to_string.
+        '''
+        return self._text
+
+    def __repr__(self) -> str:
+        return '[' + self._repr_body + ']'
+
+    def __reduce__(self):
+        # pickled as its statements, so it can be returned from worker processes
+        return (self.__class__, (list(self),))
+
+    def _rerender(self) -> None:
+        statements = list(self)
+        super().clear()
+        self._text, self._repr_body = '', ''
+        self.extend(statements)
+
+    def _rerendering(method_name):
+        method = getattr(list, method_name)
+        def wrapper(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            self._rerender()
+            return result
+        wrapper.__name__ = method_name
+        return wrapper
+
+    __setitem__ = _rerendering('__setitem__')
+    __delitem__ = _rerendering('__delitem__')
+    insert = _rerendering('insert')
+    pop = _rerendering('pop')
+    remove = _rerendering('remove')
+    clear = _rerendering('clear')
+    sort = _rerendering('sort')
+    reverse = _rerendering('reverse')
+    del _rerendering
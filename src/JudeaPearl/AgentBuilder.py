@@ -9,7 +9,8 @@ sys.path.append('../LLM')
 sys.path.append('../Serialization')
 sys.path.append('../Question')
 
-from LLM import LanguageModel, llm_json_loader
+from LLM import LanguageModel, LLMMixin
+from ResponseSchema import response_schema
 from Serialize import RegisteredSerializable
 from Variable import ExogenousVariable, EndogenousVariable, Variable, retry_on_keyerror_decorator
 from Prompting import PromptMixin
@@ -21,7 +22,7 @@ class NotAddedError(Exception):
     '''
     pass
 
-class AgentBuilder(PromptMixin, RegisteredSerializable):
+class AgentBuilder(PromptMixin, LLMMixin, RegisteredSerializable):
     def __init__(self, template_dir: str ="prompt_templates"):
         '''
         Initializes an AgentBuilder instance.
@@ -226,8 +227,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
                     "previous_prompt": prompt
                     }
         prompt = self.generate_prompt("REP_prompt.txt", template_dir = self.template_dir, **prompt_params)
-        raw_output = self.call_llm(prompt)
-        return llm_json_loader(raw_output)
+        return self.call_llm_json(prompt, schema=response_schema("REP_prompt.txt", self.template_dir))
     
 
 
@@ -253,8 +253,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
             "agent_roles": self.agent_list
         }
         prompt = self.generate_prompt("get_name.txt", template_dir = self.template_dir, **prompt_params)
-        raw_output = self.call_llm(prompt)
-        name_dict = llm_json_loader(raw_output)
+        name_dict = self.call_llm_json(prompt, schema=response_schema("get_name.txt", self.template_dir))
         names = name_dict['names']
         for name, agent in zip(names, self.agent_list):
             self.agent_dict[agent] = {'your name': name, **self.agent_dict[agent]}
@@ -276,8 +275,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
                     "agent": agent
                     }
         prompt = self.generate_prompt("get_agent_goals.txt", template_dir = self.template_dir, **prompt_params)
-        raw_output = self.call_llm(prompt)
-        goal = llm_json_loader(raw_output)
+        goal = self.call_llm_json(prompt, schema=response_schema("get_agent_goals.txt", self.template_dir))
         self.agent_dict[agent]['goal'] = goal['goal']
         self.explanations_dict['goal'] = goal['explanation']
         return goal
@@ -297,8 +295,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
                     "goal": self.agent_dict[agent]['goal']
                     }
         prompt = self.generate_prompt("get_agent_constraints.txt", template_dir = self.template_dir, **prompt_params)
-        raw_output = self.call_llm(prompt)
-        constraint = llm_json_loader(raw_output)
+        constraint = self.call_llm_json(prompt, schema=response_schema("get_agent_constraints.txt", self.template_dir))
         self.agent_dict[agent]['constraint'] = constraint['constraint']
         self.explanations_dict['constraint'] = constraint['explanation']
         return constraint
@@ -357,8 +354,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
                     }
         
         prompt = self.generate_prompt("get_necessary_info.txt", template_dir = self.template_dir, **prompt_params)
-        raw_output = self.call_llm(prompt)
-        info = llm_json_loader(raw_output)
+        info = self.call_llm_json(prompt, schema=response_schema("get_necessary_info.txt", self.template_dir))
         self.necessary_agent_info[agent] = info['information']
         self.explanations_dict['get_necessary_info'] = info['explanation']
 
@@ -386,8 +382,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
                     }
         
         prompt = self.generate_prompt("info_to_attributes.txt", template_dir = self.template_dir, **prompt_params)
-        raw_output = self.call_llm(prompt)
-        info_attributes = llm_json_loader(raw_output)
+        info_attributes = self.call_llm_json(prompt, schema=response_schema("info_to_attributes.txt", self.template_dir))
         #double check prompt
         info_attributes = self.REP_prompt(prompt, info_attributes)
         for index, attribute in enumerate(info_attributes['information']):
@@ -423,8 +418,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
                 "attribute_values": self.necessary_agent_attributes[agent].values()
             }
             prompt = self.generate_prompt("check_info_mismatch.txt", template_dir = self.template_dir, **prompt_params)
-            raw_output = self.call_llm(prompt)
-            checked_attributes = llm_json_loader(raw_output)
+            checked_attributes = self.call_llm_json(prompt, schema=response_schema("check_info_mismatch.txt", self.template_dir))
             for index, attribute in enumerate(checked_attributes['attributes']):
                 self.agent_dict[agent][attribute] = checked_attributes['values'][index]
                 self.necessary_agent_attributes[agent][attribute] = checked_attributes['values'][index]
@@ -554,8 +548,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
                     "relevant_agents": self.agent_list
                     }
         prompt = self.generate_prompt("get_interaction_type.txt", template_dir = self.template_dir, **prompt_params)
-        raw_output = self.call_llm(prompt)
-        interaction_dict = llm_json_loader(raw_output)
+        interaction_dict = self.call_llm_json(prompt, schema=response_schema("get_interaction_type.txt", self.template_dir))
         self.interaction_type = interaction_dict['interaction_type']
         self.explanations_dict['explanation'] = interaction_dict['explanation']
 
@@ -569,8 +562,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
                     "relevant_agents": self.agent_list
                     }
         prompt = self.generate_prompt("get_center_agent_no_order.txt", template_dir = self.template_dir, **prompt_params)
-        raw_output = self.call_llm(prompt)
-        order_dict = llm_json_loader(raw_output)
+        order_dict = self.call_llm_json(prompt, schema=response_schema("get_center_agent_no_order.txt", self.template_dir))
         # no order for this interaction type, just returning the agents list for kehang
         self.order_dict['order'] = self.agent_list
         self.order_dict['central agent'] = order_dict['central agent']
@@ -586,8 +578,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
                     "relevant_agents": self.agent_list
                     }
         prompt = self.generate_prompt("get_center_agent_ordered.txt", template_dir = self.template_dir, **prompt_params)
-        raw_output = self.call_llm(prompt)
-        order_dict = llm_json_loader(raw_output)
+        order_dict = self.call_llm_json(prompt, schema=response_schema("get_center_agent_ordered.txt", self.template_dir))
         self.order_dict['order'] = order_dict['order']
         self.order_dict['central agent'] = order_dict['central agent']
         self.explanations_dict['explanation'] = order_dict['explanation']
@@ -603,8 +594,7 @@ class AgentBuilder(PromptMixin, RegisteredSerializable):
                     "relevant_agents": self.agent_list
                     }
         prompt = self.generate_prompt("get_agent_order.txt", template_dir = self.template_dir, **prompt_params)
-        raw_output = self.call_llm(prompt)
-        order_dict = llm_json_loader(raw_output)
+        order_dict = self.call_llm_json(prompt, schema=response_schema("get_agent_order.txt", self.template_dir))
         self.order_dict['order'] = order_dict['order']
         # no central agent for this interaction type
         self.order_dict['central agent'] = []
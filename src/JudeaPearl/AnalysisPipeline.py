@@ -0,0 +1,113 @@
+import os
+import sys
+import copy
+import json
+from typing import Dict, Optional
+
+import pandas as pd
+
+sys.path.append("./src/LLM")
+
+from LLM import LanguageModel
+from DataParser import DataParser
+from DataCleaner import DataCleaner
+from DataAnalyst import DataAnalyst
+
+
+class AnalysisPipeline:
+    """
+    This class runs the analysis of the experimental results: DataParser, DataCleaner, then DataAnalyst.
+    The data frames and dictionaries are handed from one stage to the next in memory, so they keep their types,
+    and the outputs are only written once, by save, after the data is cleaned. Each stage gets its own copy of the
+    meta data, as it did when reading meta_data.json, since the cleaner changes the SCM structure in place.
+
+    Args:
+        interaction_data (Dict[str, Dict]): The results of the experiment, with the SCM, the data and the attribute value mapping.
+        LLM (LanguageModel): The LLM of the data parser.
+        template_dir (str): The prompt templates of the data parser.
+    """
+
+    def __init__(
+        self,
+        interaction_data: Dict[str, Dict],
+        LLM: LanguageModel,
+        template_dir: str = "prompt_templates",
+    ) -> None:
+        self.interaction_data = interaction_data
+        self.data_parser = DataParser(interaction_data, template_dir=template_dir)
+        self.data_parser.add_LLM(LLM)
+        self.data_cleaner: Optional[DataCleaner] = None
+        self.scm_simple: Optional[Dict[str, Dict]] = None
+
+    def parse(self) -> pd.DataFrame:
+        """
+        Parses the interactions into the raw data frame and gathers its meta data.
+        """
+        self.data_parser.get_data_from_interactions()
+        self.data_parser.gather_meta_data()
+        # a column no interaction has data for is left as objects, numbers are what the cleaner expects
+        self.data_parser.data_frame = self.data_parser.data_frame.infer_objects()
+        return self.data_parser.data_frame
+
+    def clean(self) -> pd.DataFrame:
+        """
+        Builds the final data frame, with the interaction columns and the short variable names, from the raw data frame.
+        """
+        # the cleaner adds the interaction columns to the data frame it is given, the raw data frame is kept as is
+        self.data_cleaner = DataCleaner(
+            self.interaction_data,
+            self.data_parser.data_frame.copy(),
+            copy.deepcopy(self.data_parser.meta_data),
+        )
+        self.data_cleaner.generate_final_df()
+        self.scm_simple = json.loads(self.data_cleaner.scm.backend_scm_to_json())
+        return self.data_cleaner.final_df_interactions
+
+    def save(self, path: str) -> None:
+        """
+        Writes the outputs of the parser and the cleaner, the csv and json files listed in the README, and all of them
+        with their types in analysis_data.pkl, which pandas.read_pickle loads back.
+        """
+        self.data_parser.write_data(path)
+        self.data_cleaner.save_data(path)
+        pd.to_pickle(
+            {
+                "raw_data": self.data_parser.data_frame,
+                "meta_data": self.data_parser.meta_data,
+                "data": self.data_cleaner.final_df_interactions,
+                "mapped_data": self.data_cleaner.final_mapped_df,
+                "final_mapping": self.data_cleaner.variable_mapping,
+                "final_edge_dict": self.data_cleaner.final_edge_dict,
+                "scm_simple": self.scm_simple,
+            },
+            os.path.join(path, "analysis_data.pkl"),
+        )
+
+    def analyze(self, path: str, **kwargs) -> DataAnalyst:
+        """
+        Estimates the SCM and writes the latex outputs to path.
+        The estimation script reads mapped_data.csv from path, so the data has to be saved there first.
+
+        Args:
+            path (str): The directory of the saved data and of the outputs.
+            **kwargs: The options of DataAnalyst.analyze_data.
+        """
+        data_analyst = DataAnalyst(
+            self.data_cleaner.final_df_interactions.copy(),
+            copy.deepcopy(self.data_parser.meta_data),
+            copy.deepcopy(self.data_cleaner.variable_mapping),
+            copy.deepcopy(self.data_cleaner.final_edge_dict),
+            self.interaction_data,
+            self.scm_simple,
+        )
+        data_analyst.analyze_data(path, final_output_dir=path, **kwargs)
+        return data_analyst
+
+    def run(self, path: str, **kwargs) -> DataAnalyst:
+        """
+        Parses, cleans, saves and analyzes the data. Stops after saving if the data has no variance to estimate the SCM from.
+        """
+        self.parse()
+        self.clean()
+        self.save(path)
+        return self.analyze(path, **kwargs)
@@ -1,6 +1,6 @@
 import sys
 import json
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Optional
 import os
 import numpy as np
 import pandas as pd
@@ -11,7 +11,7 @@ sys.path.append("../JudeaPearl")
 sys.path.append("../LLM")
 from Variable import EndogenousVariable, Variable
 from StructuralCausalModelBuilder import StructuralCausalModelBuilder
-from LLM import LanguageModel, LLMMixin, llm_json_loader
+from LLM import LanguageModel, LLMMixin, llm_json_loader, default_family
 
 
 class RaiseCategoricalVariableError(Exception):
@@ -38,11 +38,16 @@ class DataCleaner(LLMMixin):
         interaction_data: Dict[str, Dict],
         cleaned_data: pd.DataFrame,
         meta_data: Dict,
-        LLM=LanguageModel(family="openai", model="gpt-4", temperature=0.1),
+        LLM: Optional[LanguageModel] = None,
     ) -> None:
         # Initialize the Structural Causal Model (SCM)
         self.scm = self._initialize_scm(interaction_data["scm"])
-        self.LLM = LLM
+        # created here rather than as a default argument so the family follows LLM_FAMILY at run time
+        self.LLM = (
+            LLM
+            if LLM is not None
+            else LanguageModel(family=default_family(), model="gpt-4", temperature=0.1)
+        )
 
         # Extract interaction data and attribute-value mapping from the SCM interaction data
         self.interaction_data = interaction_data["data"]
@@ -253,6 +258,7 @@ class DataCleaner(LLMMixin):
         self.variable_mapping = self.generate_variable_mapping(
             self.final_df.columns.values
         )
+        self.final_mapped_df = self.final_df.rename(columns=self.variable_mapping)
 
     def save_data(self, path=None):
         """
@@ -264,7 +270,6 @@ class DataCleaner(LLMMixin):
         # if yes, raise an error
 
         self.final_df_interactions.to_csv(os.path.join(path, "data.csv"), index=False)
-        self.final_mapped_df = self.final_df.rename(columns=self.variable_mapping)
         self.final_mapped_df.to_csv(os.path.join(path, "mapped_data.csv"), index=False)
         # save final mapping dictionary
         with open(os.path.join(path, "final_mapping.json"), "w") as f:
@@ -275,8 +280,12 @@ class DataCleaner(LLMMixin):
         self.scm.scm_to_json("", os.path.join(path, "scm_simple.json"))
 
         # after saving the data, check if the data is informative, otherwise raise an error
-        # check if the final_df_interactions has 0 variance in any columns
-        # if yes, raise an error
+        self.check_variance()
+
+    def check_variance(self):
+        """
+        Exits if the final data frame has 0 variance in any columns, as the SCM cannot be estimated from it.
+        """
         if self.final_df_interactions.columns[
             self.final_df_interactions.var() == 0
         ].any():
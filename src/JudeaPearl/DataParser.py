@@ -2,7 +2,7 @@ import sys
 import json
 from typing import List, Dict, Tuple, Union, Optional, Any, Callable
 import os
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 import re
 import pandas as pd
 import numpy as np
@@ -13,7 +13,8 @@ sys.path.append("./src/LLM")
 sys.path.append("./src/Serialization")
 sys.path.append("./src/Question")
 
-from LLM import LanguageModel, llm_json_loader, LLMMixin
+from LLM import LanguageModel, LLMMixin
+from ResponseSchema import response_schema
 from Serialize import RegisteredSerializable
 from Variable import (
     Variable,
@@ -23,7 +24,16 @@ from Variable import (
 )
 from Prompting import PromptMixin
 from StructuralCausalModelBuilder import StructuralCausalModelBuilder
+from FastParser import fast_parse, fast_parse_stats
 
+# Number of interactions parsed at the same time, the parsing is made of LLM calls so it runs in threads
+PARSE_CONCURRENCY: int = int(os.getenv("PARSE_CONCURRENCY", 8))
+# Whether answers that are plainly a number, a level or a yes/no are parsed without asking the LLM
+FAST_PARSE: bool = os.getenv("DATA_FAST_PARSE", "on").lower() not in ("off", "false", "0", "no")
+# Number of answers to the same question of the same agent parsed in one prompt, 0 or 1 parses them one by one
+PARSE_BATCH_SIZE: int = int(os.getenv("DATA_PARSE_BATCH_SIZE", 0))
+# the number in the attribute value of a continuous or count variable, like the 10 of "10 dollars"
+NUMBER_PATTERN = re.compile(r"\d+")
 
 class SetEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -66,6 +76,13 @@ class DataParser(PromptMixin, LLMMixin, RegisteredSerializable):
 
         self.explanations_dict = {}
 
+        # values of the answers already parsed, by (variable name, agent, question, answer), see parse_answers_in_batches
+        self.parsed_answers: Dict[Tuple[str, str, str, str], Union[float, int]] = {}
+        # aggregation method of each variable measured by more than one question, see resolve_aggregation_methods
+        self.aggregation_methods: Dict[str, str] = {}
+        # value of each attribute value already parsed, by (variable name, attribute value)
+        self.exogenous_values: Dict[Tuple[str, str], Union[float, int]] = {}
+
     def _initialize_scm(self, scm_interaction_data: Dict[str, Dict]):
         """
         Initialize the SCM based on the provided interaction data.
@@ -188,23 +205,63 @@ class DataParser(PromptMixin, LLMMixin, RegisteredSerializable):
         """
         This function parses the exogenous data from the interaction data.
         """
-        variable = self.scm.variable_dict[var_name]
         raw_data = self.attribute_value_mapping[interaction_num][var_name]
+        return self.exogenous_value(var_name, raw_data)
+
+    def exogenous_value(self, var_name: str, raw_data: str) -> Union[float, int]:
+        """
+        This function parses an attribute value of an exogenous variable, once per variable and attribute value.
+        """
+        key = (var_name, raw_data)
+        if key in self.exogenous_values:
+            return self.exogenous_values[key]
+
+        variable = self.scm.variable_dict[var_name]
         if variable.variable_type == "continuous":
-            data_single = float(re.findall(r"\d+", raw_data)[0])
+            data_single = float(NUMBER_PATTERN.search(raw_data).group())
         elif variable.variable_type == "count":
-            data_single = int(re.findall(r"\d+", raw_data)[0])
+            data_single = int(NUMBER_PATTERN.search(raw_data).group())
         elif variable.variable_type in ("nominal", "binary", "ordinal"):
             level_match = self.level_variation_dict[var_name][raw_data]
             data_single = self.level_value_dict[var_name][level_match]
         else:
             raise ValueError(f"Unknown variable type: {variable.variable_type}")
-        print(f"{variable.name}: ", data_single)
+        self.exogenous_values[key] = data_single
         return data_single
 
-    def aggregate_multiple_data(self, var_name: str, survey: Dict) -> Union[float, int]:
+    def exogenous_columns(self, interaction_nums: List[str]) -> Dict[str, np.ndarray]:
         """
-        This function aggregates data from multiple questions per variable.
+        This function builds the columns of the exogenous variables for the given interactions from attribute_value_mapping.
+        The design only has a few distinct attribute values per variable, so each of them is parsed once and the columns are filled by indexing.
+
+        Args:
+            interaction_nums (List[str]): The interaction numbers of the rows, in order.
+        """
+        mappings = [self.attribute_value_mapping[num] for num in interaction_nums]
+        var_names = dict.fromkeys(
+            var_name for mapping in mappings for var_name in mapping
+        )
+
+        columns = {}
+        for var_name in var_names:
+            # codes index the distinct attribute values, -1 where the interaction doesn't set the variable
+            codes, raw_values = pd.factorize(
+                pd.Series([mapping.get(var_name) for mapping in mappings], dtype=object)
+            )
+            values = np.array(
+                [self.exogenous_value(var_name, raw_data) for raw_data in raw_values]
+            )
+            if (codes < 0).any():
+                columns[var_name] = np.where(
+                    codes >= 0, values.astype(float)[codes], np.nan
+                )
+            else:
+                columns[var_name] = values[codes]
+        return columns
+
+    def measure_multiple_data(self, var_name: str, survey: Dict) -> List[Union[float, int]]:
+        """
+        This function parses the data from multiple questions per variable, one value per question, before aggregation.
         """
         variable = self.scm.variable_dict[var_name]
         raw_data = []
@@ -217,11 +274,15 @@ class DataParser(PromptMixin, LLMMixin, RegisteredSerializable):
                 )
                 raw_data.append(data_single)
 
-        aggregation = self.get_aggregation_method(variable, raw_data)
-
-        data_to_clean = [i for i in raw_data if not math.isnan(i)]
+        return raw_data
 
-        return self.mechanistic_aggregation(data_to_clean, aggregation)
+    def aggregate_multiple_data(self, var_name: str, survey: Dict) -> Union[float, int]:
+        """
+        This function aggregates data from multiple questions per variable.
+        """
+        return self.aggregate_measurements(
+            var_name, [self.measure_multiple_data(var_name, survey)]
+        )[0]
 
     @retry_on_keyerror_decorator
     def parse_single_question(
@@ -229,7 +290,18 @@ class DataParser(PromptMixin, LLMMixin, RegisteredSerializable):
     ) -> Union[float, int]:
         """
         This function parses the data from a survey questions and returns a single value for the variable.
+        Unambiguous answers are parsed by rule (see FastParser.fast_parse), the others are sent to the LLM.
         """
+        key = self._answer_key(variable.name, agent, question, answer)
+        if key in self.parsed_answers:
+            return self.parsed_answers[key]
+        if FAST_PARSE:
+            data_single = fast_parse(
+                variable.variable_type, answer, self.level_value_dict[variable.name]
+            )
+            if data_single is not None:
+                return data_single
+
         if agent == "oracle":
             agent = "the oracle, an additional agent who can read the transcript of the interaction and answer questions about the scenario"
 
@@ -257,9 +329,15 @@ class DataParser(PromptMixin, LLMMixin, RegisteredSerializable):
         prompt = self.generate_prompt(
             prompt_template, template_dir=self.template_dir, **prompt_params
         )
-        raw_output = self.call_llm(prompt)
-        data_dict = llm_json_loader(raw_output)
-        answer = data_dict["answer"]
+        data_dict = self.call_llm_json(
+            prompt, schema=response_schema(prompt_template, self.template_dir)
+        )
+        return self._to_data_point(variable, data_dict["answer"])
+
+    def _to_data_point(self, variable: Variable, answer: str) -> Union[float, int]:
+        """
+        This function converts the value extracted by the LLM into the data point of the variable.
+        """
         if answer == "na":
             return np.NaN
 
@@ -268,13 +346,124 @@ class DataParser(PromptMixin, LLMMixin, RegisteredSerializable):
             return (
                 float(answer) if variable.variable_type == "continuous" else int(answer)
             )
-        except ValueError:
+        except (ValueError, TypeError):
             return np.NaN
 
+    @staticmethod
+    def _answer_key(
+        var_name: str, agent: str, question: str, answer: str
+    ) -> Tuple[str, str, str, str]:
+        return var_name, agent, question, str(answer)
+
     @retry_on_keyerror_decorator
-    def get_aggregation_method(self, variable: Variable, measurements: List) -> Dict:
+    def parse_answer_batch(
+        self, variable: Variable, question: str, answers: List[str], agent: str
+    ) -> Dict[int, Union[float, int]]:
         """
-        This function gets the aggregation method for a variable.
+        This function parses the answers of one agent to the same survey question in different interactions with a single prompt.
+
+        Returns:
+            The value of each answer by its index in answers. The answers missing from the response are left out.
+        """
+        if agent == "oracle":
+            agent = "the oracle, an additional agent who can read the transcript of the interaction and answer questions about the scenario"
+
+        prompt = self.generate_prompt(
+            "get_data_batch.txt",
+            template_dir=self.template_dir,
+            scenario_description=self.scenario_description,
+            variable_name=variable.name,
+            variable_type=variable.variable_type,
+            relevant_agents=self.agent_list,
+            agent=agent,
+            question=question,
+            answers=json.dumps(
+                [{"index": index, "answer": answer} for index, answer in enumerate(answers)]
+            ),
+            levels=variable.levels,
+            level_values=list(self.level_value_dict[variable.name].values()),
+        )
+        data_dict = self.call_llm_json(
+            prompt, schema=response_schema("get_data_batch.txt", self.template_dir)
+        )
+
+        values = {}
+        for item in data_dict["answers"]:
+            if not isinstance(item, dict) or "answer" not in item:
+                continue
+            try:
+                index = int(item.get("index"))
+            except (ValueError, TypeError):
+                continue
+            if 0 <= index < len(answers):
+                values[index] = self._to_data_point(variable, item["answer"])
+        return values
+
+    def parse_answers_in_batches(
+        self, batch_size: Optional[int] = None, max_workers: Optional[int] = None
+    ) -> None:
+        """
+        This function parses the survey answers of all the interactions before they are processed, batch_size answers to the same question per prompt.
+        The answers the batches miss are parsed one by one by parse_single_question.
+
+        Args:
+            batch_size (int, optional): The number of answers per prompt. Defaults to PARSE_BATCH_SIZE.
+            max_workers (int, optional): The number of prompts sent at the same time. Defaults to PARSE_CONCURRENCY.
+        """
+        if batch_size is None:
+            batch_size = PARSE_BATCH_SIZE
+        if batch_size < 1:
+            raise ValueError(
+                f"The parse batch size must be at least 1, got {batch_size}. Pass batch_size or set DATA_PARSE_BATCH_SIZE."
+            )
+        # the distinct answers left to the LLM, by (variable name, agent, question)
+        pending: Dict[Tuple[str, str, str], List[str]] = {}
+        seen = set(self.parsed_answers)
+        for interaction in self.interaction_data.values():
+            if not interaction:
+                continue
+            for var_name, survey in interaction["survey"].items():
+                variable = self.scm.variable_dict[var_name]
+                for agent, questions in survey.items():
+                    for question, answer_str in questions.items():
+                        answer = json.loads(answer_str)["answer"]
+                        key = self._answer_key(var_name, agent, question, answer)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        data_single = (
+                            fast_parse(variable.variable_type, answer, self.level_value_dict[var_name])
+                            if FAST_PARSE
+                            else None
+                        )
+                        if data_single is not None:
+                            self.parsed_answers[key] = data_single
+                        else:
+                            pending.setdefault(key[:3], []).append(answer)
+
+        batches = [
+            (var_name, agent, question, answers[start : start + batch_size])
+            for (var_name, agent, question), answers in pending.items()
+            for start in range(0, len(answers), batch_size)
+        ]
+
+        def parse_batch(batch):
+            var_name, agent, question, answers = batch
+            values = self.parse_answer_batch(
+                self.scm.variable_dict[var_name], question, answers, agent
+            )
+            for index, data_single in values.items():
+                self.parsed_answers[
+                    self._answer_key(var_name, agent, question, answers[index])
+                ] = data_single
+
+        with ThreadPoolExecutor(max_workers=max_workers or PARSE_CONCURRENCY) as executor:
+            list(executor.map(parse_batch, batches))
+
+    @retry_on_keyerror_decorator
+    def get_aggregation_method(self, variable: Variable, measurements: Dict) -> str:
+        """
+        This function gets the aggregation method for a variable, from the questions that measure it.
         """
 
         print(variable.measurement_aggregation)
@@ -292,61 +481,118 @@ class DataParser(PromptMixin, LLMMixin, RegisteredSerializable):
             template_dir=self.template_dir,
             **prompt_params,
         )
-        raw_output = self.call_llm(prompt)
-        aggregation_dict = llm_json_loader(raw_output)
+        aggregation_dict = self.call_llm_json(
+            prompt,
+            schema=response_schema("get_aggregation_method.txt", self.template_dir),
+        )
         aggregation = aggregation_dict["aggregation"]
         return aggregation
 
-    def mechanistic_aggregation(
-        self, data_list: List[Union[float, int]], aggregation: str
-    ) -> Union[float, int]:
+    def resolve_aggregation_methods(self) -> Dict[str, str]:
+        """
+        This function gets the aggregation method of each variable measured by more than one question, once per variable.
+        The method only depends on the variable and its questions, which are the same in every interaction, so the first interaction measuring the variable is used.
+        """
+        for interaction in self.interaction_data.values():
+            if not interaction:
+                continue
+            for var_name, survey in interaction["survey"].items():
+                if var_name in self.aggregation_methods or not self._check_multiple_question_per_measure(survey):
+                    continue
+                questions = {agent: list(questions) for agent, questions in survey.items()}
+                self.aggregation_methods[var_name] = self.get_aggregation_method(
+                    self.scm.variable_dict[var_name], questions
+                )
+        return self.aggregation_methods
+
+    def aggregate_measurements(
+        self, var_name: str, measurements: List[List[Union[float, int]]]
+    ) -> List[Union[float, int]]:
         """
-        This function aggregates the data from a list of measurements.
+        This function aggregates the measurements of a variable in many interactions at once, one list of measurements per interaction.
         """
+        variable = self.scm.variable_dict[var_name]
+        if var_name not in self.aggregation_methods:
+            self.resolve_aggregation_methods()
+        aggregation = self.aggregation_methods[var_name]
+
+        # one row per interaction, padded with NaN when an interaction has fewer measurements
+        matrix = np.full((len(measurements), max(map(len, measurements), default=0)), np.nan)
+        for row, raw_data in enumerate(measurements):
+            matrix[row, : len(raw_data)] = raw_data
+        values = self.aggregate_matrix(matrix, aggregation)
+
+        # a sum, extreme or mode of whole numbers is a whole number
+        if variable.variable_type != "continuous" and aggregation in ("sum", "max", "min", "mode"):
+            return [value if np.isnan(value) else int(value) for value in values.tolist()]
+        return values.tolist()
+
+    @staticmethod
+    def aggregate_matrix(matrix: np.ndarray, aggregation: str) -> np.ndarray:
+        """
+        This function aggregates each row of a matrix of measurements, leaving out the missing (NaN) measurements.
+        A row without measurements aggregates to NaN, whatever the method.
+        """
+        missing = np.isnan(matrix)
+        counts = (~missing).sum(axis=1)
         if aggregation == "average":
-            return self.average_data(data_list)
+            values = np.nansum(matrix, axis=1) / np.maximum(counts, 1)
         elif aggregation == "sum":
-            return self.sum_data(data_list)
+            values = np.nansum(matrix, axis=1)
         elif aggregation == "max":
-            return self.max_data(data_list)
+            values = np.where(missing, -np.inf, matrix).max(axis=1, initial=-np.inf)
         elif aggregation == "min":
-            return self.min_data(data_list)
+            values = np.where(missing, np.inf, matrix).min(axis=1, initial=np.inf)
+        elif aggregation == "median":
+            # NaN sorts last, so the measurements of each row come first
+            ordered = np.sort(matrix, axis=1)
+            low = np.take_along_axis(ordered, np.maximum(counts - 1, 0)[:, None] // 2, axis=1)[:, 0]
+            high = np.take_along_axis(ordered, (counts // 2)[:, None], axis=1)[:, 0]
+            values = (low + high) / 2
         elif aggregation == "mode":
-            return self.mode_data(data_list)
+            # ties go to the first measurement of the row, row by row as numpy has no mode
+            modes = []
+            for row, row_missing in zip(matrix, missing):
+                count = Counter(row[~row_missing].tolist())
+                modes.append(max(count, key=count.get) if count else np.nan)
+            values = np.array(modes, dtype=float)
         else:
             raise ValueError(
                 f"UNKNOWN AGGREGATION METHOD--PLEASE TRY AGAIN {aggregation}"
             )
+        # the fill values of the empty rows (0, -inf, inf) are not measurements
+        return np.where(counts > 0, values, np.nan)
+
+    def mechanistic_aggregation(
+        self, data_list: List[Union[float, int]], aggregation: str
+    ) -> Union[float, int]:
+        """
+        This function aggregates the data from a list of measurements, see aggregate_matrix.
+        """
+        return self.aggregate_matrix(
+            np.array([data_list], dtype=float).reshape(1, -1), aggregation
+        )[0].item()
 
     def average_data(self, data_list: List[Union[float, int]]) -> Union[float, int]:
-        if not data_list:
-            return 0.0  # or raise ValueError("data_list must not be empty")
-        return sum(data_list) / len(data_list)
+        return self.mechanistic_aggregation(data_list, "average")
 
     def sum_data(self, data_list: List[Union[float, int]]) -> Union[float, int]:
-        return sum(data_list)
+        return self.mechanistic_aggregation(data_list, "sum")
 
     def max_data(self, data_list: List[Union[float, int]]) -> Union[float, int]:
-        if not data_list:
-            return float("-inf")  # or raise ValueError("data_list must not be empty")
-        return max(data_list)
+        return self.mechanistic_aggregation(data_list, "max")
 
     def min_data(self, data_list: List[Union[float, int]]) -> Union[float, int]:
-        if not data_list:
-            return float("inf")  # or raise ValueError("data_list must not be empty")
-        return min(data_list)
+        return self.mechanistic_aggregation(data_list, "min")
 
     def mode_data(self, data_list: List[Union[float, int]]) -> Union[float, int]:
-        if not data_list:
-            return None  # or raise ValueError("data_list must not be empty")
-        count = Counter(data_list)
-        mode = max(count, key=count.get)
-        return mode
+        return self.mechanistic_aggregation(data_list, "mode")
 
     def process_interaction(self, interaction_num):
         """
         This function takes the interaction data and returns a dictionary for a single interaction with the data from the survey questions.
-        Also adds the data to the data frame.
+        A variable measured by multiple questions holds the list of its measurements, which get_data_from_interactions aggregates for all the interactions at once.
+        The exogenous variables are left to exogenous_columns, which builds them for all the interactions at once.
 
         Args:
             interaction_num (str): The interaction number to be indexed from the interaction data.
@@ -357,47 +603,67 @@ class DataParser(PromptMixin, LLMMixin, RegisteredSerializable):
         survey = self.interaction_data[interaction_num]["survey"]
         single_observation = {}
 
-        for var_name in self.attribute_value_mapping[interaction_num].keys():
-            data_single = self.exogenous_data_parse(var_name, interaction_num)
-            single_observation[var_name] = data_single
-
         for var_name in survey.keys():
             # if multiple questions per variable (still only one per agent!)
             if self._check_multiple_question_per_measure(survey[var_name]):
-                data_single = self.aggregate_multiple_data(var_name, survey)
-                single_observation[var_name] = data_single
+                single_observation[var_name] = self.measure_multiple_data(
+                    var_name, survey
+                )
             # only one question to be answered per variable
             else:
                 single_observation[var_name] = self.parse_single_question_per_measure(
                     var_name, survey
                 )
 
-        self.data_frame.loc[len(self.data_frame)] = single_observation
-
         return single_observation
 
-    def get_data_from_interactions(self):
-        with ProcessPoolExecutor() as executor:
-            # Submit tasks to the executor
-            futures = {
-                executor.submit(
-                    self.process_interaction, interaction_num
-                ): interaction_num
-                for interaction_num in self.interaction_data.keys()
-            }
-
-            # Process results
-            for future in as_completed(futures):
-                result = future.result()
-                if result is not None:
-                    self.data_frame.loc[len(self.data_frame)] = result
+    def get_data_from_interactions(self, max_workers: Optional[int] = None) -> None:
+        """
+        This function parses all the interactions concurrently and builds the data frame from their observations, in the order of the interactions.
+
+        Args:
+            max_workers (int, optional): The number of interactions parsed at the same time. Defaults to PARSE_CONCURRENCY.
+        """
+        if PARSE_BATCH_SIZE > 1:
+            self.parse_answers_in_batches(max_workers=max_workers)
+        self.resolve_aggregation_methods()
+
+        interaction_nums = [
+            num for num, interaction in self.interaction_data.items() if interaction
+        ]
+        # threads share the parser, so nothing is pickled, and the rows are collected before building the data frame once
+        with ThreadPoolExecutor(max_workers=max_workers or PARSE_CONCURRENCY) as executor:
+            rows = list(executor.map(self.process_interaction, interaction_nums))
+
+        for var_name in self.aggregation_methods:
+            measured = [row for row in rows if isinstance(row.get(var_name), list)]
+            if measured:
+                values = self.aggregate_measurements(
+                    var_name, [row[var_name] for row in measured]
+                )
+                for row, data_single in zip(measured, values):
+                    row[var_name] = data_single
+        self.data_frame = pd.DataFrame(rows, columns=self.variables)
+        # the endogenous data joins the exogenous columns of the design
+        for var_name, column in self.exogenous_columns(interaction_nums).items():
+            if var_name in self.data_frame.columns:
+                self.data_frame[var_name] = column
+
+        stats = fast_parse_stats()
+        local = sum(count for outcome, count in stats.items() if outcome.endswith(":local"))
+        if stats:
+            print(f"Parsed {local} of {sum(stats.values())} answers without the LLM: {stats}")
 
     def gather_meta_data(self) -> Dict:
         """
         This function gathers the meta data for the scenario.
         """
         self.meta_data["variables"] = {}
-        self.meta_data["scm_structure"] = self.scm.edge_dict
+        # lists, as in meta_data.json, so the stages after the parser get the same structure in memory as from the file
+        self.meta_data["scm_structure"] = {
+            var_name: list(children) if isinstance(children, set) else children
+            for var_name, children in self.scm.edge_dict.items()
+        }
         for var_name, variable in self.scm.variable_dict.items():
             self.meta_data["variables"][var_name] = {}
             self.meta_data["variables"][var_name][
@@ -409,6 +675,10 @@ class DataParser(PromptMixin, LLMMixin, RegisteredSerializable):
             self.meta_data["variables"][var_name]["endo_or_exo"] = type(
                 variable
             ).__name__
+            if var_name in self.aggregation_methods:
+                self.meta_data["variables"][var_name]["aggregation"] = (
+                    self.aggregation_methods[var_name]
+                )
 
     def write_data(self, folder_path: str) -> None:
         """
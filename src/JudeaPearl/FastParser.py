@@ -0,0 +1,102 @@
+import re
+import difflib
+import threading
+from collections import Counter
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+# How many survey answers each variable type resolved locally ('<type>:local') and how many still needed the
+# get_*_data prompt ('<type>:llm'). The counts are per process, see fast_parse_stats.
+FAST_PARSE_COUNTS: Counter = Counter()
+_counts_lock = threading.Lock()
+
+# a lone number, possibly with a currency sign, thousands separators and a unit ("$1,200", "15%", "7 dollars")
+_NUMBER = re.compile(r'^[$€£]?\s*(-?\d{1,3}(?:,\d{3})+|-?\d+)(\.\d+)?\s*(%|percent|dollars?|usd|euros?|pounds?)?$')
+_PUNCTUATION = re.compile(r'[\s".,!;:()]+')
+MISSING_ANSWERS = {'na', 'n/a', 'none', 'unknown', "i don't know", 'i do not know', "don't know", 'not sure'}
+YES_ANSWERS = {'yes', 'y', 'true', 'yes it was', 'yes they did', 'yes we did', 'yes i did'}
+NO_ANSWERS = {'no', 'n', 'false', 'no it was not', 'no they did not', 'no we did not', 'no i did not'}
+_NEGATION = re.compile(r"\b(no|not|non|none|never|without|fail(ed|s)?|didn't|did not|wasn't|was not|isn't|is not)\b")
+# an answer this similar to a single level is taken for that level (typos, plurals)
+FUZZY_CUTOFF: float = 0.9
+
+
+def count_fast_parse(outcome: str) -> None:
+    with _counts_lock:
+        FAST_PARSE_COUNTS[outcome] += 1
+
+def fast_parse_stats() -> Dict[str, int]:
+    '''
+    Number of answers resolved without the LLM ('<type>:local') and sent to the LLM ('<type>:llm') in this process.
+    '''
+    with _counts_lock:
+        return dict(FAST_PARSE_COUNTS)
+
+
+def normalize_answer(answer: object) -> str:
+    '''
+    The answer in lower case with the surrounding quotes, punctuation and repeated spaces removed.
+    '''
+    return _PUNCTUATION.sub(' ', str(answer).lower()).strip(" '")
+
+def parse_number(answer: str, whole: bool = False) -> Optional[float]:
+    '''
+    The number of an answer that is only a number (with an optional currency or unit), None otherwise.
+
+    Args:
+        answer (str): the survey answer
+        whole (bool): only accept whole numbers, for count variables
+    '''
+    match = _NUMBER.match(str(answer).strip().lower().rstrip('.'))
+    if match is None or (whole and match.group(2) and float(match.group(2)) != 0):
+        return None
+    return float(match.group(1).replace(',', '') + (match.group(2) or ''))
+
+def _match_level(answer: str, level_values: Dict[str, int]) -> Optional[int]:
+    levels = {normalize_answer(level): value for level, value in level_values.items()}
+    if answer in levels:
+        return levels[answer]
+    close = difflib.get_close_matches(answer, list(levels), n=2, cutoff=FUZZY_CUTOFF)
+    # only a single close level, two of them would make the answer ambiguous
+    return levels[close[0]] if len(close) == 1 else None
+
+def _match_yes_no(answer: str, level_values: Dict[str, int]) -> Optional[int]:
+    if answer not in YES_ANSWERS and answer not in NO_ANSWERS:
+        return None
+    negated = [value for level, value in level_values.items() if _NEGATION.search(normalize_answer(level))]
+    affirmative = [value for level, value in level_values.items() if not _NEGATION.search(normalize_answer(level))]
+    # the levels must say which of them is the "no", e.g. ['no', 'yes'] or ['agreement', 'no agreement']
+    if len(negated) != 1 or len(affirmative) != 1:
+        return None
+    return affirmative[0] if answer in YES_ANSWERS else negated[0]
+
+def fast_parse(variable_type: str, answer: object, level_values: Dict[str, int]) -> Optional[Union[float, int]]:
+    '''
+    Extracts the data point of a survey answer without the LLM when the answer leaves no doubt: a lone number for
+    continuous and count variables, a level (or a yes / no for binary variables) for the others.
+
+    Args:
+        variable_type (str): continuous, count, binary, ordinal or nominal
+        answer (object): the answer of the agent or the oracle
+        level_values (dict): the numeric value of each level, DataParser.level_value_dict of the variable
+
+    Returns:
+        the value as parse_single_question returns it (NaN for a missing answer), or None if the LLM has to decide
+    '''
+    normalized = normalize_answer(answer)
+    if normalized in MISSING_ANSWERS:
+        value = np.NaN
+    elif variable_type == 'continuous':
+        value = parse_number(answer)
+    elif variable_type == 'count':
+        number = parse_number(answer, whole=True)
+        value = None if number is None else int(number)
+    elif variable_type in ('binary', 'ordinal', 'nominal'):
+        value = _match_level(normalized, level_values)
+        if value is None and variable_type == 'binary':
+            value = _match_yes_no(normalized, level_values)
+    else:
+        value = None
+    count_fast_parse(f"{variable_type}:{'llm' if value is None else 'local'}")
+    return value
@@ -8,7 +8,8 @@ sys.path.append("../LLM")
 sys.path.append("../Serialization")
 sys.path.append("../Question")
 
-from LLM import LLMMixin, llm_json_loader
+from LLM import LLMMixin
+from ResponseSchema import response_schema
 from Serialize import RegisteredSerializable
 from Prompting import PromptMixin
 
@@ -142,8 +143,9 @@ class Variable(PromptMixin, LLMMixin, RegisteredSerializable):
         prompt = self.generate_prompt(
             prompt_file, template_dir=self.template_dir, **prompt_params
         )
-        raw_output = self.call_llm(prompt)
-        return llm_json_loader(raw_output)
+        return self.call_llm_json(
+            prompt, schema=response_schema(prompt_file, self.template_dir)
+        )
 
     @retry_on_keyerror_decorator
     def classify_variable_type(self) -> None:
@@ -164,8 +166,10 @@ class Variable(PromptMixin, LLMMixin, RegisteredSerializable):
             template_dir=self.template_dir,
             **prompt_params,
         )
-        raw_output = self.call_llm(prompt)
-        variable_type = llm_json_loader(raw_output)
+        variable_type = self.call_llm_json(
+            prompt,
+            schema=response_schema("classify_variable_type.txt", self.template_dir),
+        )
         self.explanations_dict["variable_type"] = variable_type["explanation"]
         self.variable_type = variable_type["variable_type"]
 
@@ -187,8 +191,9 @@ class Variable(PromptMixin, LLMMixin, RegisteredSerializable):
         prompt = self.generate_prompt(
             "get_variable_units.txt", template_dir=self.template_dir, **prompt_params
         )
-        raw_output = self.call_llm(prompt)
-        units = llm_json_loader(raw_output)
+        units = self.call_llm_json(
+            prompt, schema=response_schema("get_variable_units.txt", self.template_dir)
+        )
         self.explanations_dict["units"] = units["explanation"]
         self.units = units["units"]
 
@@ -212,8 +217,9 @@ class Variable(PromptMixin, LLMMixin, RegisteredSerializable):
         prompt = self.generate_prompt(
             "create_levels.txt", template_dir=self.template_dir, **prompt_params
         )
-        raw_output = self.call_llm(prompt)
-        levels = llm_json_loader(raw_output)
+        levels = self.call_llm_json(
+            prompt, schema=response_schema("create_levels.txt", self.template_dir)
+        )
         self.explanations_dict["levels"] = levels["explanation"]
         self.levels = levels["levels"]
 
@@ -244,8 +250,10 @@ class Variable(PromptMixin, LLMMixin, RegisteredSerializable):
             template_dir=self.template_dir,
             **prompt_params,
         )
-        raw_output = self.call_llm(prompt)
-        measurement_questions = llm_json_loader(raw_output)
+        measurement_questions = self.call_llm_json(
+            prompt,
+            schema=response_schema("create_measurement_questions.txt", self.template_dir),
+        )
         measurement_questions = self.REP_prompt(prompt, measurement_questions)
         self.agent_measure_question_dict = {
             key: measurement_questions[key]
@@ -312,8 +320,10 @@ class EndogenousVariable(Variable):
             template_dir=self.template_dir,
             **prompt_params,
         )
-        raw_output = self.call_llm(prompt)
-        operationalization_dict = llm_json_loader(raw_output)
+        operationalization_dict = self.call_llm_json(
+            prompt,
+            schema=response_schema("operationalize_variable.txt", self.template_dir),
+        )
         operationalization_dict = self.REP_prompt(prompt, operationalization_dict)
         self.explanations_dict["operationalization_dict"] = operationalization_dict[
             "explanation"
@@ -353,8 +363,10 @@ class EndogenousVariable(Variable):
         prompt = self.generate_prompt(
             "get_exogenous_causes.txt", template_dir=self.template_dir, **prompt_params
         )
-        raw_output = self.call_llm(prompt)
-        causes_dict = llm_json_loader(raw_output)
+        causes_dict = self.call_llm_json(
+            prompt,
+            schema=response_schema("get_exogenous_causes.txt", self.template_dir),
+        )
         self.explanations_dict["causes"] = causes_dict["explanation"]
         self.causes = causes_dict["causes"]
 
@@ -443,8 +455,10 @@ class ExogenousVariable(Variable):
             template_dir=self.template_dir,
             **prompt_params,
         )
-        raw_output = self.call_llm(prompt)
-        operationalization_dict = llm_json_loader(raw_output)
+        operationalization_dict = self.call_llm_json(
+            prompt,
+            schema=response_schema("operationalize_variable_cause.txt", self.template_dir),
+        )
         operationalization_dict = self.REP_prompt(prompt, operationalization_dict)
         self.explanations_dict["operationalization_dict"] = operationalization_dict[
             "explanation"
@@ -477,8 +491,9 @@ class ExogenousVariable(Variable):
         prompt = self.generate_prompt(
             "check_if_endogenous.txt", template_dir=self.template_dir, **prompt_params
         )
-        raw_output = self.call_llm(prompt)
-        when_outcome_determined = llm_json_loader(raw_output)
+        when_outcome_determined = self.call_llm_json(
+            prompt, schema=response_schema("check_if_endogenous.txt", self.template_dir)
+        )
 
         return (
             "endogenous"
@@ -529,8 +544,10 @@ class ExogenousVariable(Variable):
             template_dir=self.template_dir,
             **prompt_params,
         )
-        raw_output = self.call_llm(prompt)
-        scenario_or_agent_var = llm_json_loader(raw_output)
+        scenario_or_agent_var = self.call_llm_json(
+            prompt,
+            schema=response_schema("scenario_or_agent_variation.txt", self.template_dir),
+        )
         self.explanations_dict["scenario_or_agent_var"] = scenario_or_agent_var[
             "explanation"
         ]
@@ -571,8 +588,10 @@ class ExogenousVariable(Variable):
             template_dir=self.template_dir,
             **prompt_params,
         )
-        raw_output = self.call_llm(prompt)
-        attribute_variation = llm_json_loader(raw_output)
+        attribute_variation = self.call_llm_json(
+            prompt,
+            schema=response_schema("induce_variation_scenario.txt", self.template_dir),
+        )
         attribute_variation = self.REP_prompt(prompt, attribute_variation)
         # if self.variable_type == "ordinal":
         # attribute_variation = self.REP_prompt(prompt, attribute_variation, True)
@@ -614,8 +633,10 @@ class ExogenousVariable(Variable):
             template_dir=self.template_dir,
             **prompt_params,
         )
-        raw_output = self.call_llm(prompt)
-        attribute_variation = llm_json_loader(raw_output)
+        attribute_variation = self.call_llm_json(
+            prompt,
+            schema=response_schema("induce_variation_individual.txt", self.template_dir),
+        )
         attribute_variation = self.REP_prompt(prompt, attribute_variation)
         if self.variable_type == "ordinal":
             attribute_variation = self.REP_prompt(prompt, attribute_variation, True)
@@ -683,8 +704,10 @@ class ExogenousVariable(Variable):
             template_dir=self.template_dir,
             **prompt_params,
         )
-        raw_output = self.call_llm(prompt)
-        final_variation = llm_json_loader(raw_output)
+        final_variation = self.call_llm_json(
+            prompt,
+            schema=response_schema("individual_variation_align.txt", self.template_dir),
+        )
         self.attribute_variation["attribute_values"] = final_variation[
             "attribute_values"
         ]
@@ -716,8 +739,10 @@ class ExogenousVariable(Variable):
             template_dir=self.template_dir,
             **prompt_params,
         )
-        raw_output = self.call_llm(prompt)
-        public_private_dict = llm_json_loader(raw_output)
+        public_private_dict = self.call_llm_json(
+            prompt,
+            schema=response_schema("public_or_private_variation.txt", self.template_dir),
+        )
         self.explanations_dict["public_or_private_var"] = public_private_dict[
             "explanation"
         ]
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+# Defaults can be overridden in the .env file
+CACHE_PATH: str = os.getenv('LLM_CACHE_PATH', os.path.join('experiment_logs', 'llm_cache.sqlite'))
+# calls sampled above this temperature are not cached unless a call asks for it explicitly
+CACHE_MAX_TEMPERATURE: float = float(os.getenv('LLM_CACHE_MAX_TEMPERATURE', 0.1))
+CACHE_MAX_SIZE_MB: float = float(os.getenv('LLM_CACHE_MAX_SIZE_MB', 512))
+CACHE_MAX_AGE_DAYS: float = float(os.getenv('LLM_CACHE_MAX_AGE_DAYS', 30))
+
+
+def cache_enabled() -> bool:
+    '''
+    The cache is on unless LLM_CACHE is set to off/false/0.
+    '''
+    return os.getenv('LLM_CACHE', 'on').lower() not in ('off', 'false', '0', 'no')
+
+
+class ResponseCache:
+    '''
+    A persistent cache of LLM responses stored in a SQLite file.
+    Entries are keyed by a hash of everything that determines the response (see make_key).
+    The file can be shared by several processes; each process opens its own connection.
+
+    Args:
+        path (str): path to the SQLite file
+        max_size_mb (float): the least recently used entries are evicted above this size
+        max_age_days (float): entries older than this are evicted
+        evict_every (int): number of writes between two eviction passes
+    '''
+    def __init__(self, path: str = CACHE_PATH, max_size_mb: float = CACHE_MAX_SIZE_MB, max_age_days: float = CACHE_MAX_AGE_DAYS, evict_every: int = 500) -> None:
+        self.path: str = path
+        self.max_bytes: int = int(max_size_mb * 1024 * 1024)
+        self.max_age: float = max_age_days * 24 * 3600
+        self.evict_every: int = evict_every
+        self._writes: int = 0
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @staticmethod
+    def make_key(family: str, model: str, temperature: float, max_tokens: Optional[int], system_prompt: str, prompt: str, json_mode: bool = False) -> str:
+        '''
+        Content hash of a call. Any change to the model, its settings, the system prompt, the prompt or the JSON mode gives a new key.
+        '''
+        payload = json.dumps([family, model, temperature, max_tokens, system_prompt, prompt, json_mode], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections can't be shared with forked workers, so every process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                    key TEXT PRIMARY KEY,
+                                    response TEXT NOT NULL,
+                                    size INTEGER NOT NULL,
+                                    created_at REAL NOT NULL,
+                                    accessed_at REAL NOT NULL)''')
+            connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key: str) -> Optional[str]:
+        '''
+        Returns the cached response for the key, or None if there is no fresh entry.
+        '''
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT response, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if now - created_at > self.max_age:
+                connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+            connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            return response
+
+    def set(self, key: str, response: str) -> None:
+        '''
+        Stores a response. Runs an eviction pass every evict_every writes.
+        '''
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute('INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                               (key, response, len(response.encode('utf-8')), now, now))
+            self._writes += 1
+            if self._writes % self.evict_every == 0:
+                self._evict(connection)
+
+    def evict(self) -> None:
+        '''
+        Removes expired entries, then the least recently used ones until the cache fits in max_size_mb.
+        '''
+        with self._lock:
+            self._evict(self._connect())
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        connection.execute('DELETE FROM responses WHERE created_at < ?', (time.time() - self.max_age,))
+        total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        excess = total_size - self.max_bytes
+        stale_keys = []
+        for key, size in connection.execute('SELECT key, size FROM responses ORDER BY accessed_at, rowid'):
+            stale_keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        connection.executemany('DELETE FROM responses WHERE key = ?', stale_keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connect().execute('DELETE FROM responses')
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            entries, size = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        return {'entries': entries, 'size_mb': size / (1024 * 1024)}
+
+
+_response_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> ResponseCache:
+    '''
+    Returns the process-wide response cache, created on first use.
+    '''
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import fcntl
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional, Set
+
+# The mode and file come from the environment, usually set by the --record / --replay CLI options:
+# LLM_CASSETTE_MODE = record or replay, LLM_CASSETTE_PATH = experiment_logs/run.cassette.jsonl
+CASSETTE_MODES = ('record', 'replay')
+# frames from these files are skipped when looking for the call site of an LLM call
+_INTERNAL_FILES = ('LLM.py', 'Cassette.py', 'retrying.py', 'functools.py', 'threading.py', 'thread.py')
+
+
+class CassetteMissError(LookupError):
+    '''
+    Raised in replay mode when a call is not in the cassette.
+    '''
+
+
+def call_site(max_depth: int = 30) -> str:
+    '''
+    "module.function" of the code that called the LLM, i.e. the first frame outside the LLM plumbing.
+    '''
+    frame = sys._getframe(1)
+    for _ in range(max_depth):
+        if frame is None:
+            break
+        filename = os.path.basename(frame.f_code.co_filename)
+        if filename not in _INTERNAL_FILES and f'{os.sep}asyncio{os.sep}' not in frame.f_code.co_filename:
+            return f'{os.path.splitext(filename)[0]}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+class Cassette:
+    '''
+    Append-only log of every LLM call of a run, one JSON object per line, that can be replayed later without the API.
+    In record mode each call is appended with its call site, parameters and response. The prompt and system prompt
+    are only written the first time a key is seen, later calls with the same key only store the key and the response.
+    In replay mode the responses are returned bit-for-bit, in the recorded order for keys that were called several times.
+    Several processes can record into the same file, each line is written under an exclusive file lock.
+
+    Args:
+        path (str): path to the JSONL file
+        mode (str): 'record' or 'replay'
+    '''
+    def __init__(self, path: str, mode: str) -> None:
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Cassette mode must be one of {CASSETTE_MODES}, got '{mode}'.")
+        self.path: str = path
+        self.mode: str = mode
+        self._lock = threading.Lock()
+        self._written_keys: Set[str] = set()
+        self._responses: Dict[str, Deque[str]] = defaultdict(deque)
+        self._last_response: Dict[str, str] = {}
+        if mode == 'replay':
+            self._load()
+        else:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"No cassette to replay at {self.path}.")
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self._responses[record['key']].append(record['response'])
+
+    def __len__(self) -> int:
+        return sum(len(responses) for responses in self._responses.values())
+
+    def record(self, key: str, site: str, params: Dict[str, object], prompt: str, response: str) -> None:
+        '''
+        Appends one call to the cassette.
+
+        Args:
+            key (str): content hash of the call, see ResponseCache.make_key
+            site (str): where the call was made from, see call_site
+            params (dict): family, model, temperature, max_tokens and system_prompt of the LLM, and the json_mode of the call
+            prompt (str): the prompt that was sent
+            response (str): the response that came back
+        '''
+        entry = {'key': key, 'site': site}
+        with self._lock:
+            if key not in self._written_keys:
+                entry.update(params)
+                entry['prompt'] = prompt
+                self._written_keys.add(key)
+            entry['response'] = response
+            line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+            with open(self.path, 'a', encoding='utf-8') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(line)
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def replay(self, key: str) -> str:
+        '''
+        Returns the next recorded response for the key. Once they are used up, the last one is returned again.
+        '''
+        with self._lock:
+            responses = self._responses.get(key)
+            if responses:
+                self._last_response[key] = responses.popleft()
+            if key not in self._last_response:
+                raise CassetteMissError(f"Call {key} is not in the cassette {self.path}. It must be replayed with the same prompts and LLM settings it was recorded with.")
+            return self._last_response[key]
+
+
+_cassette: Optional[Cassette] = None
+
+def get_cassette() -> Optional[Cassette]:
+    '''
+    Returns the process-wide cassette, or None if no cassette mode is set.
+    '''
+    global _cassette
+    mode, path = os.getenv('LLM_CASSETTE_MODE'), os.getenv('LLM_CASSETTE_PATH')
+    if not mode or not path:
+        return None
+    if _cassette is None or _cassette.mode != mode or _cassette.path != path:
+        _cassette = Cassette(path, mode)
+    return _cassette
@@ -0,0 +1,142 @@
+import re
+import json
+import logging
+import threading
+from collections import Counter
+from json.decoder import JSONDecodeError
+from typing import Dict, List, Optional, Tuple
+
+# How often each local fix made an LLM output parse, and how often the LLM corrector still had to be called.
+# The counts are per process, see json_repair_stats.
+REPAIR_COUNTS: Counter = Counter()
+_counts_lock = threading.Lock()
+
+_CODE_FENCE = re.compile(r'```[a-zA-Z]*\s*(.*?)```', re.DOTALL)
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+_SMART_QUOTES = str.maketrans({'“': '"', '”': '"', '„': '"', '‟': '"', '‘': "'", '’': "'", '‚': "'", '‛': "'"})
+
+
+def count_repair(fix: str) -> None:
+    with _counts_lock:
+        REPAIR_COUNTS[fix] += 1
+
+def json_repair_stats() -> Dict[str, int]:
+    '''
+    Number of outputs fixed by each local repair in this process, plus 'llm_corrector' for the outputs
+    that needed the LLM and 'failed' for those that couldn't be parsed at all.
+    '''
+    with _counts_lock:
+        return dict(REPAIR_COUNTS)
+
+
+def strip_code_fence(text: str) -> str:
+    match = _CODE_FENCE.search(text)
+    return match.group(1) if match else text
+
+def extract_json_block(text: str) -> str:
+    '''
+    The first balanced {...} or [...] block of the text, ignoring brackets inside strings.
+    Returns the text unchanged if there is no complete block.
+    '''
+    start = min((i for i in (text.find('{'), text.find('[')) if i != -1), default=-1)
+    if start == -1:
+        return text
+    depth, quote, escaped = 0, None, False
+    for position in range(start, len(text)):
+        char = text[position]
+        if quote is not None:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            # an apostrophe inside a word (e.g. buyer's) doesn't open a string
+            if char == '"' or not text[position - 1].isalnum():
+                quote = char
+        elif char in '{[':
+            depth += 1
+        elif char in '}]':
+            depth -= 1
+            if depth == 0:
+                return text[start:position + 1]
+    return text
+
+def replace_smart_quotes(text: str) -> str:
+    return text.translate(_SMART_QUOTES)
+
+def remove_trailing_commas(text: str) -> str:
+    return _TRAILING_COMMA.sub(r'\1', text)
+
+def single_to_double_quotes(text: str) -> str:
+    '''
+    Rewrites single-quoted strings as double-quoted ones, escaping the double quotes they contain.
+    Apostrophes inside double-quoted strings and inside words are left alone.
+    '''
+    output: List[str] = []
+    quote, escaped = None, False
+    for position, char in enumerate(text):
+        if quote is None:
+            if char == '"' or (char == "'" and (position == 0 or not text[position - 1].isalnum())):
+                quote = char
+                output.append('"')
+            else:
+                output.append(char)
+            continue
+        if escaped:
+            escaped = False
+            if char == "'":
+                # \' is not a valid JSON escape, the quote doesn't need one
+                output[-1] = "'"
+            else:
+                output.append(char)
+        elif char == '\\':
+            escaped = True
+            output.append(char)
+        elif char == quote and (quote == '"' or position + 1 == len(text) or not text[position + 1].isalnum()):
+            quote = None
+            output.append('"')
+        elif char == '"' and quote == "'":
+            output.append('\\"')
+        else:
+            output.append(char)
+    return ''.join(output)
+
+# applied in this order, each on top of the previous ones
+REPAIRS = [
+    ('code_fence', strip_code_fence),
+    ('extract_block', extract_json_block),
+    ('smart_quotes', replace_smart_quotes),
+    ('trailing_commas', remove_trailing_commas),
+    ('single_quotes', single_to_double_quotes),
+]
+
+
+def repair_json(text: str) -> Tuple[Optional[object], List[str]]:
+    '''
+    Tries cheap local fixes for the usual ways LLM outputs break JSON: code fences, prose around the JSON,
+    smart quotes, trailing commas and single quotes.
+
+    Args:
+        text (str): the LLM output that json.loads rejected
+
+    Returns:
+        the parsed JSON (None if no combination of fixes worked) and the names of the fixes that changed the text
+    '''
+    applied: List[str] = []
+    for name, fix in REPAIRS:
+        fixed = fix(text)
+        if fixed == text:
+            continue
+        text = fixed
+        applied.append(name)
+        try:
+            parsed = json.loads(text)
+        except JSONDecodeError:
+            continue
+        for fix_name in applied:
+            count_repair(fix_name)
+        logging.debug(f"Repaired LLM JSON locally with: {', '.join(applied)}")
+        return parsed, applied
+    return None, applied
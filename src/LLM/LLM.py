@@ -5,10 +5,13 @@ import os
 import sys
 import json
 import random
+import asyncio
+import functools
+import weakref
 from json.decoder import JSONDecodeError
 import logging
 from retrying import retry
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 
 load_dotenv()
 
@@ -16,6 +19,71 @@ sys.path.append('./src/Serialization')
 # current_script_path = os.path.dirname(os.path.abspath(__file__))
 
 from Serialize import RegisteredSerializable
+from Cache import ResponseCache, get_response_cache, cache_enabled, CACHE_MAX_TEMPERATURE
+from RateLimiter import get_rate_limiter, estimate_request_tokens
+from MockLLM import get_mock_llm
+from Cassette import get_cassette, call_site
+from JsonRepair import repair_json, count_repair
+from ResponseSchema import ResponseSchema
+from SingleFlight import get_single_flight
+from Metrics import track_call, note_attempt, note_usage
+
+# Upper bound on async requests in flight per process, shared by every LanguageModel instance.
+# A single process can keep this many calls open instead of forking one worker per simulation.
+ASYNC_CONCURRENCY_LIMIT: int = int(os.getenv('LLM_MAX_CONCURRENCY', 100))
+_async_semaphores = weakref.WeakKeyDictionary()
+
+def set_async_concurrency(limit: int) -> None:
+    '''
+    Sets the maximum number of concurrent async LLM calls for this process.
+
+    Args:
+        limit (int): maximum number of requests in flight at once
+    '''
+    global ASYNC_CONCURRENCY_LIMIT
+    if limit < 1:
+        raise ValueError("The async concurrency limit must be at least 1.")
+    ASYNC_CONCURRENCY_LIMIT = limit
+    _async_semaphores.clear()
+
+def _get_async_semaphore() -> asyncio.Semaphore:
+    '''
+    Returns the semaphore bounding the async calls on the running event loop (one per loop).
+    '''
+    loop = asyncio.get_running_loop()
+    semaphore = _async_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY_LIMIT)
+        _async_semaphores[loop] = semaphore
+    return semaphore
+
+def async_retry(wait_exponential_multiplier: int = 1000, wait_exponential_max: int = 10000, stop_max_attempt_number: int = 100):
+    '''
+    The asyncio counterpart of retrying's @retry with exponential backoff (waits are in milliseconds).
+    Sleeps with asyncio.sleep so a backing-off call doesn't block the other requests on the loop.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(1, stop_max_attempt_number + 1):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if attempt == stop_max_attempt_number:
+                        raise
+                    wait = min(wait_exponential_multiplier * 2 ** attempt, wait_exponential_max)
+                    await asyncio.sleep(wait / 1000)
+        return wrapper
+    return decorator
+
+# models that accept response_format={"type": "json_object"}, i.e. always answer with valid JSON
+JSON_MODE_MODELS = {"gpt-4-turbo", "gpt-4-1106-preview", "gpt-3.5-turbo-1106"}
+
+def default_family() -> str:
+    '''
+    The model family used by the pipeline, "openai" unless LLM_FAMILY is set (e.g. LLM_FAMILY = mock to run offline).
+    '''
+    return os.getenv('LLM_FAMILY', 'openai')
 
 class LanguageModel(RegisteredSerializable):
     def __init__(self, model: str, family: str, temperature: float, max_tokens = None, system_prompt: str = "") -> None:
@@ -31,11 +99,23 @@ class LanguageModel(RegisteredSerializable):
             "openai": {
                 "text-davinci-003": 'call_openai_api',
                 "gpt-3.5-turbo": 'call_openai_api_35',
-                "gpt-4": 'call_openai_api_35'
+                "gpt-3.5-turbo-1106": 'call_openai_api_35',
+                "gpt-4": 'call_openai_api_35',
+                "gpt-4-1106-preview": 'call_openai_api_35',
+                "gpt-4-turbo": 'call_openai_api_35'
             },
             "replicate": {
                 "llama70b-v2-chat": 'call_llama70b_v2',
                 "llama13b-v2-chat": 'call_llama13b_v2'
+            },
+            # local stand-in for the OpenAI models, see MockLLM.py
+            "mock": {
+                "text-davinci-003": 'call_mock',
+                "gpt-3.5-turbo": 'call_mock',
+                "gpt-3.5-turbo-1106": 'call_mock',
+                "gpt-4": 'call_mock',
+                "gpt-4-1106-preview": 'call_mock',
+                "gpt-4-turbo": 'call_mock'
             }
         }
         
@@ -45,8 +125,7 @@ class LanguageModel(RegisteredSerializable):
         if self.model not in self.family_model_mapping[self.family]:
             raise ValueError(f"Model '{model}' not supported for the '{family}' family.")
 
-        self.call_llm = getattr(self, self.family_model_mapping[self.family][self.model])
-
+        self.call_backend = getattr(self, self.family_model_mapping[self.family][self.model])
 
     def __repr__(self):
         string = f'''Family: {self.family}\nModel: {self.model}\nTemperature: {self.temperature}'''
@@ -56,24 +135,181 @@ class LanguageModel(RegisteredSerializable):
         for family, model in self.family_model_mapping.items():
             print(f'{family}: {list(model.keys())}')
 
+    def is_cacheable(self, cache: Optional[bool] = None) -> bool:
+        '''
+        Whether a call can be served from / stored in the response cache.
+        By default only (near) deterministic calls are cached, i.e. temperature <= CACHE_MAX_TEMPERATURE.
+
+        Args:
+            cache (bool, optional): per-call override. False always skips the cache, True always uses it.
+        '''
+        if not cache_enabled() or cache is False:
+            return False
+        return cache is True or self.temperature <= CACHE_MAX_TEMPERATURE
+
+    def cache_key(self, prompt: str, json_mode: bool = False) -> str:
+        return ResponseCache.make_key(self.family, self.model, self.temperature, self.max_tokens, self.system_prompt, prompt, json_mode)
+
+    def call_llm(self, prompt: str, cache: Optional[bool] = None, json_mode: bool = False) -> str:
+        '''
+        Sends the prompt to the LLM, going through the response cache first when the call is cacheable.
+        Identical cacheable calls in flight at the same time share a single request (see SingleFlight.py).
+        Tokens, latency, retries and cost of the call are recorded under its call site (see Metrics.py).
+        When a cassette is set (see Cassette.py) the call is recorded, or answered from the cassette in replay mode.
+
+        Args:
+            prompt (str): the prompt to send to the LLM
+            cache (bool, optional): per-call override of the cache, see is_cacheable
+            json_mode (bool): ask for a JSON response, using the provider's JSON mode when the model has one
+        '''
+        site = call_site()
+        with track_call(site, self.family, self.model) as call:
+            cassette = get_cassette()
+            if cassette is not None and cassette.mode == 'replay':
+                return cassette.replay(self.cache_key(prompt, json_mode))
+
+            key = self.cache_key(prompt, json_mode) if self.is_cacheable(cache) else None
+            response = get_response_cache().get(key) if key is not None else None
+            if response is None:
+                fetch = functools.partial(self._fetch, prompt, key, json_mode)
+                response = fetch() if key is None else get_single_flight().do(key, fetch)
+            call.count_tokens(prompt, response)
+
+        if cassette is not None:
+            self._record(cassette, site, prompt, response, json_mode)
+        return response
+
+    async def acall_llm(self, prompt: str, cache: Optional[bool] = None, json_mode: bool = False) -> str:
+        '''
+        Async version of call_llm. The number of calls in flight is bounded by ASYNC_CONCURRENCY_LIMIT.
+        Backends without a native async method (acall_<method>) run the blocking call in a worker thread.
+
+        Args:
+            prompt (str): the prompt to send to the LLM
+            cache (bool, optional): per-call override of the cache, see is_cacheable
+            json_mode (bool): ask for a JSON response, using the provider's JSON mode when the model has one
+        '''
+        site = call_site()
+        with track_call(site, self.family, self.model) as call:
+            cassette = get_cassette()
+            if cassette is not None and cassette.mode == 'replay':
+                return cassette.replay(self.cache_key(prompt, json_mode))
+
+            key = self.cache_key(prompt, json_mode) if self.is_cacheable(cache) else None
+            # the cache is a SQLite file, its reads and writes run in a worker thread to keep the loop free
+            response = await asyncio.to_thread(get_response_cache().get, key) if key is not None else None
+            if response is None:
+                fetch = functools.partial(self._afetch, prompt, key, json_mode)
+                response = await (fetch() if key is None else get_single_flight().ado(key, fetch))
+            call.count_tokens(prompt, response)
+
+        if cassette is not None:
+            self._record(cassette, site, prompt, response, json_mode)
+        return response
+
+    def _fetch(self, prompt: str, key: Optional[str], json_mode: bool) -> str:
+        response = self.call_backend(prompt, **self._json_mode_kwargs(json_mode))
+        if key is not None:
+            get_response_cache().set(key, response)
+        return response
+
+    async def _afetch(self, prompt: str, key: Optional[str], json_mode: bool) -> str:
+        async_method = getattr(self, 'a' + self.family_model_mapping[self.family][self.model], None)
+        if async_method is None:
+            async with _get_async_semaphore():
+                response = await asyncio.to_thread(self.call_backend, prompt, **self._json_mode_kwargs(json_mode))
+        else:
+            response = await self._aattempt(async_method, prompt, json_mode)
+        if key is not None:
+            await asyncio.to_thread(get_response_cache().set, key, response)
+        return response
+
+    @async_retry(wait_exponential_multiplier = 1000, wait_exponential_max = 10000, stop_max_attempt_number = 100)
+    async def _aattempt(self, async_method, prompt: str, json_mode: bool) -> str:
+        '''
+        A single attempt of an async backend. The semaphore is only held during the attempt,
+        so the calls backing off between attempts don't take permits from the others.
+        '''
+        async with _get_async_semaphore():
+            return await async_method(prompt, **self._json_mode_kwargs(json_mode))
+
+    def _record(self, cassette, site: str, prompt: str, response: str, json_mode: bool) -> None:
+        '''
+        Appends the call to the cassette being recorded, cache hits included so the cassette covers the whole run.
+        '''
+        params = {"family": self.family, "model": self.model, "temperature": self.temperature,
+                  "max_tokens": self.max_tokens, "system_prompt": self.system_prompt, "json_mode": json_mode}
+        cassette.record(self.cache_key(prompt, json_mode), site, params, prompt, response)
+
+    def _json_mode_kwargs(self, json_mode: bool) -> Dict[str, bool]:
+        # only the chat backends take the argument, and only for models that support it
+        return {"json_mode": True} if json_mode and self.model in JSON_MODE_MODELS else {}
+
+    def _before_request(self, prompt: str, max_tokens: Optional[int]) -> Optional[int]:
+        '''
+        Counts the attempt for the metrics and returns the estimated tokens of an OpenAI request, or None when no rate limit is configured.
+        '''
+        note_attempt()
+        if get_rate_limiter() is None:
+            return None
+        return estimate_request_tokens(prompt, self.system_prompt, self.model, max_tokens)
+
+    def _after_response(self, estimated_tokens: Optional[int], response) -> None:
+        '''
+        Records the token usage of a response for the metrics and corrects the rate limiter's estimate with it.
+        '''
+        if "usage" not in response:
+            return
+        note_usage(response["usage"]["prompt_tokens"], response["usage"].get("completion_tokens", 0))
+        if estimated_tokens is not None:
+            get_rate_limiter().settle(self.model, estimated_tokens, response["usage"]["total_tokens"])
+
     @retry(wait_exponential_multiplier = 1000, wait_exponential_max = 10000, stop_max_attempt_number = 100)
-    def call_openai_api_35(self, prompt: str) -> str:        
+    def call_openai_api_35(self, prompt: str, json_mode: bool = False) -> str:        
+        estimated_tokens = self._before_request(prompt, self.max_tokens)
+        if estimated_tokens is not None:
+            get_rate_limiter().acquire(self.model, estimated_tokens)
         try:
             response = openai.ChatCompletion.create(
                 model = self.model,
                 messages = [{"role": "system", "content": self.system_prompt},
                             {"role": "user", "content": prompt}],
                 max_tokens = None if self.max_tokens is None else self.max_tokens,
-                temperature = self.temperature
+                temperature = self.temperature,
+                **({"response_format": {"type": "json_object"}} if json_mode else {})
                 )
+            self._after_response(estimated_tokens, response)
             return response["choices"][0]["message"]["content"]
         
         except openai.error.RateLimitError as e:
             logging.exception("Rate limit exceeded. Retrying...")
             raise e
 
+    async def acall_openai_api_35(self, prompt: str, json_mode: bool = False) -> str:
+        estimated_tokens = self._before_request(prompt, self.max_tokens)
+        if estimated_tokens is not None:
+            await get_rate_limiter().aacquire(self.model, estimated_tokens)
+        try:
+            response = await openai.ChatCompletion.acreate(
+                model = self.model,
+                messages = [{"role": "system", "content": self.system_prompt},
+                            {"role": "user", "content": prompt}],
+                max_tokens = None if self.max_tokens is None else self.max_tokens,
+                temperature = self.temperature,
+                **({"response_format": {"type": "json_object"}} if json_mode else {})
+                )
+            await asyncio.to_thread(self._after_response, estimated_tokens, response)
+            return response["choices"][0]["message"]["content"]
+
+        except openai.error.RateLimitError as e:
+            logging.exception("Rate limit exceeded. Retrying...")
+            raise e
+
     @retry(wait_exponential_multiplier = 1000, wait_exponential_max = 10000, stop_max_attempt_number = 100)
     def call_openai_api(self, prompt: str) -> str:
+        estimated_tokens = self._before_request(prompt, 100)
+        if estimated_tokens is not None:
+            get_rate_limiter().acquire(self.model, estimated_tokens)
         try:
             response = openai.Completion.create(
                 engine = self.model,
@@ -83,12 +319,58 @@ class LanguageModel(RegisteredSerializable):
                 stop = None,
                 temperature = self.temperature
             )
+            self._after_response(estimated_tokens, response)
+            return response.choices[0].text.strip()
+        except openai.error.RateLimitError as e:
+            logging.exception("Rate limit exceeded. Retrying...")
+            raise e
+
+    async def acall_openai_api(self, prompt: str) -> str:
+        estimated_tokens = self._before_request(prompt, 100)
+        if estimated_tokens is not None:
+            await get_rate_limiter().aacquire(self.model, estimated_tokens)
+        try:
+            response = await openai.Completion.acreate(
+                engine = self.model,
+                prompt = prompt,
+                max_tokens = 100,
+                n = 1,
+                stop = None,
+                temperature = self.temperature
+            )
+            await asyncio.to_thread(self._after_response, estimated_tokens, response)
             return response.choices[0].text.strip()
         except openai.error.RateLimitError as e:
             logging.exception("Rate limit exceeded. Retrying...")
             raise e
     
+    @retry(wait_exponential_multiplier = 1000, wait_exponential_max = 10000, stop_max_attempt_number = 100)
+    def call_mock(self, prompt: str, json_mode: bool = False) -> str:
+        estimated_tokens = self._before_request(prompt, self.max_tokens)
+        if estimated_tokens is not None:
+            get_rate_limiter().acquire(self.model, estimated_tokens)
+        try:
+            response = get_mock_llm().complete(prompt, self.system_prompt, self.model)
+            self._after_response(estimated_tokens, response)
+            return response["choices"][0]["message"]["content"]
+        except openai.error.RateLimitError as e:
+            logging.exception("Rate limit exceeded. Retrying...")
+            raise e
+
+    async def acall_mock(self, prompt: str, json_mode: bool = False) -> str:
+        estimated_tokens = self._before_request(prompt, self.max_tokens)
+        if estimated_tokens is not None:
+            await get_rate_limiter().aacquire(self.model, estimated_tokens)
+        try:
+            response = await get_mock_llm().acomplete(prompt, self.system_prompt, self.model)
+            await asyncio.to_thread(self._after_response, estimated_tokens, response)
+            return response["choices"][0]["message"]["content"]
+        except openai.error.RateLimitError as e:
+            logging.exception("Rate limit exceeded. Retrying...")
+            raise e
+
     def call_llama70b_v2(self, prompt: str) -> str:
+        note_attempt()
         model = "replicate/llama-2-70b-chat:2796ee9483c3fd7aa2e171d38f4ca12251a30609463dcfd4cd76703f22e96cdf"
         output = replicate.run(model,
                         input={"prompt":prompt,
@@ -103,6 +385,7 @@ class LanguageModel(RegisteredSerializable):
         return result
     
     def call_llama13b_v2(self, prompt: str, top_p: float = 1, max_length: int = 500, repetition_penalty: float = 1) -> str:
+        note_attempt()
         model = "a16z-infra/llama-2-13b-chat:d5da4236b006f967ceb7da037be9cfc3924b20d21fed88e1e94f19d56e2d3111"
         output = replicate.run(model,
                         input={"prompt":prompt,
@@ -120,11 +403,63 @@ class LLMMixin:
     def add_LLM(self, LLM: 'LanguageModel') -> None:
         self.LLM = LLM
 
-    def call_llm(self, prompt: str) -> str:
+    def call_llm(self, prompt: str, **kwargs) -> str:
         if hasattr(self, 'LLM'):
-            return self.LLM.call_llm(prompt)
+            return self.LLM.call_llm(prompt, **kwargs)
         else:
             raise NotImplementedError("This method gets implemented when you add an LLM")
+
+    async def acall_llm(self, prompt: str, **kwargs) -> str:
+        if hasattr(self, 'LLM'):
+            return await self.LLM.acall_llm(prompt, **kwargs)
+        else:
+            raise NotImplementedError("This method gets implemented when you add an LLM")
+
+    def call_llm_json(self, prompt: str, schema: Optional[ResponseSchema] = None, **kwargs) -> Dict:
+        '''
+        Calls the LLM in JSON mode and loads the response. With a schema, a response missing keys gets
+        a local key fix and then one short repair call before a KeyError is raised.
+
+        Args:
+            prompt (str): the prompt to send to the LLM
+            schema (ResponseSchema, optional): the keys the response must have, see ResponseSchema.response_schema
+        '''
+        raw_output = self.call_llm(prompt, json_mode=True, **kwargs)
+        response = self._apply_schema(llm_json_loader(raw_output), schema)
+        if schema is None or not schema.missing_keys(response):
+            return response
+        count_repair('schema_llm_repair')
+        repaired_output = self.call_llm(schema.repair_prompt(raw_output), json_mode=True)
+        return self._check_schema(self._apply_schema(llm_json_loader(repaired_output), schema), schema)
+
+    async def acall_llm_json(self, prompt: str, schema: Optional[ResponseSchema] = None, **kwargs) -> Dict:
+        '''
+        Async version of call_llm_json.
+        '''
+        raw_output = await self.acall_llm(prompt, json_mode=True, **kwargs)
+        response = self._apply_schema(llm_json_loader(raw_output), schema)
+        if schema is None or not schema.missing_keys(response):
+            return response
+        count_repair('schema_llm_repair')
+        repaired_output = await self.acall_llm(schema.repair_prompt(raw_output), json_mode=True)
+        return self._check_schema(self._apply_schema(llm_json_loader(repaired_output), schema), schema)
+
+    @staticmethod
+    def _apply_schema(response, schema: Optional[ResponseSchema]):
+        if schema is None or not schema.missing_keys(response):
+            return response
+        fixed = schema.fix_keys(response)
+        if not schema.missing_keys(fixed):
+            count_repair('schema_key_fix')
+        return fixed
+
+    @staticmethod
+    def _check_schema(response, schema: ResponseSchema):
+        missing = schema.missing_keys(response)
+        if missing:
+            # KeyError so that retry_on_keyerror_decorator can still re-run the step
+            raise KeyError(f"Response to {schema.name} is missing the keys {missing}")
+        return response
         
 def llm_json_loader(raw_llm_output: str) -> Dict[str, str]:
     '''
@@ -141,9 +476,15 @@ def llm_json_loader(raw_llm_output: str) -> Dict[str, str]:
             return llm_json
         
         except JSONDecodeError as e:
-            print(f'Attempt {attempt+1}: LLM returned invalid JSON BUT WILL CALL LLM AGAIN TO FIX{llm_output}', e.doc, e.pos)
             error_doc, error_pos = e.doc, e.pos
 
+        # most invalid outputs only need a local fix (code fence, surrounding text, quotes, trailing commas)
+        llm_json, _ = repair_json(llm_output.lower())
+        if llm_json is not None:
+            return llm_json
+
+        print(f'Attempt {attempt+1}: LLM returned invalid JSON BUT WILL CALL LLM AGAIN TO FIX{llm_output}', error_doc, error_pos)
+        count_repair('llm_corrector')
         try:
             llm_output = json_corrector(llm_output, error_doc, error_pos)
 
@@ -153,6 +494,7 @@ def llm_json_loader(raw_llm_output: str) -> Dict[str, str]:
     # If after three attempts we still couldn't parse the JSON, raise an exception
     print(f'ORIGINAL STRING FROM LLM: {raw_llm_output}')
     print(f'FINAL FAILED STRING FROM LLM: {llm_output}')
+    count_repair('failed')
     raise JSONDecodeError("INVALID JSON")
 
 def json_corrector(llm_output: str, error_doc, error_pos) -> str:
@@ -160,7 +502,7 @@ def json_corrector(llm_output: str, error_doc, error_pos) -> str:
     Sends json to LLM to fix it and returns the fixed json
     '''
 
-    LLM = LanguageModel(family = "openai", model = "gpt-4", temperature = 0.1)
+    LLM = LanguageModel(family = default_family(), model = "gpt-4", temperature = 0.1)
 
     cleanup_prompt = f'''The following json is invalid: {llm_output}
 with the following error: {error_doc} at position {error_pos}.
@@ -0,0 +1,203 @@
+import os
+import csv
+import json
+import time
+import fcntl
+import threading
+import contextlib
+import contextvars
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from RateLimiter import count_tokens
+
+# USD per 1000 prompt / completion tokens. The mock family is priced like the model it stands in for.
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-turbo': (0.01, 0.03),
+    'gpt-4-1106-preview': (0.01, 0.03),
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'gpt-3.5-turbo-1106': (0.001, 0.002),
+    'text-davinci-003': (0.02, 0.02),
+}
+SUMMARY_FIELDS = ['site', 'calls', 'api_calls', 'cached_calls', 'retries', 'prompt_tokens', 'completion_tokens',
+                  'latency_seconds', 'mean_latency_seconds', 'cost_usd']
+
+
+def metrics_path() -> Optional[str]:
+    '''
+    The file the LLM calls of a CLI run are appended to, by the parent and its worker processes alike, so the
+    parent can summarize them all. Only set when the CLI gives the run an id (LLM_METRICS_RUN) and an output
+    directory (LLM_METRICS_DIR), otherwise the calls are kept in memory.
+    '''
+    run, directory = os.getenv('LLM_METRICS_RUN'), os.getenv('LLM_METRICS_DIR')
+    if not run or not directory:
+        return None
+    return os.path.join(directory, f'llm_calls_{run}.jsonl')
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class CallMetrics:
+    '''
+    What one call_llm invocation cost. A call answered without reaching the backend (response cache, cassette
+    or another caller's identical request) has no attempts and costs nothing.
+
+    Args:
+        site (str): where the call was made from, e.g. "AgentBuilder.get_agent_goals"
+        family (str): model family of the LLM
+        model (str): model name of the LLM
+    '''
+    def __init__(self, site: str, family: str, model: str) -> None:
+        self.site: str = site
+        self.family: str = family
+        self.model: str = model
+        self.attempts: int = 0
+        self.prompt_tokens: int = 0
+        self.completion_tokens: int = 0
+        self.usage_reported: bool = False
+        self.latency: float = 0.0
+        self._start: float = time.perf_counter()
+
+    def add_usage(self, prompt_tokens: int, completion_tokens: int) -> None:
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.usage_reported = True
+
+    def count_tokens(self, prompt: str, response: str) -> None:
+        # backends that don't report usage (replicate) are counted with the tokenizer
+        if self.attempts and not self.usage_reported:
+            self.prompt_tokens = count_tokens(prompt, self.model)
+            self.completion_tokens = count_tokens(response, self.model)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            'site': self.site,
+            'family': self.family,
+            'model': self.model,
+            'cached': self.attempts == 0,
+            'retries': max(0, self.attempts - 1),
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'latency': round(self.latency, 4),
+            'cost_usd': estimate_cost(self.model, self.prompt_tokens, self.completion_tokens),
+        }
+
+
+class MetricsRegistry:
+    '''
+    Collects the CallMetrics of every LLM call made by this process, and appends them to the JSONL file
+    of the run when there is one, shared with the other processes of the run.
+
+    Args:
+        path (str, optional): the JSONL file of the run, None to keep the calls in memory only
+    '''
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path: Optional[str] = path
+        self.calls: List[Dict[str, object]] = []
+        self._lock = threading.Lock()
+
+    def add(self, call: CallMetrics) -> None:
+        record = call.to_dict()
+        record['run'] = os.getenv('LLM_METRICS_RUN', '')
+        with self._lock:
+            self.calls.append(record)
+            if self.path is None:
+                return
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(json.dumps(record, separators=(',', ':')) + '\n')
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load_run(self, run: Optional[str] = None) -> List[Dict[str, object]]:
+        '''
+        The calls of a run made by any process, read from the file of the run (this process' calls if there is no file).
+
+        Args:
+            run (str, optional): the run id, defaults to LLM_METRICS_RUN
+        '''
+        run = os.getenv('LLM_METRICS_RUN', '') if run is None else run
+        if self.path is None or not os.path.exists(self.path):
+            return [call for call in self.calls if call['run'] == run]
+        with open(self.path, 'r') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return [record for record in records if record['run'] == run]
+
+    @staticmethod
+    def summarize(calls: List[Dict[str, object]]) -> List[Dict[str, object]]:
+        '''
+        Totals per call site, most expensive first.
+        '''
+        sites = defaultdict(lambda: dict.fromkeys(SUMMARY_FIELDS, 0))
+        for call in calls:
+            site = sites[call['site']]
+            site['site'] = call['site']
+            site['calls'] += 1
+            site['cached_calls'] += int(call['cached'])
+            site['api_calls'] += int(not call['cached'])
+            for field in ('retries', 'prompt_tokens', 'completion_tokens', 'cost_usd'):
+                site[field] += call[field]
+            site['latency_seconds'] += call['latency']
+        for site in sites.values():
+            site['mean_latency_seconds'] = round(site['latency_seconds'] / site['calls'], 4)
+            site['latency_seconds'] = round(site['latency_seconds'], 4)
+            site['cost_usd'] = round(site['cost_usd'], 6)
+        return sorted(sites.values(), key=lambda site: (-site['cost_usd'], -site['latency_seconds']))
+
+    def dump(self, output_dir: str, name: str, run: Optional[str] = None) -> List[Dict[str, object]]:
+        '''
+        Writes the per call site summary of a run to llm_metrics_<name>.json and .csv in output_dir.
+        '''
+        summary = self.summarize(self.load_run(run))
+        with open(os.path.join(output_dir, f'llm_metrics_{name}.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        with open(os.path.join(output_dir, f'llm_metrics_{name}.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(summary)
+        return summary
+
+
+_metrics_registry: Optional[MetricsRegistry] = None
+_current_call: contextvars.ContextVar = contextvars.ContextVar('current_llm_call', default=None)
+
+def get_metrics_registry() -> MetricsRegistry:
+    '''
+    Returns the process-wide metrics registry, created on first use.
+    '''
+    global _metrics_registry
+    if _metrics_registry is None:
+        _metrics_registry = MetricsRegistry(path=metrics_path())
+    return _metrics_registry
+
+@contextlib.contextmanager
+def track_call(site: str, family: str, model: str) -> Iterator[CallMetrics]:
+    '''
+    Measures an LLM call. The backend reports its attempts and token usage with note_attempt and note_usage,
+    which find the call through a context variable (copied into asyncio tasks and asyncio.to_thread).
+    '''
+    call = CallMetrics(site, family, model)
+    token = _current_call.set(call)
+    try:
+        yield call
+    finally:
+        call.latency = time.perf_counter() - call._start
+        _current_call.reset(token)
+        get_metrics_registry().add(call)
+
+def note_attempt() -> None:
+    call = _current_call.get()
+    if call is not None:
+        call.attempts += 1
+
+def note_usage(prompt_tokens: int, completion_tokens: int) -> None:
+    call = _current_call.get()
+    if call is not None:
+        call.add_usage(prompt_tokens, completion_tokens)
@@ -0,0 +1,639 @@
+import os
+import re
+import ast
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import openai
+from jinja2 import Environment, Template, meta
+
+from RateLimiter import count_tokens
+
+# The mock backend answers every prompt of the pipeline locally, so the whole workflow can run offline and for free.
+# All settings come from the .env file, e.g. MOCK_LLM_LATENCY = lognormal:800,0.5 and MOCK_LLM_RATE_LIMIT_RATE = 0.05
+MOCK_SEED: str = os.getenv('MOCK_LLM_SEED', '0')
+# fixed:<ms>, uniform:<low ms>,<high ms>, normal:<mean ms>,<sd ms> or lognormal:<median ms>,<sigma>
+MOCK_LATENCY: str = os.getenv('MOCK_LLM_LATENCY', 'fixed:0')
+# extra latency per completion token, on top of MOCK_LATENCY
+MOCK_MS_PER_TOKEN: float = float(os.getenv('MOCK_LLM_MS_PER_TOKEN', 0))
+# share of calls failing with a 429 (openai.error.RateLimitError) or a timeout (openai.error.Timeout)
+MOCK_RATE_LIMIT_RATE: float = float(os.getenv('MOCK_LLM_RATE_LIMIT_RATE', 0))
+MOCK_TIMEOUT_RATE: float = float(os.getenv('MOCK_LLM_TIMEOUT_RATE', 0))
+# how long a call hangs before it times out
+MOCK_TIMEOUT_SECONDS: float = float(os.getenv('MOCK_LLM_TIMEOUT_SECONDS', 1.0))
+
+current_script_path = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIRS: List[str] = [os.path.join(current_script_path, '..', 'JudeaPearl', 'prompt_templates'),
+                            os.path.join(current_script_path, '..', 'Human', 'prompt_templates')]
+
+NAMES: List[str] = ['Alice', 'Ben', 'Carla', 'David', 'Elena', 'Frank', 'Grace', 'Hugo', 'Irene', 'James',
+                    'Karen', 'Leo', 'Maya', 'Nathan', 'Olivia', 'Peter', 'Quinn', 'Rosa', 'Sam', 'Tara']
+ORDINAL_LEVELS: List[str] = ['very low', 'low', 'medium', 'high', 'very high']
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    '''
+    Turns a latency spec like "lognormal:800,0.5" into a function drawing a latency in seconds.
+
+    Args:
+        spec (str): fixed:<ms>, uniform:<low ms>,<high ms>, normal:<mean ms>,<sd ms> or lognormal:<median ms>,<sigma>
+    '''
+    kind, _, values = spec.partition(':')
+    params = [float(value) for value in values.split(',') if value.strip()]
+    kind = kind.strip().lower()
+    if kind == 'fixed':
+        return lambda rng: params[0] / 1000
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1]) / 1000
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1])) / 1000
+    if kind == 'lognormal':
+        return lambda rng: params[0] * rng.lognormvariate(0, params[1]) / 1000
+    raise ValueError(f"Unknown latency distribution '{spec}'.")
+
+
+def _literal(text: str):
+    '''
+    Reads a value that a template rendered from a python object (list, dict, dict_keys...) back into that object.
+    '''
+    text = text.strip()
+    for prefix in ('dict_keys(', 'dict_values('):
+        if text.startswith(prefix) and text.endswith(')'):
+            text = text[len(prefix):-1]
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def _as_list(text: str) -> List[str]:
+    value = _literal(text)
+    if isinstance(value, (list, tuple, set)):
+        return [str(item) for item in value]
+    if isinstance(value, dict):
+        return [str(item) for item in value]
+    return [value] if value else []
+
+def _numbers(text: str) -> List[float]:
+    # a minus right after a digit is a range like "0-20", not a negative number
+    return [float(number) for number in re.findall(r'(?<![\d.])-?\d+(?:\.\d+)?', text.replace(',', ''))]
+
+def _agent_in(variable_name: str, agents: List[str]) -> Optional[str]:
+    '''
+    The agent a variable name refers to, e.g. "buyer" for "the buyer's budget".
+    '''
+    mentioned = [agent for agent in agents if agent.lower() in variable_name.lower()]
+    return max(mentioned, key=len) if mentioned else None
+
+def _variable_type(variable_name: str) -> str:
+    name = variable_name.lower()
+    if 'whether' in name or name.startswith('if '):
+        return 'binary'
+    if 'number of' in name or 'how many' in name or 'count' in name:
+        return 'count'
+    if any(word in name for word in ('price', 'budget', 'amount', 'cost', 'value', 'income', 'salary', 'bid', 'dollar', 'money', 'offer', 'bail', 'age', 'years')):
+        return 'continuous'
+    return 'ordinal'
+
+def _levels(variable_type: str, num_levels: int = 5) -> List[str]:
+    if variable_type == 'binary':
+        return ['no', 'yes']
+    if variable_type == 'continuous':
+        return [f'{i * 20 + (1 if i else 0)}-{(i + 1) * 20}' for i in range(num_levels - 1)] + [f'above {(num_levels - 1) * 20}']
+    if variable_type == 'count':
+        return [f'{i * 3}-{i * 3 + 2}' for i in range(num_levels - 1)] + [f'{(num_levels - 1) * 3}+']
+    return list(ORDINAL_LEVELS)
+
+def _level_variation(variable_type: str, levels: List[str]) -> List[str]:
+    '''
+    Values of an attribute inducing each level. Numeric levels become a number inside the range.
+    '''
+    if variable_type not in ('continuous', 'count'):
+        return list(levels)
+    values = []
+    for level in levels:
+        numbers = _numbers(level)
+        if len(numbers) >= 2:
+            values.append(str(int((numbers[0] + numbers[1]) // 2)))
+        elif numbers:
+            values.append(str(int(numbers[0] + (10 if variable_type == 'continuous' else 2))))
+        else:
+            values.append(str(len(values)))
+    return values
+
+def _measurement_question(variable_name: str, variable_type: str, levels: List[str]) -> str:
+    if variable_type == 'binary':
+        return f'Please tell us {variable_name}. Answer yes or no.'
+    if variable_type == 'ordinal':
+        options = ', '.join(f"'{level}'" for level in levels)
+        return f'How would you rate {variable_name}? Please respond with exactly one of these options: {options}.'
+    if variable_type == 'count':
+        return f'What was {variable_name}? Please respond with a single whole number.'
+    return f'What was {variable_name}? Please respond with a single number.'
+
+def _survey_answer(question: str, rng: random.Random) -> str:
+    '''
+    Answers a measurement question in the format it asks for.
+    '''
+    question = question.lower()
+    if 'one of these options:' in question:
+        options = re.findall(r"'([^']+)'", question.split('one of these options:', 1)[1])
+        if options:
+            return rng.choice(options)
+    if 'yes or no' in question or question.startswith(('did ', 'was ', 'were ', 'is ', 'does ', 'do ')):
+        return rng.choice(['yes', 'no'])
+    scale = re.search(r'(\d+)\s*(?:-|to)\s*(\d+)', question)
+    if scale and 'scale' in question:
+        low, high = sorted((int(scale.group(1)), int(scale.group(2))))
+        return str(rng.randint(low, high))
+    if any(word in question for word in ('whole number', 'how many', 'number of', 'count')):
+        return str(rng.randint(0, 12))
+    if any(word in question for word in ('number', 'price', 'how much', 'amount', '$', 'dollar', 'value')):
+        return str(rng.randint(5, 100))
+    return "I don't know"
+
+def _extract_value(answer: str, variable_type: str, levels: List[str], level_values: List) -> str:
+    '''
+    The numeric data point in an answer, as the get_*_data templates ask for.
+    '''
+    answer = str(answer).lower()
+    if variable_type == 'binary':
+        if re.search(r'\b(yes|1|true)\b', answer):
+            return '1'
+        if re.search(r'\b(no|0|false)\b', answer):
+            return '0'
+        return 'NA'
+    if variable_type in ('ordinal', 'nominal'):
+        matches = [(level, value) for level, value in zip(levels, level_values) if str(level).lower() in answer]
+        if matches:
+            return str(max(matches, key=lambda match: len(str(match[0])))[1])
+        for number in _numbers(answer):
+            if number in [float(value) for value in level_values]:
+                return str(int(number))
+        return 'NA'
+    numbers = _numbers(answer)
+    if not numbers:
+        return 'NA'
+    return str(int(numbers[0])) if variable_type == 'count' else str(numbers[0])
+
+def _statement(rng: random.Random, scenario: str, n_left: int) -> str:
+    openers = ['Hello everyone.', 'Thanks for taking the time.', 'I see your point.', 'Let me be direct.', 'That is fair.', 'I hear you.']
+    middles = [f'We are here because of {scenario}, so let us focus on that.',
+               'I think we can find something that works for both of us.',
+               f'I would be comfortable with {rng.randint(5, 100)} dollars.',
+               'Could you tell me a bit more about what you have in mind?',
+               'I am not sure that works for me yet.',
+               'I want to make sure we are both happy with the outcome.']
+    sentences = [rng.choice(openers)] + rng.sample(middles, rng.randint(1, 3))
+    if n_left <= 2:
+        sentences.append('Thank you for the conversation, goodbye.')
+    return ' '.join(sentences)
+
+def _history_length(history: str) -> int:
+    value = _literal(history)
+    if isinstance(value, list):
+        return len(value)
+    return history.count('}, {') + 1 if history.strip() not in ('', '[]', 'None') else 0
+
+def _first_json_block(text: str) -> str:
+    start, end = text.find('{'), text.rfind('}')
+    return text[start:end + 1] if start != -1 and end > start else text
+
+
+class PromptTemplateIndex:
+    '''
+    Recognizes which prompt template a prompt was rendered from and recovers the values of its variables.
+    Each template is rendered with sentinel values, which splits it into the literal text around the variables.
+    A prompt matches a template if it contains all of the literal text in order.
+
+    Args:
+        template_dirs (list): directories with the .txt prompt templates
+    '''
+    SENTINEL: str = '\x00'
+
+    def __init__(self, template_dirs: List[str] = TEMPLATE_DIRS) -> None:
+        self.templates: List[Tuple[str, List[str], List[str]]] = []
+        env = Environment()
+        for template_dir in template_dirs:
+            if not os.path.isdir(template_dir):
+                continue
+            for file_name in sorted(os.listdir(template_dir)):
+                if not file_name.endswith('.txt'):
+                    continue
+                with open(os.path.join(template_dir, file_name), 'r') as f:
+                    template_string = f.read()
+                try:
+                    variables = meta.find_undeclared_variables(env.parse(template_string))
+                    rendered = Template(template_string).render({variable: f'{self.SENTINEL}{variable}{self.SENTINEL}' for variable in variables})
+                except Exception:
+                    # a few files in the template folders are notes, not templates
+                    continue
+                parts = rendered.split(self.SENTINEL)
+                self.templates.append((file_name, parts[0::2], parts[1::2]))
+
+    def match(self, prompt: str) -> Tuple[Optional[str], Dict[str, str]]:
+        '''
+        Returns the name of the template the prompt was rendered from and the text of each variable, or (None, {}).
+        '''
+        best_name, best_params, best_score = None, {}, -1
+        for file_name, literals, variables in self.templates:
+            if not prompt.startswith(literals[0]) or not prompt.endswith(literals[-1]):
+                continue
+            params = self._split(prompt, literals, variables)
+            score = sum(len(literal) for literal in literals)
+            if params is not None and score > best_score:
+                best_name, best_params, best_score = file_name, params, score
+        return best_name, best_params
+
+    @staticmethod
+    def _split(prompt: str, literals: List[str], variables: List[str]) -> Optional[Dict[str, str]]:
+        params = {}
+        position = len(literals[0])
+        end = len(prompt) - len(literals[-1])
+        for index, variable in enumerate(variables):
+            literal = literals[index + 1]
+            if index == len(variables) - 1:
+                next_position = end
+            elif literal:
+                next_position = prompt.find(literal, position, end)
+            else:
+                next_position = position
+            if next_position < position:
+                return None
+            params.setdefault(variable, prompt[position:next_position])
+            position = next_position + len(literal)
+        return params if position == len(prompt) else None
+
+
+class MockLLM:
+    '''
+    A local stand-in for the OpenAI chat API that answers every prompt of the pipeline with schema-valid output.
+    Answers are drawn from a generator seeded by the prompt, so the same prompt always gets the same answer,
+    while latency and injected faults follow the configured distributions to mimic a real endpoint under load.
+
+    Args:
+        seed (str): seed of the answers and of the latency/fault draws
+        latency (str): latency distribution, see parse_latency
+        ms_per_token (float): extra latency per completion token
+        rate_limit_rate (float): share of calls raising openai.error.RateLimitError
+        timeout_rate (float): share of calls raising openai.error.Timeout after timeout_seconds
+        timeout_seconds (float): time a call hangs before timing out
+    '''
+    def __init__(self, seed: str = MOCK_SEED, latency: str = MOCK_LATENCY, ms_per_token: float = MOCK_MS_PER_TOKEN,
+                 rate_limit_rate: float = MOCK_RATE_LIMIT_RATE, timeout_rate: float = MOCK_TIMEOUT_RATE,
+                 timeout_seconds: float = MOCK_TIMEOUT_SECONDS) -> None:
+        self.seed: str = seed
+        self.latency: Callable[[random.Random], float] = parse_latency(latency)
+        self.ms_per_token: float = ms_per_token
+        self.rate_limit_rate: float = rate_limit_rate
+        self.timeout_rate: float = timeout_rate
+        self.timeout_seconds: float = timeout_seconds
+        self.templates = PromptTemplateIndex()
+        self._lock = threading.Lock()
+        self._rng: Optional[random.Random] = None
+        self._pid: Optional[int] = None
+        self.handlers: Dict[str, Callable[[Dict[str, str], random.Random], object]] = {
+            'get_human_actors.txt': self._human_actors,
+            'outcome_generator1.txt': self._outcomes,
+            'outcome_generator2.txt': self._outcomes,
+            'operationalize_variable.txt': self._operationalize,
+            'operationalize_variable_cause.txt': self._operationalize,
+            'classify_variable_type.txt': self._variable_type,
+            'get_variable_units.txt': self._units,
+            'create_levels.txt': self._levels,
+            'create_measurement_questions.txt': self._measurement_questions,
+            'get_exogenous_causes.txt': self._causes,
+            'get_causes.txt': self._causes,
+            'check_if_endogenous.txt': lambda p, rng: {'when_determined': 'before', 'explanation': 'The value is set before the scenario starts.'},
+            'scenario_or_agent_variation.txt': self._variable_scope,
+            'induce_variation_individual.txt': self._variation,
+            'induce_variation_scenario.txt': self._variation,
+            'get_variation_mapping.txt': self._variation,
+            'individual_variation_align.txt': lambda p, rng: {'attribute_values': _as_list(p['attribute_values']), 'explanation': 'The values are already aligned.'},
+            'public_or_private_variation.txt': lambda p, rng: {'choice': 'private', 'public_name': 'private', 'explanation': 'Only the agent knows this attribute.'},
+            'REP_prompt.txt': self._repeat,
+            'REP_variation.txt': self._repeat,
+            'get_name.txt': self._names,
+            'get_agent_goals.txt': lambda p, rng: {'explanation': 'The goal follows from the role.', 'goal': f"you want to get the best possible outcome for yourself as the {p['agent']}"},
+            'get_agent_constraints.txt': lambda p, rng: {'explanation': 'No constraint is necessary.', 'constraint': 'you have no constraints'},
+            'get_necessary_info.txt': lambda p, rng: {'explanation': 'The agent needs to know what the conversation is about.', 'information': ['the topic of the conversation']},
+            'get_agent_attributes.txt': lambda p, rng: {'information': ['the topic of the conversation'], 'explanation of each piece of information': 'The agent needs to know what the conversation is about.'},
+            'info_to_attributes.txt': self._info_to_attributes,
+            'check_info_mismatch.txt': lambda p, rng: {'explanation': 'The attributes are consistent.', 'attributes': _as_list(p['attribute_names']), 'values': _as_list(p['attribute_values'])},
+            'get_interaction_type.txt': self._interaction_type,
+            'get_agent_order.txt': lambda p, rng: {'order': _as_list(p['relevant_agents']), 'explanation': 'The agents take turns.'},
+            'get_center_agent_no_order.txt': lambda p, rng: {'central agent': _as_list(p['relevant_agents'])[0], 'explanation': 'The first agent leads.'},
+            'get_center_agent_ordered.txt': lambda p, rng: {'central agent': _as_list(p['relevant_agents'])[0], 'order': _as_list(p['relevant_agents'])[1:], 'explanation': 'The first agent leads.'},
+            'add_observed_proxies.txt': lambda p, rng: {'observed_proxies': [f"reported {p['variable_name']}"], 'explanation': 'The variable is measured by one question.'},
+            'latent_or_observed.txt': lambda p, rng: {'latent_or_observed': 'observed', 'explanation': 'The variable is measured directly.'},
+            'measurement_is_NA.txt': lambda p, rng: {'missing_data_situations': ['data always present'], 'explanation': 'The agents can always answer.'},
+            'variable_in_list.txt': lambda p, rng: {'in_list': 'False', 'name_of_variable': p['variable_name'], 'name_of_match': '', 'explanation': 'No variable matches.'},
+            'get_aggregation_method.txt': self._aggregation,
+            'custom_aggregation.txt': self._custom_aggregation,
+            'get_binary_data.txt': lambda p, rng: self._data(p, 'binary'),
+            'get_continuous_data.txt': lambda p, rng: self._data(p, 'continuous'),
+            'get_count_data.txt': lambda p, rng: self._data(p, 'count'),
+            'get_ordinal_data.txt': lambda p, rng: self._data(p, 'ordinal'),
+            'get_nominal_data.txt': lambda p, rng: self._data(p, 'nominal'),
+            'get_data_batch.txt': lambda p, rng: self._data_many(p),
+            'survey_agent.txt': lambda p, rng: self._survey(p['question'], rng),
+            'survey_oracle.txt': lambda p, rng: self._survey(p['question'], rng),
+            'survey_oracle_batch.txt': lambda p, rng: self._survey_many(p['questions'], rng),
+            'to_continue_or_to_finish.txt': lambda p, rng: self._continue(p['history'], rng),
+            'make_statement.txt': lambda p, rng: _statement(rng, p['scenario_description'], int((_numbers(p['n_left']) or [20])[0])),
+            'ask_agent_thoughts.txt': lambda p, rng: {'thoughts': 'The person who has spoken least should go next.', 'explanation': 'It keeps the conversation balanced.'},
+            'ask_oracle_post.txt': self._next_agent,
+            'ask_oracle_prescriptively.txt': self._next_agent,
+            'is_rational.txt': lambda p, rng: 'yes',
+            'current.context.txt': lambda p, rng: _statement(rng, 'this conversation', 20),
+            'instantiate_agent.txt': lambda p, rng: _statement(rng, p['scenario_description'], 20),
+        }
+        # prompts written inline in the code instead of in a template file
+        self.inline_handlers: List[Tuple[str, Callable[[str, random.Random], object]]] = [
+            ('Determine whether the conversation should continue or if is complete', self._inline_continue),
+            ('Your task is to answer the following question:', self._inline_survey),
+            ('Your task is to answer each of the following questions, keyed by id:', self._inline_survey_many),
+            ('Provide your natural response to this conversation without any other text', self._inline_statement),
+            ('decide whether the conversation is complete after your statement', self._inline_statement_and_decision),
+            ('Please enter an abbreviated name for this variable:', self._inline_short_name),
+            ('The following json is invalid:', self._inline_json_fix),
+            ('is this response consistent with your goals', lambda prompt, rng: 'yes'),
+            ('Write a short summary of the conversation so far', self._inline_summary),
+        ]
+
+    ############################### answers #########################################
+
+    def respond(self, prompt: str, system_prompt: str = '', model: str = 'gpt-4') -> str:
+        '''
+        The answer to a prompt. Deterministic: the same prompt always gets the same answer.
+
+        Args:
+            prompt (str): the prompt sent to the model
+            system_prompt (str): the system prompt, ignored by the mock
+            model (str): the model name, ignored by the mock
+        '''
+        rng = random.Random(hashlib.sha256(f'{self.seed}:{prompt}'.encode('utf-8')).hexdigest())
+        template_name, params = self.templates.match(prompt)
+        if template_name in self.handlers:
+            answer = self.handlers[template_name](params, rng)
+        else:
+            for fingerprint, handler in self.inline_handlers:
+                if fingerprint in prompt:
+                    answer = handler(prompt, rng)
+                    break
+            else:
+                logging.warning("The mock LLM does not recognize this prompt, returning a generic answer.")
+                answer = {'answer': 'mock answer', 'explanation': 'mock explanation'}
+        return answer if isinstance(answer, str) else json.dumps(answer)
+
+    def _human_actors(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        scenario = p['scenario_description'].lower()
+        roles = [(('bargain', 'buy', 'sell', 'mug'), ['buyer', 'seller']),
+                 (('auction', 'bid'), ['auctioneer', 'bidder 1', 'bidder 2', 'bidder 3']),
+                 (('interview',), ['interviewer', 'job applicant']),
+                 (('judge', 'bail', 'court'), ['judge', 'defendant', 'prosecutor', 'defense attorney']),
+                 (('family', 'couple'), ['partner 1', 'partner 2'])]
+        for keywords, agents in roles:
+            if any(keyword in scenario for keyword in keywords):
+                return {'agents': agents, 'explanation': 'These are the people who speak in the scenario.'}
+        return {'agents': ['host', 'guest'], 'explanation': 'These are the people who speak in the scenario.'}
+
+    def _outcomes(self, p: Dict[str, str], rng: random.Random) -> List[str]:
+        agents = _as_list(p['agents']) or ['host', 'guest']
+        known = [outcome.lower() for outcome in _as_list(p.get('outcomes', '[]'))]
+        pool = ['whether or not an agreement is reached',
+                f"{agents[0]}'s satisfaction with the conversation",
+                'number of statements made before the conversation ends',
+                f"final amount of money offered by the {agents[0]}"]
+        pool += [f"{agent}'s level of {trait}" for trait in ('frustration', 'trust', 'enthusiasm') for agent in agents]
+        return [outcome for outcome in pool if outcome.lower() not in known][:3]
+
+    def _operationalize(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        name = p['variable_name']
+        return {'explanation': f'{name} is measured with a single question after the scenario.',
+                'operationalization': f'{name}, as reported after the conversation',
+                'method_to_obtain_quantity': f'ask the relevant agent about {name} after the conversation',
+                'method_to_vary': f'assign a value of {name} to the relevant agent before the conversation'}
+
+    def _variable_type(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        return {'variable_type': _variable_type(p['variable_name']), 'explanation': 'Based on how the variable is measured.'}
+
+    def _units(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        units = {'binary': 'yes/no', 'count': 'number of times', 'continuous': 'dollars', 'ordinal': 'level from very low to very high'}
+        return {'units': units.get(p['variable_type'].strip(), 'level'), 'explanation': 'Based on the variable type.'}
+
+    def _levels(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        num_levels = int((_numbers(p['num_cont_lvls']) or [5])[0])
+        return {'levels': _levels(p['variable_type'].strip(), num_levels), 'explanation': 'Levels ordered from smallest to largest.'}
+
+    def _measurement_questions(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        name, variable_type = p['variable_name'], p['variable_type'].strip()
+        agents = _as_list(p['relevant_agents'])
+        levels = _as_list(p['levels']) if variable_type != 'continuous' else []
+        agent = _agent_in(name, agents) or ('oracle' if variable_type == 'count' or not agents else agents[0])
+        return {agent: [_measurement_question(name, variable_type, levels)],
+                'aggregation': 'no aggregation is necessary',
+                'explanation': 'A single question gives the value of the variable.'}
+
+    def _causes(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        agents = _as_list(p['relevant_agents']) or ['host']
+        taken = ' '.join([p['variable_name'], p.get('descendant_outcomes', ''), p.get('possible_covariates', '')]).lower()
+        templates = ["{agent}'s budget", "{agent}'s level of patience", "whether the {agent} is in a hurry", "{agent}'s years of experience", "{agent}'s level of confidence"]
+        candidates = [template.format(agent=agent) for template in templates for agent in agents]
+        causes = [cause for cause in candidates if cause.lower() not in taken]
+        num_causes = int((_numbers(p['num_causes']) or [1])[0])
+        return {'causes': causes[:num_causes], 'explanation': 'These are set before the scenario begins.'}
+
+    def _variable_scope(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        agents = _as_list(p['relevant_agents'])
+        agent = _agent_in(p['variable_name'], agents)
+        if agent is None:
+            return {'variable_scope': 'scenario', 'relevant_entity': 'scenario', 'explanation': 'The variable is about the scenario.'}
+        return {'variable_scope': 'individual', 'relevant_entity': agent, 'explanation': 'The variable is about one agent.'}
+
+    def _variation(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        name = p['variable_name']
+        agents = _as_list(p['relevant_agents'])
+        agent = _agent_in(name, agents) or p.get('agent') or (agents[0] if agents else 'scenario')
+        variable_type = p.get('variable_type', _variable_type(name)).strip()
+        levels = _as_list(p['levels'])
+        attribute_name = re.sub(rf"^(the )?{re.escape(agent)}'s ", '', name.strip())
+        return {'attribute_name': attribute_name,
+                'attribute_values': _level_variation(variable_type, levels),
+                'varied_agent': agent,
+                'explanation': 'One value per level of the variable.'}
+
+    def _repeat(self, p: Dict[str, str], rng: random.Random) -> object:
+        previous_response = _literal(p['previous_response'])
+        return previous_response if isinstance(previous_response, (dict, list)) else p['previous_response']
+
+    def _names(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        roles = _as_list(p['agent_roles'])
+        return {'names': rng.sample(NAMES, min(len(roles), len(NAMES))), 'explanation': 'Common first names.'}
+
+    def _info_to_attributes(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        information = _as_list(p['necessary_info'])
+        values = [p['scenario_description'] if 'topic' in info else f'a typical {info}' for info in information]
+        return {'explanation': 'Plausible values for the scenario.', 'information': information, 'values': values}
+
+    def _interaction_type(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        agents = _as_list(p['relevant_agents'])
+        interaction_type = 'ordered' if len(agents) <= 2 else rng.choice(['ordered', 'random', 'center ordered', 'center random'])
+        return {'interaction_type': interaction_type, 'explanation': 'This is the most natural way for these agents to talk.'}
+
+    def _aggregation(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        method = p['aggregation_method'].lower()
+        for keyword, aggregation in (('sum', 'sum'), ('max', 'max'), ('min', 'min'), ('mode', 'mode'), ('median', 'median')):
+            if keyword in method:
+                return {'aggregation': aggregation, 'explanation': f'The measurements are combined with the {aggregation}.'}
+        return {'aggregation': 'average', 'explanation': 'The measurements are averaged.'}
+
+    def _custom_aggregation(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        measurements = [float(value) for value in _as_list(p['measurements']) if _numbers(value)]
+        data_point = str(sum(measurements) / len(measurements)) if measurements else 'na'
+        return {'data point': data_point, 'explanation': 'The average of the measurements.'}
+
+    def _data(self, p: Dict[str, str], variable_type: str) -> Dict:
+        levels = _as_list(p.get('levels', '[]'))
+        level_values = _as_list(p.get('level_values', '[]'))
+        if variable_type == 'binary' and not level_values:
+            level_values = ['0', '1']
+        return {'answer': _extract_value(p['answer'], variable_type, levels, level_values), 'explanation': 'Extracted from the answer.'}
+
+    def _data_many(self, p: Dict[str, str]) -> Dict:
+        try:
+            answers = json.loads(p['answers'])
+        except json.JSONDecodeError:
+            return {'answers': []}
+        return {'answers': [{'index': item['index'], **self._data({**p, 'answer': str(item['answer'])}, p['variable_type'])}
+                            for item in answers]}
+
+    def _survey(self, question: str, rng: random.Random) -> Dict:
+        return {'explanation': 'Based on the conversation and my characteristics.', 'answer': _survey_answer(question, rng)}
+
+    def _survey_many(self, questions: str, rng: random.Random) -> Dict:
+        try:
+            questions = json.loads(questions)
+        except json.JSONDecodeError:
+            return {}
+        return {question_id: self._survey(question, rng) for question_id, question in questions.items()}
+
+    def _continue(self, history: str, rng: random.Random) -> Dict:
+        n_statements = _history_length(history)
+        if n_statements >= 3 and rng.random() < min(1.0, (n_statements - 2) / 8):
+            # to_continue_or_to_finish looks for the word "continue" anywhere in the response
+            return {'explanation': 'The agents have reached a natural end of the conversation.', 'choice': 'complete'}
+        return {'explanation': 'The agents are still in the middle of the conversation.', 'choice': 'continue'}
+
+    def _next_agent(self, p: Dict[str, str], rng: random.Random) -> Dict:
+        agents = _as_list(p['agent_list']) or ['1']
+        return {'explanation': 'This agent has the most to add.', 'choice_of_next_agent': rng.choice(agents)}
+
+    def _inline_continue(self, prompt: str, rng: random.Random) -> Dict:
+        history = re.search(r'the conversation between the agents so far: (.*)\. You must determine', prompt, re.DOTALL)
+        return self._continue(history.group(1) if history else '', rng)
+
+    def _inline_survey(self, prompt: str, rng: random.Random) -> Dict:
+        question = re.search(r"Your task is to answer the following question: '(.*?)'\. When answering", prompt, re.DOTALL)
+        return self._survey(question.group(1) if question else '', rng)
+
+    def _inline_survey_many(self, prompt: str, rng: random.Random) -> Dict:
+        questions = re.search(r'Your task is to answer each of the following questions, keyed by id: (\{.*?\})\n', prompt, re.DOTALL)
+        return self._survey_many(questions.group(1) if questions else '{}', rng)
+
+    def _inline_statement(self, prompt: str, rng: random.Random) -> str:
+        scenario = re.search(r'in this scenario (.*?)\. \n', prompt, re.DOTALL)
+        n_left = re.search(r'at most (\d+) combined statements', prompt)
+        return _statement(rng, scenario.group(1).strip() if scenario else 'this conversation', int(n_left.group(1)) if n_left else 20)
+
+    def _inline_statement_and_decision(self, prompt: str, rng: random.Random) -> Dict:
+        statement = self._inline_statement(prompt, rng)
+        n_statements = re.search(r'there have been (\d+) total statements', prompt)
+        n_statements = int(n_statements.group(1)) + 1 if n_statements else 1
+        complete = 'goodbye' in statement or (n_statements >= 3 and rng.random() < min(1.0, (n_statements - 2) / 8))
+        return {'statement': statement, 'conversation_complete': 'yes' if complete else 'no'}
+
+    def _inline_short_name(self, prompt: str, rng: random.Random) -> Dict:
+        variable_name = re.search(r'abbreviated name for this variable: (.*?)\.\n', prompt, re.DOTALL)
+        words = re.sub(r'[^a-z0-9 ]', '', (variable_name.group(1) if variable_name else 'variable').lower()).split()
+        short_name = '_'.join(word[:7] for word in words if word not in ('the', 'of', 'a', 'an', 'or', 'not'))[:12].strip('_')
+        return {'variable_name': short_name or 'variable', 'explanation': 'First letters of the main words.'}
+
+    def _inline_json_fix(self, prompt: str, rng: random.Random) -> str:
+        invalid_json = re.search(r'The following json is invalid: (.*)\nwith the following error:', prompt, re.DOTALL)
+        return _first_json_block(invalid_json.group(1) if invalid_json else prompt)
+
+    def _inline_summary(self, prompt: str, rng: random.Random) -> str:
+        amounts = re.findall(r'\d+ dollars', prompt)
+        summary = 'The participants introduced themselves and discussed what each of them wants.'
+        if amounts:
+            summary += f" Amounts mentioned so far: {', '.join(dict.fromkeys(amounts))}."
+        return summary
+
+    ############################### transport #########################################
+
+    def _draw(self) -> Tuple[float, float]:
+        '''
+        Draws the latency and a uniform number deciding faults for one call.
+        '''
+        with self._lock:
+            # forked workers would otherwise share the parent's sequence of draws
+            if self._rng is None or self._pid != os.getpid():
+                self._rng = random.Random(f'{self.seed}:{os.getpid()}')
+                self._pid = os.getpid()
+            return self.latency(self._rng), self._rng.random()
+
+    def _chat_completion(self, prompt: str, system_prompt: str, model: str) -> Tuple[Dict, float, Optional[Exception]]:
+        latency, fault = self._draw()
+        if fault < self.rate_limit_rate:
+            return {}, latency, openai.error.RateLimitError("Mock rate limit reached.")
+        if fault < self.rate_limit_rate + self.timeout_rate:
+            return {}, self.timeout_seconds, openai.error.Timeout("Mock request timed out.")
+        content = self.respond(prompt, system_prompt, model)
+        prompt_tokens = count_tokens(prompt, model) + count_tokens(system_prompt, model) + 8
+        completion_tokens = count_tokens(content, model)
+        response = {'model': model,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}}
+        return response, latency + completion_tokens * self.ms_per_token / 1000, None
+
+    def complete(self, prompt: str, system_prompt: str = '', model: str = 'gpt-4') -> Dict:
+        '''
+        Blocking call shaped like openai.ChatCompletion.create: waits for the drawn latency and returns a response dict.
+        '''
+        response, latency, error = self._chat_completion(prompt, system_prompt, model)
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return response
+
+    async def acomplete(self, prompt: str, system_prompt: str = '', model: str = 'gpt-4') -> Dict:
+        '''
+        Async version of complete, shaped like openai.ChatCompletion.acreate.
+        '''
+        response, latency, error = self._chat_completion(prompt, system_prompt, model)
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return response
+
+
+_mock_llm: Optional[MockLLM] = None
+
+def get_mock_llm() -> MockLLM:
+    '''
+    Returns the process-wide mock backend, created on first use.
+    '''
+    global _mock_llm
+    if _mock_llm is None:
+        _mock_llm = MockLLM()
+    return _mock_llm
@@ -0,0 +1,185 @@
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+import functools
+from typing import Optional, Tuple
+
+import tiktoken
+
+# Limits are per model and come from the .env file, e.g. OPENAI_RPM_LIMIT = 500 and OPENAI_TPM_LIMIT = 30000.
+# The limiter is off unless at least one of them is set.
+RATE_LIMIT_PATH: str = os.getenv('LLM_RATE_LIMIT_PATH', os.path.join('experiment_logs', 'llm_rate_limit.sqlite'))
+# completion tokens reserved for a call without max_tokens, corrected with the real usage once the call returns
+COMPLETION_TOKENS_ESTIMATE: int = int(os.getenv('LLM_COMPLETION_TOKENS_ESTIMATE', 256))
+# longest single sleep, so waiting callers re-check the shared bucket regularly
+MAX_SLEEP_SECONDS: float = 5.0
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        # tiktoken downloads its encodings on first use, which fails offline
+        logging.warning("Could not load the tiktoken encoding, estimating tokens from the number of characters.")
+        return None
+
+def count_tokens(text: str, model: str = 'gpt-4') -> int:
+    '''
+    Number of tokens in a string for the given model.
+    '''
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def estimate_request_tokens(prompt: str, system_prompt: str = '', model: str = 'gpt-4', max_tokens: Optional[int] = None) -> int:
+    '''
+    Tokens a chat request counts against the TPM limit: both messages, their formatting overhead and the completion.
+    '''
+    message_overhead = 8
+    completion_tokens = max_tokens if max_tokens is not None else COMPLETION_TOKENS_ESTIMATE
+    return count_tokens(prompt, model) + count_tokens(system_prompt, model) + message_overhead + completion_tokens
+
+
+class TokenBucketRateLimiter:
+    '''
+    Token buckets for requests per minute and tokens per minute, shared by every thread and process using the same state file.
+    Callers block in acquire until both buckets can pay for the request, instead of sending it and backing off after a 429.
+    The buckets live in a SQLite file and are updated in an immediate transaction, which works as a cross-process lock.
+
+    Args:
+        rpm (int, optional): requests per minute, None for no request limit
+        tpm (int, optional): tokens per minute, None for no token limit
+        path (str): path to the SQLite state file
+    '''
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None, path: str = RATE_LIMIT_PATH) -> None:
+        self.rpm: Optional[int] = rpm
+        self.tpm: Optional[int] = tpm
+        self.path: str = path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections can't be shared with forked workers, so every process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            connection.execute('''CREATE TABLE IF NOT EXISTS buckets (
+                                    name TEXT PRIMARY KEY,
+                                    requests REAL NOT NULL,
+                                    tokens REAL NOT NULL,
+                                    updated_at REAL NOT NULL)''')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _refill(self, requests: float, tokens: float, elapsed: float) -> Tuple[float, float]:
+        if self.rpm is not None:
+            requests = min(self.rpm, requests + elapsed * self.rpm / 60)
+        if self.tpm is not None:
+            tokens = min(self.tpm, tokens + elapsed * self.tpm / 60)
+        return requests, tokens
+
+    def _try_acquire(self, name: str, n_tokens: int) -> float:
+        '''
+        Takes one request and n_tokens from the buckets if they are available.
+        Returns 0 on success, otherwise the number of seconds until they should be.
+        '''
+        # a request larger than the whole bucket can never fit, so it only waits for a full bucket
+        if self.tpm is not None:
+            n_tokens = min(n_tokens, self.tpm)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute('SELECT requests, tokens, updated_at FROM buckets WHERE name = ?', (name,)).fetchone()
+                if row is None:
+                    requests, tokens = float(self.rpm or 0), float(self.tpm or 0)
+                else:
+                    requests, tokens = self._refill(row[0], row[1], max(0.0, now - row[2]))
+
+                wait = 0.0
+                if self.rpm is not None and requests < 1:
+                    wait = max(wait, (1 - requests) * 60 / self.rpm)
+                if self.tpm is not None and tokens < n_tokens:
+                    wait = max(wait, (n_tokens - tokens) * 60 / self.tpm)
+                if wait == 0.0:
+                    requests -= 1 if self.rpm is not None else 0
+                    tokens -= n_tokens if self.tpm is not None else 0
+
+                connection.execute('INSERT OR REPLACE INTO buckets (name, requests, tokens, updated_at) VALUES (?, ?, ?, ?)',
+                                   (name, requests, tokens, now))
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        return wait
+
+    def acquire(self, name: str, n_tokens: int) -> None:
+        '''
+        Blocks until the request can be sent.
+
+        Args:
+            name (str): the bucket, usually the model name since OpenAI limits are per model
+            n_tokens (int): estimated tokens of the request, see estimate_request_tokens
+        '''
+        while True:
+            wait = self._try_acquire(name, n_tokens)
+            if wait == 0.0:
+                return
+            time.sleep(min(wait, MAX_SLEEP_SECONDS))
+
+    async def aacquire(self, name: str, n_tokens: int) -> None:
+        '''
+        Async version of acquire, waits with asyncio.sleep so the other calls on the loop keep going.
+        The SQLite transaction can block on other processes, so it runs in a worker thread.
+        '''
+        while True:
+            wait = await asyncio.to_thread(self._try_acquire, name, n_tokens)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(min(wait, MAX_SLEEP_SECONDS))
+
+    def settle(self, name: str, estimated_tokens: int, actual_tokens: int) -> None:
+        '''
+        Corrects the token bucket once the real usage of a request is known.
+        An underestimate leaves the bucket in debt, which later callers wait out.
+        '''
+        if self.tpm is None or estimated_tokens == actual_tokens:
+            return
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute('UPDATE buckets SET tokens = MIN(?, tokens + ?) WHERE name = ?',
+                                   (self.tpm, min(estimated_tokens, self.tpm) - actual_tokens, name))
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+
+_rate_limiter: Optional[TokenBucketRateLimiter] = None
+
+def get_rate_limiter() -> Optional[TokenBucketRateLimiter]:
+    '''
+    Returns the process-wide rate limiter for OpenAI calls, or None if no limit is configured.
+    '''
+    global _rate_limiter
+    rpm, tpm = os.getenv('OPENAI_RPM_LIMIT'), os.getenv('OPENAI_TPM_LIMIT')
+    if rpm is None and tpm is None:
+        return None
+    if _rate_limiter is None:
+        _rate_limiter = TokenBucketRateLimiter(rpm=int(rpm) if rpm else None, tpm=int(tpm) if tpm else None)
+    return _rate_limiter
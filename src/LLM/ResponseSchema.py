@@ -0,0 +1,87 @@
+import os
+import re
+import functools
+from typing import Dict, List, Optional
+
+import yaml
+
+# Each template directory can declare the keys of its JSON responses in this file, see JudeaPearl/prompt_templates
+SCHEMA_FILE: str = 'response_schemas.yaml'
+
+
+def _normalize_key(key: str) -> str:
+    return re.sub(r'[\s_\-]+', '', str(key).lower())
+
+
+class ResponseSchema:
+    '''
+    The keys a JSON response to a prompt template must have.
+
+    Args:
+        name (str): name of the template the schema belongs to
+        keys (list): required keys of the response
+    '''
+    def __init__(self, name: str, keys: List[str]) -> None:
+        self.name: str = name
+        self.keys: List[str] = [str(key) for key in keys]
+
+    def __repr__(self):
+        return f'ResponseSchema({self.name}: {self.keys})'
+
+    def missing_keys(self, response: object) -> List[str]:
+        if not isinstance(response, dict):
+            return list(self.keys)
+        return [key for key in self.keys if key not in response]
+
+    def fix_keys(self, response: object) -> object:
+        '''
+        Local fixes for responses that have the right content under slightly wrong keys:
+        keys that only differ in spacing, underscores or dashes ("variable type" for "variable_type")
+        and responses wrapped in a single outer key ({"response": {...}}).
+        '''
+        if isinstance(response, dict) and len(response) == 1:
+            inner = next(iter(response.values()))
+            if isinstance(inner, dict) and not self.missing_keys(inner):
+                return inner
+        if not isinstance(response, dict):
+            return response
+        normalized = {_normalize_key(key): key for key in response}
+        fixed = dict(response)
+        for key in self.missing_keys(response):
+            original_key = normalized.get(_normalize_key(key))
+            if original_key is not None:
+                fixed[key] = fixed.pop(original_key)
+        return fixed
+
+    def repair_prompt(self, raw_output: str) -> str:
+        '''
+        A short prompt asking the LLM to put a response it already gave in the expected format.
+        '''
+        keys = ', '.join(f'"{key}"' for key in self.keys)
+        return f'''The following response should be a JSON with the keys {keys}, but it is invalid or some keys are missing:
+{raw_output}
+Rewrite it as a valid JSON with exactly these keys, keeping all of the information in the response.
+Format your output as the JSON only, without any other text, so it can be loaded directly into python as a json string.'''
+
+
+@functools.lru_cache(maxsize=None)
+def load_response_schemas(template_dir: str) -> Dict[str, ResponseSchema]:
+    '''
+    Reads the response schemas of a template directory, an empty dict if it has none.
+    '''
+    path = os.path.join(template_dir, SCHEMA_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        schemas = yaml.safe_load(f) or {}
+    return {name: ResponseSchema(name, schema['keys']) for name, schema in schemas.items()}
+
+def response_schema(prompt_name: str, template_dir: str = "prompt_templates") -> Optional[ResponseSchema]:
+    '''
+    The response schema declared for a template, or None if the template has none.
+
+    Args:
+        prompt_name (str): the name of the template file in the template directory
+        template_dir (str, optional): the directory where the template is stored. Defaults to "prompt_templates".
+    '''
+    return load_response_schemas(template_dir).get(prompt_name)
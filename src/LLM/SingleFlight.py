@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import weakref
+from typing import Awaitable, Callable, Dict, Optional
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    '''
+    Collapses identical calls that are in flight at the same time into one: the first caller of a key makes the call,
+    the others wait for it and get the same result (or exception). Works across the threads of a process with do
+    and across the tasks of an event loop with ado. Once a call returns, its key is free again, so later calls
+    go through the response cache as usual.
+    '''
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls = weakref.WeakKeyDictionary()
+        # number of calls that were answered by another caller's request
+        self.shared: int = 0
+
+    def do(self, key: str, fn: Callable[[], str]) -> str:
+        '''
+        Returns fn(), sharing the result with the threads that ask for the same key while it runs.
+        '''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        '''
+        Async version of do, sharing the result with the tasks of the running loop that ask for the same key.
+        '''
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            self.shared += 1
+            # shield so that a cancelled follower doesn't cancel the call for everyone else
+            return await asyncio.shield(future)
+
+        future = calls[key] = loop.create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # the leader raises itself, followers (if any) retrieve the exception from the future
+            future.exception()
+            raise
+        finally:
+            del calls[key]
+
+
+_single_flight = SingleFlight()
+
+def get_single_flight() -> SingleFlight:
+    '''
+    Returns the process-wide SingleFlight used by LanguageModel for cacheable calls.
+    '''
+    return _single_flight
@@ -1,6 +1,9 @@
 from jinja2 import Template, Environment, meta, FileSystemLoader
+import os
 import json
-from typing import Dict, List, Union
+import logging
+import threading
+from typing import Dict, FrozenSet, List, Tuple, Union
 from json.decoder import JSONDecodeError
 import sys
 
@@ -70,21 +73,78 @@ class PromptBuilder:
         variables = meta.find_undeclared_variables(ast)
         return list(variables)
 
+class TemplateRegistry:
+    '''
+    Compiled templates shared by the whole process. The first time a template directory is used,
+    every template in it is read, compiled and its variables are extracted; afterwards getting
+    a template is a dictionary lookup.
+    '''
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._templates: Dict[Tuple[str, str], Tuple[Template, FrozenSet[str]]] = {}
+        self._loaded_dirs: set = set()
+
+    def load_directory(self, template_dir: str) -> None:
+        '''
+        Compiles all the templates of a directory. Templates that don't parse are skipped with a warning.
+        '''
+        directory = os.path.abspath(template_dir)
+        with self._lock:
+            if directory in self._loaded_dirs:
+                return
+            library = PromptLibrary(directory)
+            for template_name in library.show_templates():
+                try:
+                    self._compile(directory, template_name, library)
+                except Exception as e:
+                    logging.warning(f"Could not compile the prompt template {template_name}: {e}")
+            self._loaded_dirs.add(directory)
+
+    def _compile(self, directory: str, template_name: str, library: PromptLibrary) -> Tuple[Template, FrozenSet[str]]:
+        template_string = library.get_template_string(template_name)
+        variables = frozenset(meta.find_undeclared_variables(library.env.parse(template_string)))
+        compiled = (Template(template_string), variables)
+        self._templates[(directory, template_name)] = compiled
+        return compiled
+
+    def get(self, template_name: str, template_dir: str = "prompt_templates") -> Tuple[Template, FrozenSet[str]]:
+        '''
+        Returns the compiled template and the set of variables it uses.
+        '''
+        directory = os.path.abspath(template_dir)
+        compiled = self._templates.get((directory, template_name))
+        if compiled is not None:
+            return compiled
+        self.load_directory(directory)
+        compiled = self._templates.get((directory, template_name))
+        if compiled is None:
+            # not in the directory when it was loaded (or broken): compile it on its own so the error surfaces
+            with self._lock:
+                compiled = self._compile(directory, template_name, PromptLibrary(directory))
+        return compiled
+
+
+_template_registry = TemplateRegistry()
+
+def get_template_registry() -> TemplateRegistry:
+    return _template_registry
+
+
 class PromptMixin:
     def generate_prompt(self, prompt_name: str, template_dir: str = "prompt_templates", **kwargs) -> str:
         '''
         Creates a prompt from a template and a dictionary of variables to fill in the template.
+        The template comes compiled from the process-wide TemplateRegistry.
 
         Args:
             prompt_name (str): The name of the template file in the template directory.
             template_dir (str, optional): The directory where the template is stored. Defaults to "prompt_templates".
             **kwargs: The variables to fill in the template.
         '''
-        prompt_library = PromptLibrary(template_dir)
-        prompt_string = prompt_library.get_template_string(prompt_name)
-        prompt_template = PromptBuilder(prompt_string)
-        prompt = prompt_template.build_prompt(kwargs)
-        return prompt
+        template, variables = get_template_registry().get(prompt_name, template_dir)
+        if not variables.issubset(kwargs.keys()):
+            raise ValueError(f"The data is not valid. The valid data is : {list(variables)}")
+        return template.render(kwargs)
     
     def get_prompt_variables(self, prompt_name: str , template_dir: str = "prompt_templates") -> List[str]:
         '''
@@ -94,11 +154,7 @@ class PromptMixin:
             prompt_name (str): The name of the template file in the template directory.
             template_dir (str, optional): The directory where the template is stored. Defaults to "prompt_templates".
         '''
-        prompt_library = PromptLibrary(template_dir)
-        prompt_string = prompt_library.get_template_string(prompt_name)
-        env = Environment()
-        ast = env.parse(prompt_string)
-        variables = meta.find_undeclared_variables(ast)
+        _, variables = get_template_registry().get(prompt_name, template_dir)
         return list(variables)
 
 
@@ -4,11 +4,16 @@
 from pathlib import Path
 from typing import Optional
 import logging
+import time
 import sys
 import os
 import json
+import asyncio
+import threading
 import pandas as pd
-from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
 from functools import partial
 from tqdm import tqdm
 
@@ -19,23 +24,23 @@ sys.path.append('./src/Question')
 
 import typer
 from typing import List
-from .utils import generate_all_combinations_with_mapping, get_info_from_scm, reorganize_data, ensure_directory, save_json, get_valid_number, subsampler
+from .utils import generate_all_combinations_with_mapping, get_info_from_scm, reorganize_data, ensure_directory, save_json, get_valid_number, subsampler, JsonlWriter, compact_jsonl, combination_key, load_completed, read_jsonl
 
 from src import ERRORS, __app_name__, __version__, config, database
 
 from src import __app_name__, __version__
 
 
-from LLM import LanguageModel, LLMMixin, llm_json_loader
+from LLM import LanguageModel, LLMMixin, llm_json_loader, default_family
+from Metrics import get_metrics_registry
 from AgentBuilder import AgentBuilder
 from Human import Human
+from Simulation import Simulation, LockstepRunner, TURN_MODES
 from Interaction import SocialInteraction
 from StructuralCausalModelBuilder import StructuralCausalModelBuilder
 from Prompting import PromptMixin
 from JudeaPearl import JudeaPearl
-from DataParser import DataParser
-from DataCleaner import DataCleaner
-from DataAnalyst import DataAnalyst
+from AnalysisPipeline import AnalysisPipeline
 
 from jinja2 import Environment, FileSystemLoader
 
@@ -47,6 +52,13 @@ env = Environment(loader=FileSystemLoader(templates_dir))
 
 app = typer.Typer()
 
+# Number of survey questions of one simulation asked at the same time
+SURVEY_CONCURRENCY: int = int(os.getenv('SURVEY_CONCURRENCY', 8))
+# Ask each respondent all of its survey questions in one prompt instead of one prompt per question
+SURVEY_BATCH_QUESTIONS: bool = os.getenv('SURVEY_BATCH_QUESTIONS', 'off').lower() in ('on', 'true', '1', 'yes')
+# With --pipeline, the number of finished conversations that can wait for or be in their survey before the simulations pause
+PIPELINE_QUEUE_DEPTH: int = int(os.getenv('PIPELINE_QUEUE_DEPTH', 2 * (os.cpu_count() or 1)))
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # @app.command()
@@ -81,7 +93,7 @@ def build_agent(scm_json: str,
                 temp_scientist: float = typer.Option(0.3, help="Temperature for the large language model scientist")):
     """Build the agents."""
     typer.echo(f"Building agent from file {scm_json}")
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
     
     loaded_scm = StructuralCausalModelBuilder.deserialize(scm_json)
     
@@ -101,7 +113,7 @@ def build_interaction(scm_json: str,
     """Build the interaction type."""
     # typer.echo(f"Building interaction from SCM JSON")
     
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
     
     loaded_scm = StructuralCausalModelBuilder.deserialize(scm_json)
     agent_builder = AgentBuilder(template_dir=templates_dir)
@@ -120,68 +132,42 @@ def perform_simulation(
         ENDOGENOUS_VARIABLES: list, 
         OPERATIONALIZATION: str = typer.Option(None, help="a detailed description of how the variables are calibrated"), 
         max_interactions: int = typer.Option(20, help="Maximum number of interactions"),
-        temp_subject: float = typer.Option(0.3, help="Temperature for the large language model agents")
+        temp_subject: float = typer.Option(0.3, help="Temperature for the large language model agents"),
+        turn_mode: str = typer.Option("two-call", help="How the end of the conversation is decided, see TURN_MODES"),
+        check_every: int = typer.Option(3, help="In the 'periodic' turn mode, the number of turns between two continue checks")
     ):
     """Perform agent simulation"""
     # typer.echo(f"Processing scenario: {scenario} with max interactions: {max_interactions}")
-    
-    agentsInfo = agent_list
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_subject)
-    
-    agents = {}
-    agent_list = []
-    conversation_history = []
-
-    for agent_type, attributes in agentsInfo.items():
-        agent = Human(attributes)
-        agent.add_LLM(LLM)
-        agents[agent_type] = agent
-        agent_list.append(agent)
-
-    # intialize the Interaction
-    S = SocialInteraction(agent_list, scenario=scenario)
-    S.add_LLM(LLM)
-    generator = S.gen_func_dispatch[interaction_type](order_dict)
-    # determine the order
-    FirstAgent = agents[next(generator)]
-    SecondAgent = agents[next(generator)]
-    others = [agent for agent in agent_list if agent != FirstAgent]
-    interactions = 0
-    n_left = max_interactions - interactions
-    
-    ## Make first statement
-    statement = FirstAgent.make_public_statement(others, scenario, interactions, n_left, conversation_history)
-    print("No.0", FirstAgent.name, ":", statement['statement'])
-    
-    S.statements.append({FirstAgent.name: statement['statement']})
-    conversation_history.append({FirstAgent.name: statement['statement']})
-
+    simulation = Simulation(agent_list, order_dict, scenario, interaction_type, ENDOGENOUS_VARIABLES,
+                            OPERATIONALIZATION=OPERATIONALIZATION, max_interactions=max_interactions,
+                            temp_subject=temp_subject, turn_mode=turn_mode, check_every=check_every)
     # Continue to talk until the ending condition is met
-    while True:
-        interactions += 1
-        n_left -= 1
-        others = [agent for agent in agent_list if agent != SecondAgent]
-        newstatement = SecondAgent.make_public_statement(others, scenario,interactions, n_left, conversation_history)
-        name = SecondAgent.name
-        FirstAgent = SecondAgent
-        SecondAgent = agents[next(generator)]
-        statement = newstatement
-        print(f"No.{interactions}", name,":", statement['statement'])
-        
-        conversation_history.append({name: statement['statement']})
-        S.statements.append({name: statement['statement']})
-
-        # Determine the ending condition
-        to_continue = FirstAgent.to_continue_or_to_finish(scenario, agent_list, OPERATIONALIZATION= OPERATIONALIZATION,ENDOGENOUS_VARIABLES=ENDOGENOUS_VARIABLES,history=conversation_history)
-        if not to_continue:
-            print('Ending condition is reached!')
-            break
-        if interactions >= max_interactions-1:
-            break  
-        
-    return conversation_history
+    return simulation.run()
 
-def parallel_run(func, combined_dicts, output_dir, **params):
+def resume_from_log(jsonl_path, field, keys, what="simulations", on_done=None):
+    """
+    Load the results a previous run already logged, so that only the missing ones are run again.
+
+    Args:
+    jsonl_path (str): The JSON lines log of the results.
+    field (str): The field of the records holding the result, e.g. "history".
+    keys (list): The combination_key of the inputs of each result.
+    what (str): What the results are, for the message.
+    on_done (callable, optional): Called with the index and value of each logged result.
+
+    Returns:
+    dict, list: The logged results by index and the indices left to run.
+    """
+    completed = load_completed(jsonl_path, field, keys)
+    pending = [index for index in range(len(keys)) if index not in completed]
+    if completed:
+        typer.echo(f"Resuming: {len(completed)} of {len(keys)} {what} already done")
+    if on_done is not None:
+        for index, value in completed.items():
+            on_done(index, value)
+    return completed, pending
+
+def parallel_run(func, combined_dicts, output_dir, on_done=None, max_pending=None, **params):
     """
     Run an experiment with given parameters and a specific simulation or measurement function.
 
@@ -189,6 +175,8 @@ def parallel_run(func, combined_dicts, output_dir, **params):
     func (callable): A function to perform the experiment (e.g., perform_simulation or perform_measurement).
     combined_dicts (list): A list of dictionaries, each representing parameters for a single run.
     output_dir (str): The directory where results should be saved.
+    on_done (callable, optional): Called with the index and history of each simulation once it is available, including those resumed from the log.
+    max_pending (int, optional): The maximum number of simulations submitted and not yet handed to on_done, so an on_done that blocks pauses the simulations. Defaults to None for no limit.
     **params: Arbitrary keyword arguments needed for the function `func`.
     """
     total_iterations = len(combined_dicts)
@@ -198,18 +186,90 @@ def parallel_run(func, combined_dicts, output_dir, **params):
         typer.echo("Missing required parameters: 'combined_dicts' or 'output_dir'")
         return
     scenario = params.get('scenario', 'default_scenario')
+    history_path = os.path.join(output_dir, f"history_{scenario}.jsonl")
+    keys = [combination_key(agent_dict) for agent_dict in combined_dicts]
+    histories, pending = resume_from_log(history_path, "history", keys, on_done=on_done)
     
     partial_call = partial(func, **params)
-    with ProcessPoolExecutor() as executor:
-        combined_results = list(executor.map(partial_call, combined_dicts))
+    errors = []
+    queue = deque(pending)
+    futures = {}
+    log_lock = threading.Lock()
+
+    def log_history(index, future):
+        if future.exception() is None:
+            with log_lock:
+                history_log.write({"index": index, "key": keys[index], "history": future.result()})
+
+    def submit_pending():
+        while queue and (max_pending is None or len(futures) < max_pending):
+            index = queue.popleft()
+            future = executor.submit(partial_call, combined_dicts[index])
+            future.add_done_callback(partial(log_history, index))
+            futures[future] = index
+
+    # each history is logged as soon as its simulation is done, even while on_done blocks, so a crash only loses the simulations in progress
+    # (the log is closed after the executor, which runs the callbacks)
+    with JsonlWriter(history_path) as history_log, ProcessPoolExecutor() as executor:
+        submit_pending()
+        while futures:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures.pop(future)
+                try:
+                    histories[index] = future.result()
+                except Exception as e:
+                    logging.error(f"Simulation {index} failed: {e}")
+                    errors.append(e)
+                    continue
+                if on_done is not None:
+                    on_done(index, histories[index])
+            submit_pending()
+    if errors:
+        raise errors[0]
         
-    histories = combined_results
-    data_to_save = {"histories": histories}
-    save_json(data_to_save, f"history_{scenario}.json", output_dir)
+    compact_jsonl(history_path, "history", "histories", f"history_{scenario}.json", output_dir, keys)
+    
+    return [histories[index] for index in range(total_iterations)]
+    
+def batched_run(combined_dicts, output_dir, on_done=None, **params):
+    """
+    Run all the simulations in this process, advancing them together one statement per tick with concurrent async LLM calls.
+
+    Args:
+    combined_dicts (list): A list of dictionaries, each representing the agents of a single simulation.
+    output_dir (str): The directory where results should be saved.
+    on_done (callable, optional): Called with the index and history of each simulation once it is available, including those resumed from the log.
+    **params: The other arguments of perform_simulation.
+    """
+    total_iterations = len(combined_dicts)
+    typer.echo(f"There are {total_iterations} simulations in total")
     
-    return histories
+    if not combined_dicts or not output_dir:
+        typer.echo("Missing required parameters: 'combined_dicts' or 'output_dir'")
+        return
+    
+    scenario = params.get('scenario', 'default_scenario')
+    history_path = os.path.join(output_dir, f"history_{scenario}.jsonl")
+    keys = [combination_key(agent_dict) for agent_dict in combined_dicts]
+    histories, pending = resume_from_log(history_path, "history", keys, on_done=on_done)
+    
+    with JsonlWriter(history_path) as history_log, \
+            tqdm(total=total_iterations, initial=len(histories), desc="Progress") as pbar:
+        async def simulation_done(pending_index, history):
+            index = pending[pending_index]
+            histories[index] = history
+            history_log.write({"index": index, "key": keys[index], "history": history})
+            pbar.update(1)
+            if on_done is not None:
+                # on_done may block (a full measurement queue), which pauses the simulations without blocking the event loop
+                await asyncio.to_thread(on_done, index, history)
+        LockstepRunner().run([combined_dicts[index] for index in pending], on_done=simulation_done, **params)
     
-def sequential_run(func, combined_dicts, output_dir, **params):
+    compact_jsonl(history_path, "history", "histories", f"history_{scenario}.json", output_dir, keys)
+    return [histories[index] for index in range(total_iterations)]
+    
+def sequential_run(func, combined_dicts, output_dir, on_done=None, **params):
     """
     Run an experiment sequentially with given parameters and a specific simulation or measurement function.
 
@@ -217,30 +277,40 @@ def sequential_run(func, combined_dicts, output_dir, **params):
     func (callable): A function to perform the experiment (e.g., perform_simulation or perform_measurement).
     combined_dicts (list): A list of dictionaries, each representing parameters for a single run.
     output_dir (str): The directory where results should be saved.
+    on_done (callable, optional): Called with the index and history of each simulation once it is available, including those resumed from the log.
     **params: Arbitrary keyword arguments needed for the function `func`.
     """
     total_iterations = len(combined_dicts)
     typer.echo(f"There are {total_iterations} simulations in total")
-    logs = []
-    
-    with tqdm(total=total_iterations, desc="Progress") as pbar:
-        for agent_dict in combined_dicts:
+    scenario = params.get('scenario', 'default_scenario')
+    history_path = os.path.join(output_dir, f"history_{scenario}.jsonl")
+    keys = [combination_key(agent_dict) for agent_dict in combined_dicts]
+    logs, pending = resume_from_log(history_path, "history", keys, on_done=on_done)
+    
+    # each history is appended to the log as soon as it is done, the json file is written once at the end
+    with JsonlWriter(history_path) as history_log, \
+            tqdm(total=total_iterations, initial=len(logs), desc="Progress") as pbar:
+        for index in pending:
+            agent_dict = combined_dicts[index]
             print(agent_dict)
             pbar.update(1)
             # Call the provided function with parameters unpacked and the current agent_dict
-            history = func(agent_dict, **params)
-            logs.append(history)
-            data_to_save = {"histories": logs}
+            logs[index] = func(agent_dict, **params)
+            history_log.write({"index": index, "key": keys[index], "history": logs[index]})
+            if on_done is not None:
+                on_done(index, logs[index])
 
-             # Save every logs at once after the loop to save the file correctly
-            save_json(data_to_save, f"history_{params.get('scenario', 'default_scenario')}.json", output_dir)
-    return logs
+    compact_jsonl(history_path, "history", "histories", f"history_{scenario}.json", output_dir, keys)
+    return [logs[index] for index in range(total_iterations)]
     
 
-def call_measurement(history: str, measurementsInfo: str, agent_str: str, ENDOGENOUS_VARIABLES: List[str], SCNEARIO_DESCRIPTION: str, OPERATIONALIZATION:str):
-    """Perform measurements based on the simulation history"""
+async def acall_measurement(history: str, measurementsInfo: str, agent_str: str, ENDOGENOUS_VARIABLES: List[str], SCNEARIO_DESCRIPTION: str, OPERATIONALIZATION:str, max_concurrency: int = SURVEY_CONCURRENCY, batch_questions: bool = SURVEY_BATCH_QUESTIONS):
+    """
+    Perform measurements based on the simulation history, asking at most max_concurrency survey prompts at once.
+    With batch_questions, each agent (and the oracle) gets all of its questions in one prompt, so the transcript is sent once per respondent.
+    """
     responses = {}
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=.0)
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=.0)
     prompt_mixin = PromptMixin()
 
     agents = {}
@@ -257,9 +327,32 @@ def call_measurement(history: str, measurementsInfo: str, agent_str: str, ENDOGE
         agents[agent_type] = Human(attributes)
         agents[agent_type].add_LLM(LLM)
         agent_list.append(agents[agent_type])
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def ask(variable_name, agent_name, question):
+        async with semaphore:
+            # Oracle case
+            if agent_name == 'oracle':
+                prompt_params = { 
+                    "SCNEARIO_DESCRIPTION": SCNEARIO_DESCRIPTION,
+                    "NAME_AND_ROLE": NAME_AND_ROLE,
+                    "history": history,
+                    "question":question,
+                    "EXDOGENOUS": EXDOGENOUS,
+                    "variable_name":variable_name,
+                    "OPERATIONALIZATION": OPERATIONALIZATION
+                    }
+                prompt = prompt_mixin.generate_prompt("survey_oracle.txt", template_dir = Interaction_templates_dir, **prompt_params)
+                return await LLM.acall_llm(prompt)
+
+            # Agent cases
+            others = [agent for agent in agent_list if agent != agent_name]
+            return await agents[agent_name].asurvey(others, SCNEARIO_DESCRIPTION, question, history, EXDOGENOUS=EXDOGENOUS, VARIABLE=variable_name, OPERATIONALIZATION=OPERATIONALIZATION)
             
     responses = {}
-
+    # every question only depends on the finished history, so they are all asked together
+    questions_asked = []
     for variable_name in measurementsInfo:
         if variable_name in ENDOGENOUS_VARIABLES:
             for agent_name, questions_data in measurementsInfo[variable_name].items():
@@ -271,31 +364,53 @@ def call_measurement(history: str, measurementsInfo: str, agent_str: str, ENDOGE
                         responses[variable_name] = {}
                     if agent_name not in responses[variable_name]:
                         responses[variable_name][agent_name] = {}
-                    
-                    # Oracle case
-                    if agent_name == 'oracle':
-                        prompt_params = { 
-                            "SCNEARIO_DESCRIPTION": SCNEARIO_DESCRIPTION,
-                            "NAME_AND_ROLE": NAME_AND_ROLE,
-                            "history": history,
-                            "question":question,
-                            "EXDOGENOUS": EXDOGENOUS,
-                            "variable_name":variable_name,
-                            "OPERATIONALIZATION": OPERATIONALIZATION
-                            }
-                        prompt = prompt_mixin.generate_prompt("survey_oracle.txt", template_dir = Interaction_templates_dir, **prompt_params)
-                        
-                        survey_answer = LLM.call_llm(prompt)
-                        
-                        responses[variable_name][agent_name][question] = survey_answer
-
-                    # Agent cases
-                    else:
-                        others = [agent for agent in agent_list if agent != agent_name]
-                        survey_answer = agents[agent_name].survey(others, SCNEARIO_DESCRIPTION, question, history, EXDOGENOUS=EXDOGENOUS, VARIABLE=variable_name, OPERATIONALIZATION=OPERATIONALIZATION)
-                        # store to response
-                        responses[variable_name][agent_name][question] = survey_answer
+                    questions_asked.append((variable_name, agent_name, question))
+
+    async def ask_respondent(agent_name, asked):
+        # all the questions of one respondent in one prompt, the ones missing from the answer are asked one by one
+        if len(asked) == 1:
+            return [await ask(*asked[0])]
+        questions = {f"q{number + 1}": (question, variable_name) for number, (variable_name, _, question) in enumerate(asked)}
+        async with semaphore:
+            if agent_name == 'oracle':
+                prompt_params = { 
+                    "SCNEARIO_DESCRIPTION": SCNEARIO_DESCRIPTION,
+                    "NAME_AND_ROLE": NAME_AND_ROLE,
+                    "history": history,
+                    "questions": json.dumps({question_id: question for question_id, (question, _) in questions.items()}),
+                    "variables": json.dumps({question_id: variable_name for question_id, (_, variable_name) in questions.items()}),
+                    "EXDOGENOUS": EXDOGENOUS,
+                    "OPERATIONALIZATION": OPERATIONALIZATION
+                    }
+                prompt = prompt_mixin.generate_prompt("survey_oracle_batch.txt", template_dir = Interaction_templates_dir, **prompt_params)
+                answers = Human.parse_survey_answers(await LLM.acall_llm(prompt, json_mode=True), questions)
+            else:
+                others = [agent for agent in agent_list if agent != agent_name]
+                answers = await agents[agent_name].asurvey_many(others, SCNEARIO_DESCRIPTION, questions, history, EXDOGENOUS=EXDOGENOUS, OPERATIONALIZATION=OPERATIONALIZATION)
+
+        async def answer(question_id, asked_question):
+            if question_id in answers:
+                return answers[question_id]
+            return await ask(*asked_question)
+        return await asyncio.gather(*(answer(question_id, asked_question) for question_id, asked_question in zip(questions, asked)))
+
+    if batch_questions:
+        by_respondent = {}
+        for asked in questions_asked:
+            by_respondent.setdefault(asked[1], []).append(asked)
+        respondent_answers = await asyncio.gather(*(ask_respondent(agent_name, asked) for agent_name, asked in by_respondent.items()))
+        questions_asked = [asked for asked_by_respondent in by_respondent.values() for asked in asked_by_respondent]
+        survey_answers = [survey_answer for answers in respondent_answers for survey_answer in answers]
+    else:
+        survey_answers = await asyncio.gather(*(ask(*asked) for asked in questions_asked))
+    # store to response
+    for (variable_name, agent_name, question), survey_answer in zip(questions_asked, survey_answers):
+        responses[variable_name][agent_name][question] = survey_answer
     return responses
+
+def call_measurement(history: str, measurementsInfo: str, agent_str: str, ENDOGENOUS_VARIABLES: List[str], SCNEARIO_DESCRIPTION: str, OPERATIONALIZATION:str, max_concurrency: int = SURVEY_CONCURRENCY, batch_questions: bool = SURVEY_BATCH_QUESTIONS):
+    """Perform measurements based on the simulation history"""
+    return asyncio.run(acall_measurement(history, measurementsInfo, agent_str, ENDOGENOUS_VARIABLES, SCNEARIO_DESCRIPTION, OPERATIONALIZATION, max_concurrency=max_concurrency, batch_questions=batch_questions))
     
 # @app.command() 
 def perform_measurement(args):
@@ -304,15 +419,98 @@ def perform_measurement(args):
     typer.echo(f"Performing measurement on the question {measurementsInfo}.")
     return call_measurement(history=history, agent_str=agent_str, measurementsInfo=measurementsInfo, ENDOGENOUS_VARIABLES= ENDOGENOUS_VARIABLES, SCNEARIO_DESCRIPTION=scenario, OPERATIONALIZATION= OPERATIONALIZATION)
 
+class MeasurementQueue:
+    """
+    Surveys the simulations in worker processes as their histories are submitted, logging each survey to
+    survey_{scenario}.jsonl as soon as it is done. Surveys already logged for the same agents and history are reused.
+    With a depth, submit waits while depth surveys are queued or running, so the simulations feeding the queue
+    can't get ahead of the measurement by more than that.
+
+    Args:
+    output_dir (str): The directory of the survey log.
+    scenario (str): The scenario description.
+    measurementsInfo (dict): The measurement questions of each variable.
+    ENDOGENOUS_VARIABLES (list): The outcome variables.
+    OPERATIONALIZATION (str): How the variables are measured.
+    depth (int, optional): The maximum number of surveys queued or running. Defaults to None for no limit.
+    """
+    def __init__(self, output_dir, scenario, measurementsInfo, ENDOGENOUS_VARIABLES, OPERATIONALIZATION, depth=None):
+        self.path = os.path.join(output_dir, f"survey_{scenario}.jsonl")
+        self.scenario = scenario
+        self.measurementsInfo = measurementsInfo
+        self.ENDOGENOUS_VARIABLES = ENDOGENOUS_VARIABLES
+        self.OPERATIONALIZATION = OPERATIONALIZATION
+        self.depth = depth
+        self.logged = {record['index']: record for record in read_jsonl(self.path)}
+        self.surveys = {}
+        self.resumed = 0
+        self.in_flight = {}
+        self._keys = {}
+        self.errors = []
+        self.executor = ProcessPoolExecutor()
+        self.log = JsonlWriter(self.path)
+
+    def submit(self, index, agent_dict, history):
+        """Queue the survey of a finished simulation, unless it was already submitted or logged."""
+        if index in self.surveys or index in self._keys:
+            return
+        key = combination_key(agent_dict, history)
+        record = self.logged.get(index)
+        if record is not None and record.get('key') == key:
+            self.surveys[index] = record['survey']
+            self.resumed += 1
+            return
+        while self.depth is not None and len(self.in_flight) >= self.depth:
+            self._collect(FIRST_COMPLETED)
+        args = (history, agent_dict, self.measurementsInfo, self.ENDOGENOUS_VARIABLES, self.scenario, self.OPERATIONALIZATION)
+        self.in_flight[self.executor.submit(perform_measurement, args)] = index
+        self._keys[index] = key
+
+    def _collect(self, return_when):
+        done, _ = wait(list(self.in_flight), return_when=return_when)
+        for future in done:
+            index = self.in_flight.pop(future)
+            key = self._keys.pop(index)
+            try:
+                self.surveys[index] = future.result()
+            except Exception as e:
+                logging.error(f"Survey {index} failed: {e}")
+                self.errors.append(e)
+                continue
+            self.log.write({"index": index, "key": key, "survey": self.surveys[index]})
+
+    def results(self, n_simulations):
+        """Wait for the queued surveys and return the surveys of all the simulations, in order."""
+        if self.in_flight:
+            self._collect(ALL_COMPLETED)
+        if self.resumed:
+            typer.echo(f"Resuming: {self.resumed} of {n_simulations} surveys already done")
+        if self.errors:
+            raise self.errors[0]
+        return [self.surveys[index] for index in range(n_simulations)]
+
+    def close(self):
+        self.executor.shutdown()
+        self.log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 @app.command() 
 def end_to_end(
     scenario: str = typer.Argument(..., help="The scenario description for which the simulation is run."),
     n_causes: int = typer.Option(2, help="The number of causal factors to consider in the simulation."),
-    mode: str = typer.Option("sequential", help="The mode for running the experiment, either 'sequential' or 'parallel'."), max_interactions: int = typer.Option(20, help="Maximum number of interactions"),
+    mode: str = typer.Option("sequential", help="The mode for running the experiment: 'sequential', 'parallel' (one process per simulation) or 'batched' (all simulations in one process, advanced together with concurrent async LLM calls)."), max_interactions: int = typer.Option(20, help="Maximum number of interactions"),
     temp_scientist: float = typer.Option(0.4, help="Temperature for the large language model agents"),
     temp_subject: float = typer.Option(0.3, help="Temperature for the large language model agents"),
     subsample: bool = typer.Option(False, help="Do full combinatorial simulation or subsampling."),
-    sample_proportion: float = typer.Option(0.1, help="subsampling proportion.")
+    sample_proportion: float = typer.Option(0.1, help="subsampling proportion."),
+    turn_mode: str = typer.Option("two-call", help="How the end of a conversation is decided: 'two-call' (a separate LLM call after every statement), 'combined' (the speaker decides in the same call as its statement) or 'periodic' (the separate call every --check-every turns or after a goodbye)."),
+    check_every: int = typer.Option(3, help="Number of turns between two continue checks in the 'periodic' turn mode."),
+    pipeline: bool = typer.Option(False, help="Survey each conversation as soon as it ends, while the other simulations are still running.")
 ):
     """
     Run an end-to-end automated social science simulation.
@@ -374,19 +572,25 @@ def end_to_end(
         temp_scientist=temp_scientist, 
         temp_subject=temp_subject,
         subsample=subsample,
-        sample_proportion=sample_proportion)
+        sample_proportion=sample_proportion,
+        turn_mode=turn_mode,
+        check_every=check_every,
+        pipeline=pipeline)
     
     return "Success!"
 
 @app.command() 
 def run_experiment_with_scm(
     scm_path: str = typer.Argument(..., help="The path to the JSON file containing the SCM data."),
-    mode: str = typer.Option("sequential", help="The mode for running the experiment, either 'sequential' or 'parallel'."), 
+    mode: str = typer.Option("sequential", help="The mode for running the experiment: 'sequential', 'parallel' (one process per simulation) or 'batched' (all simulations in one process, advanced together with concurrent async LLM calls)."), 
     max_interactions: int = typer.Option(20, help="Maximum number of interactions"),
     temp_scientist: float = typer.Option(0.3, help="Temperature for the large language model scientist"),
     temp_subject: float = typer.Option(0.3, help="Temperature for the large language model agents"),
     subsample: bool = typer.Option(False, help="Do full combinatorial simulation or subsampling."),
-    sample_proportion: float = typer.Option(0.1, help="subsampling proportion.")
+    sample_proportion: float = typer.Option(0.1, help="subsampling proportion."),
+    turn_mode: str = typer.Option("two-call", help="How the end of a conversation is decided: 'two-call' (a separate LLM call after every statement), 'combined' (the speaker decides in the same call as its statement) or 'periodic' (the separate call every --check-every turns or after a goodbye)."),
+    check_every: int = typer.Option(3, help="Number of turns between two continue checks in the 'periodic' turn mode."),
+    pipeline: bool = typer.Option(False, help="Survey each conversation as soon as it ends, while the other simulations are still running.")
 ):
     """
     Run the simulation based on a structural causal model (SCM).
@@ -395,6 +599,9 @@ def run_experiment_with_scm(
     The interactions will stop if the ending condition is met.
     """
     
+    if turn_mode not in TURN_MODES:
+        logging.error(f"Unknown turn mode {turn_mode}, choose one of {TURN_MODES}.")
+        return "Turn Mode Error!"
     typer.echo(f"Running automated social science simulation for {scm_path}: ")
     output_dir = "experiment_logs"
     ensure_directory(output_dir)
@@ -463,41 +670,55 @@ def run_experiment_with_scm(
             
     ## Added the check point
     history_filepath = os.path.join(output_dir, f"history_{scenario}.json")
-    if os.path.exists(history_filepath):
-        print('agents history already there')
-        # If the file exists, read the content
-        try:
-            with open(history_filepath, "r") as file:
-                data_dict = json.load(file)
-                histories = data_dict['histories']
-            print('variations', len(histories)) 
-        except FileNotFoundError:
-            logging.error("History file not found.")
-            return "File Error!"
-        except json.JSONDecodeError:
-            logging.error("Error decoding History JSON.")
-            return "JSON Error!"
-    else:
-        params = {
-            "scenario": scenario,
-            "order_dict": order_dict,
-            "interaction_type": interaction_type,
-            "ENDOGENOUS_VARIABLES": ENDOGENOUS_VARIABLES,
-            "OPERATIONALIZATION": OPERATIONALIZATION,
-            "max_interactions": max_interactions,
-            "temp_subject": temp_subject
-        }
-            
-        if mode == "parallel":
-            histories = parallel_run(perform_simulation, sample_dict, output_dir, **params)
-        elif mode == "sequential":
-            histories = sequential_run(perform_simulation, sample_dict, output_dir, **params)
-            
-    
-    # Perform parallel measurements  
-    with ProcessPoolExecutor() as executor:
-        args = zip(histories, sample_dict, [measurementsInfo]*len(histories), [ENDOGENOUS_VARIABLES]*len(histories), [scenario]*len(histories),[OPERATIONALIZATION]*len(histories))
-        surveys = list(executor.map(perform_measurement, args))
+    with ExitStack() as stack:
+        # with --pipeline, each conversation is surveyed as soon as it ends, while the other simulations go on
+        measurements = stack.enter_context(MeasurementQueue(output_dir, scenario, measurementsInfo, ENDOGENOUS_VARIABLES, OPERATIONALIZATION,
+                                                            depth=PIPELINE_QUEUE_DEPTH)) if pipeline else None
+        if os.path.exists(history_filepath):
+            print('agents history already there')
+            # If the file exists, read the content
+            try:
+                with open(history_filepath, "r") as file:
+                    data_dict = json.load(file)
+                    histories = data_dict['histories']
+                print('variations', len(histories)) 
+            except FileNotFoundError:
+                logging.error("History file not found.")
+                return "File Error!"
+            except json.JSONDecodeError:
+                logging.error("Error decoding History JSON.")
+                return "JSON Error!"
+        else:
+            params = {
+                "scenario": scenario,
+                "order_dict": order_dict,
+                "interaction_type": interaction_type,
+                "ENDOGENOUS_VARIABLES": ENDOGENOUS_VARIABLES,
+                "OPERATIONALIZATION": OPERATIONALIZATION,
+                "max_interactions": max_interactions,
+                "temp_subject": temp_subject,
+                "turn_mode": turn_mode,
+                "check_every": check_every
+            }
+            on_done = (lambda index, history: measurements.submit(index, sample_dict[index], history)) if pipeline else None
+                
+            if mode == "parallel":
+                # no more than the queue depth plus one simulation per worker waits for the measurement
+                max_pending = PIPELINE_QUEUE_DEPTH + (os.cpu_count() or 1) if pipeline else None
+                histories = parallel_run(perform_simulation, sample_dict, output_dir, on_done=on_done, max_pending=max_pending, **params)
+            elif mode == "sequential":
+                histories = sequential_run(perform_simulation, sample_dict, output_dir, on_done=on_done, **params)
+            elif mode == "batched":
+                histories = batched_run(sample_dict, output_dir, on_done=on_done, **params)
+                
+        
+        # without --pipeline, the survey workers only start once the simulations are done
+        if measurements is None:
+            measurements = stack.enter_context(MeasurementQueue(output_dir, scenario, measurementsInfo, ENDOGENOUS_VARIABLES, OPERATIONALIZATION))
+        # Perform parallel measurements, each survey is logged as soon as it is done and skipped on a restart
+        for index, history in enumerate(histories):
+            measurements.submit(index, sample_dict[index], history)
+        surveys = measurements.results(len(histories))
         
     data_to_save_all = {
             "scm": scm,
@@ -515,7 +736,16 @@ def run_experiment_with_scm(
          
     ## Analyze the data and fit the SCM
     data_path = os.path.join(output_dir, f"result_{scenario}.json")
-    analysis_data(file_path=data_path, temp_scientist=temp_scientist)
+    try:
+        analysis_data(file_path=data_path, temp_scientist=temp_scientist)
+    finally:
+        ## Token, latency and cost of the LLM calls of every process, per call site
+        llm_metrics = get_metrics_registry().dump(output_dir, scenario)
+        typer.echo(f"LLM usage saved to {output_dir}: {sum(site['calls'] for site in llm_metrics)} calls, "
+                   f"${sum(site['cost_usd'] for site in llm_metrics):.2f} estimated")
+        for site in llm_metrics[:5]:
+            typer.echo(f"  {site['site']}: {site['calls']} calls, {site['prompt_tokens'] + site['completion_tokens']} tokens, "
+                       f"{site['latency_seconds']:.0f}s, ${site['cost_usd']:.2f}")
     
     return "Success!"
 
@@ -569,7 +799,7 @@ def get_agents(
     """
     typer.echo(f"Get agent for scenario '{scenario}'")
     
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who is interested in studying social scenarios.')
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who is interested in studying social scenarios.')
     JP = JudeaPearl(scenario, template_dir=templates_dir)
     JP.add_LLM(LLM)
     human_agents_list = JP.backend_get_human_agents()
@@ -587,7 +817,7 @@ def get_outcome(
     """
     typer.echo(f"Generating possible outcomes for scenario {scenario}")
 
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_scientist, system_prompt='You are an economist who is interested in studying social scenarios.')
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_scientist, system_prompt='You are an economist who is interested in studying social scenarios.')
     JP = JudeaPearl(scenario, template_dir=templates_dir)
     JP.add_LLM(LLM)
     outcomes = JP.backend_outcome_generator(count=n_outcomes)
@@ -607,7 +837,7 @@ def build_outcome(
     """
     typer.echo(f"Build the selected outcome {target_outcome} for scenario {scenario}")
     
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
     
     ## Define the scenario and agents
     scenario_description = scenario
@@ -640,7 +870,7 @@ def get_cause(
     """
     typer.echo(f"Get possible causes for given outcome {target_outcome}")
     
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
     
     # Instantiate the SCM
     loaded_scm = StructuralCausalModelBuilder.deserialize(scm_json)
@@ -669,7 +899,7 @@ def build_cause(
     """
     typer.echo(f"Build the selected cause {target_cause} for outcome {target_outcome}")
     
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
     
     loaded_scm = StructuralCausalModelBuilder.deserialize(scm_json)
     loaded_scm.add_LLM(LLM)
@@ -719,7 +949,7 @@ def build_cause_with_scm(
         logging.error("Error decoding SCM JSON.")
         return "JSON Error!"
     typer.echo(f"Build the selected cause {target_cause} for outcome {target_outcome}")
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
     output_dir = "experiment_logs"
     ensure_directory(output_dir)
     
@@ -777,7 +1007,7 @@ def add_line(
         return "JSON Error!"
     typer.echo(f"Add a cause relation between cause {target_cause} and  outcome {target_outcome}")
     
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_scientist, system_prompt='You are a social scientist who loves research and coming up with ideas.')
     target_outcome = f"'{target_outcome}'"
     
     loaded_scm = StructuralCausalModelBuilder.deserialize(scm)
@@ -858,7 +1088,7 @@ def analysis_data(
     # output_dir = "experiment_logs"
     ensure_directory(output_dir)
     
-    LLM = LanguageModel(family="openai", model="gpt-4", temperature=temp_scientist)
+    LLM = LanguageModel(family=default_family(), model="gpt-4", temperature=temp_scientist)
 
     try:
         with open(file_path, 'r') as f:
@@ -870,45 +1100,10 @@ def analysis_data(
         logging.error("Error decoding SCM JSON.")
         return "JSON Error!"
     
-    # data parser
-    data_parser = DataParser(interaction_data, template_dir = templates_dir)
-    data_parser.add_LLM(LLM)
-    data_parser.backend_clean_data(output_dir)
-        
-    # data cleaner
-    raw_data = pd.read_csv(os.path.join(output_dir, "raw_data.csv"))
-    with open(os.path.join(output_dir, "meta_data.json"), "r") as f:
-        meta_data = json.load(f)
-        
-    data_cleaner = DataCleaner(interaction_data, raw_data, meta_data)
-    data_cleaner.generate_final_df()
-    data_cleaner.save_data(path=output_dir)
-    
-    # data analyst
-    data = pd.read_csv(os.path.join(output_dir, "data.csv"))
-    with open(os.path.join(output_dir, "meta_data.json"), "r") as f:
-        meta_data = json.load(f)
-    # with open(os.path.join(output_dir, "result.json"), "r") as f:
-    #     interaction_data = json.load(f)
-    with open(os.path.join(output_dir, "final_mapping.json"), "r") as f:
-        final_mapping = json.load(f)
-    with open(os.path.join(output_dir, "final_edge_dict.json"), "r") as f:
-        final_edge_dict = json.load(f)
-    with open(os.path.join(output_dir,"scm_simple.json"), "r") as f:
-        scm_simple = json.load(f)
-    
-    data_analyst = DataAnalyst(
-            data,
-            meta_data,
-            final_mapping,
-            final_edge_dict,
-            interaction_data,
-            scm_simple,
-            # scenario,
-        )
-    data_analyst.analyze_data(
+    # parse, clean and analyze the data in memory, saving it once to output_dir for the estimation
+    pipeline = AnalysisPipeline(interaction_data, LLM, template_dir = templates_dir)
+    pipeline.run(
             output_dir,
-            final_output_dir=output_dir,
             interaction=False,
             std_estimates=False,
             )
@@ -928,6 +1123,33 @@ def main(
         help="Show the application's version and exit.",
         callback=_version_callback,
         is_eager=True,
-    )
+    ),
+    llm_family: Optional[str] = typer.Option(
+        None,
+        "--llm-family",
+        help="Model family for all LLM calls, e.g. 'mock' to run the whole pipeline offline. Defaults to LLM_FAMILY or 'openai'.",
+    ),
+    record: Optional[Path] = typer.Option(
+        None,
+        "--record",
+        help="Append every LLM call of the run (call site, prompt, settings and response) to this cassette file.",
+    ),
+    replay: Optional[Path] = typer.Option(
+        None,
+        "--replay",
+        help="Answer every LLM call from a cassette recorded with --record, without calling the API.",
+    ),
 ) -> None:
+    # worker processes inherit the environment, so they use the same family and cassette
+    if llm_family is not None:
+        os.environ['LLM_FAMILY'] = llm_family
+    if record is not None and replay is not None:
+        typer.secho("--record and --replay can't be used together.", fg=typer.colors.RED)
+        raise typer.Exit(1)
+    if record is not None or replay is not None:
+        os.environ['LLM_CASSETTE_MODE'] = 'record' if record is not None else 'replay'
+        os.environ['LLM_CASSETTE_PATH'] = str((record or replay).resolve())
+    # the LLM calls of this run, in every process, are logged to experiment_logs/llm_calls_<run>.jsonl, see Metrics.py
+    os.environ.setdefault('LLM_METRICS_RUN', f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    os.environ.setdefault('LLM_METRICS_DIR', "experiment_logs")
     return
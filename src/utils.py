@@ -2,6 +2,7 @@ import typer
 import os
 import sys
 import json
+import hashlib
 import random
 import math
 
@@ -99,6 +100,119 @@ def save_json(data, filename, directory):
     return file_path
         
         
+class JsonlWriter:
+    """
+    Append-only JSON lines file: each record is written as one line and never rewritten, so saving n records costs O(n).
+    Lines are flushed as they are written and fsynced in batches of sync_every records (and on close),
+    so a crash loses at most the last unsynced records.
+
+    Args:
+    path (str): The JSON lines file.
+    mode (str): 'a' to add to an existing file, 'w' to start a new one.
+    sync_every (int): The number of records between two fsyncs.
+    """
+    def __init__(self, path: str, mode: str = 'a', sync_every: int = 20):
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self._unsynced = 0
+        self._file = open(path, mode)
+
+    def write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_jsonl(path: str):
+    """
+    Read the records of a JSON lines file, skipping a last line cut short by a crash.
+
+    Args:
+    path (str): The JSON lines file.
+
+    Returns:
+    list: The records in the order they were written, empty if the file doesn't exist.
+    """
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+def combination_key(*values):
+    """
+    A short hash of the inputs of a simulation or survey, e.g. its agents, to tell if a logged result is still valid.
+
+    Args:
+    *values: JSON serializable inputs.
+
+    Returns:
+    str: The hash.
+    """
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def load_completed(jsonl_path: str, field: str, keys: list = None):
+    """
+    Read the results already logged in a JSON lines log, by index. Used to resume a run where it stopped.
+
+    Args:
+    jsonl_path (str): The JSON lines log, with records like {"index": 0, "key": "...", field: ...}.
+    field (str): The field of the records holding the result, e.g. "history".
+    keys (list, optional): The combination_key of each index; results logged for other inputs are ignored. Defaults to None to keep all records.
+
+    Returns:
+    dict: The results by index, the last one logged if an index was logged twice.
+    """
+    completed = {}
+    for record in read_jsonl(jsonl_path):
+        index = record.get('index')
+        if keys is not None and not (isinstance(index, int) and 0 <= index < len(keys) and record.get('key') == keys[index]):
+            continue
+        completed[index] = record[field]
+    return completed
+
+def compact_jsonl(jsonl_path: str, field: str, key: str, filename: str, directory: str, keys: list = None):
+    """
+    Save the records of a JSON lines log in the legacy format {key: [...]}, ordered by their "index".
+
+    Args:
+    jsonl_path (str): The JSON lines log, with records like {"index": 0, field: ...}.
+    field (str): The field of the records to save, e.g. "history".
+    key (str): The key of the saved list, e.g. "histories".
+    filename (str): The JSON file to write.
+    directory (str): The directory of the JSON file.
+    keys (list, optional): The combination_key of each index, see load_completed.
+
+    Returns:
+    list: The saved list.
+    """
+    by_index = load_completed(jsonl_path, field, keys)
+    values = [by_index[index] for index in sorted(by_index)]
+    save_json({key: values}, filename, directory)
+    return values
+
 def get_valid_number(prompt):
     """Prompt the user repeatedly until a valid number is entered.
     
@@ -0,0 +1,28 @@
+# tests/test_aggregation.py
+import sys
+
+import numpy as np
+
+sys.path.append('./src/JudeaPearl')
+
+from DataParser import DataParser
+
+
+def test_rows_are_aggregated_without_missing_measurements():
+    matrix = np.array([[1, 3, np.nan], [2, 2, 5], [np.nan, np.nan, np.nan]])
+    aggregate = DataParser.aggregate_matrix
+    np.testing.assert_array_equal(aggregate(matrix, "average"), [2, 3, np.nan])
+    np.testing.assert_array_equal(aggregate(matrix, "sum"), [4, 9, np.nan])
+    np.testing.assert_array_equal(aggregate(matrix, "max"), [3, 5, np.nan])
+    np.testing.assert_array_equal(aggregate(matrix, "min"), [1, 2, np.nan])
+    np.testing.assert_array_equal(aggregate(matrix, "median"), [2, 2, np.nan])
+    np.testing.assert_array_equal(aggregate(matrix, "mode"), [1, 2, np.nan])
+
+
+def test_list_helpers_follow_the_matrix_aggregation():
+    data_parser = DataParser.__new__(DataParser)
+    assert data_parser.mechanistic_aggregation([1, 3, 3], "mode") == 3
+    assert data_parser.average_data([1, 2]) == 1.5
+    assert data_parser.sum_data([1, 2, np.nan]) == 3
+    assert data_parser.max_data([1, 2]) == 2 and data_parser.min_data([1, 2]) == 1
+    assert np.isnan(data_parser.max_data([])) and np.isnan(data_parser.mode_data([]))
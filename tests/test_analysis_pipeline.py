@@ -0,0 +1,56 @@
+# tests/test_analysis_pipeline.py
+import sys
+import json
+
+import pandas as pd
+
+sys.path.append('./src/LLM')
+sys.path.append('./src/JudeaPearl')
+
+from LLM import LanguageModel
+from Metrics import MetricsRegistry
+from AnalysisPipeline import AnalysisPipeline
+from DataParser import DataParser
+from DataCleaner import DataCleaner
+from DataAnalyst import DataAnalyst
+import Metrics
+
+templates_dir = './src/JudeaPearl/prompt_templates'
+
+
+def load_result():
+    with open('./tests/data/mug_result.json') as file:
+        return json.load(file)
+
+
+def test_in_memory_handoff_matches_the_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setenv("LLM_FAMILY", "mock")
+    monkeypatch.setattr(Metrics, "_metrics_registry", MetricsRegistry(path=None))
+    monkeypatch.setattr(DataAnalyst, "analyze_data", lambda self, path, **kwargs: None)
+    LLM = LanguageModel(family="mock", model="gpt-4", temperature=0.1)
+
+    pipeline = AnalysisPipeline(load_result(), LLM, template_dir=templates_dir)
+    pipeline.parse()
+    pipeline.clean()
+    pipeline.save(str(tmp_path))
+
+    # the previous flow: every stage reloads the files of the stage before
+    data_parser = DataParser(load_result(), template_dir=templates_dir)
+    data_parser.add_LLM(LLM)
+    data_parser.backend_clean_data(str(tmp_path / "files"))
+    raw_data = pd.read_csv(tmp_path / "files" / "raw_data.csv")
+    with open(tmp_path / "files" / "meta_data.json") as file:
+        meta_data = json.load(file)
+    data_cleaner = DataCleaner(load_result(), raw_data, meta_data)
+    data_cleaner.generate_final_df()
+
+    pd.testing.assert_frame_equal(pipeline.data_cleaner.final_df_interactions, data_cleaner.final_df_interactions)
+    assert pipeline.data_parser.meta_data == meta_data
+
+    # the cleaner rewrites the SCM structure in place for nominal variables, the meta data of the other stages must not follow
+    pipeline.data_cleaner.update_graph_with_dummies("buyer's budget", ["buyer's budget_low", "buyer's budget_high"])
+    assert pipeline.data_parser.meta_data == meta_data
+    data_analyst = pipeline.analyze(str(tmp_path))
+    assert data_analyst.meta_data == meta_data
+    pd.testing.assert_frame_equal(data_analyst.final_df, pd.read_csv(tmp_path / "data.csv"))
@@ -0,0 +1,34 @@
+# tests/test_cassette.py
+import sys
+import json
+
+import pytest
+
+sys.path.append('./src/LLM')
+sys.path.append('./src/Serialization')
+
+from LLM import LanguageModel
+from Cassette import CassetteMissError
+from Metrics import MetricsRegistry
+import Metrics
+
+
+def test_record_then_replay(tmp_path, monkeypatch):
+    path = str(tmp_path / "run.cassette.jsonl")
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setenv("LLM_CASSETTE_PATH", path)
+    monkeypatch.setattr(Metrics, "_metrics_registry", MetricsRegistry(path=None))
+    LLM = LanguageModel(family="mock", model="gpt-4", temperature=0.7)
+
+    monkeypatch.setenv("LLM_CASSETTE_MODE", "record")
+    recorded = [LLM.call_llm("hello"), LLM.call_llm("hello"), LLM.call_llm("bye")]
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 3
+    assert lines[0]["site"] == "test_cassette.test_record_then_replay"
+    assert "prompt" in lines[0] and "prompt" not in lines[1]
+
+    monkeypatch.setenv("LLM_CASSETTE_MODE", "replay")
+    assert [LLM.call_llm("hello"), LLM.call_llm("hello"), LLM.call_llm("bye")] == recorded
+    with pytest.raises(CassetteMissError):
+        LLM.call_llm("never recorded")
@@ -0,0 +1,28 @@
+# tests/test_conversation_memory.py
+import sys
+
+sys.path.append('./src/Human')
+sys.path.append('./src/LLM')
+sys.path.append('./src/Serialization')
+
+from ConversationMemory import ConversationMemory
+from Human import list_to_string
+from LLM import LanguageModel
+from Metrics import MetricsRegistry
+import Metrics
+
+
+def test_memory_keeps_prompts_within_budget(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setattr(Metrics, "_metrics_registry", MetricsRegistry(path=None))
+    LLM = LanguageModel(family="mock", model="gpt-4", temperature=0.3)
+    history = [{f"agent {turn % 2}": f"I can offer {turn} dollars for the mug, what do you think?"} for turn in range(30)]
+
+    assert ConversationMemory(max_tokens=None).render(history) is None
+    assert ConversationMemory(max_tokens=10_000).render(history) is None
+
+    memory = ConversationMemory(max_tokens=300, recent_turns=4, summarize_every=4)
+    memory.refresh(history, LLM)
+    rendered = memory.render(history)
+    assert memory.summarized_turns == 24 and memory.summary in rendered
+    assert rendered.endswith(list_to_string(history[-4:]))
@@ -0,0 +1,119 @@
+# tests/test_data_parser.py
+import sys
+import json
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append('./src/LLM')
+sys.path.append('./src/JudeaPearl')
+
+from LLM import LanguageModel
+from Metrics import MetricsRegistry
+from MockLLM import MockLLM
+from DataParser import DataParser
+import DataParser as data_parser_module
+import Metrics
+
+templates_dir = './src/JudeaPearl/prompt_templates'
+OUTCOME = 'whether or not an agreement is reached'
+# answers the rules of FastParser can't read, the last one has no data
+ANSWERS = ["yes, we shook hands", "no, we walked away", "yes, after a while", "yes, at 20 dollars", "no, too expensive", "we talked about the weather"]
+
+
+@pytest.fixture
+def parser(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setattr(Metrics, "_metrics_registry", MetricsRegistry(path=None))
+    with open('./tests/data/mug_result.json') as file:
+        result = json.load(file)
+    for num, interaction in result["data"].items():
+        for agent, questions in interaction["survey"][OUTCOME].items():
+            for question in questions:
+                questions[question] = json.dumps({"explanation": "", "answer": ANSWERS[int(num)]})
+    data_parser = DataParser(result, template_dir=templates_dir)
+    data_parser.add_LLM(LanguageModel(family="mock", model="gpt-4", temperature=0.1))
+    return data_parser
+
+
+def count_prompts(data_parser, monkeypatch):
+    prompts = Counter()
+    generate_prompt = data_parser.generate_prompt
+
+    def counting_generate_prompt(template, **kwargs):
+        prompts[template] += 1
+        return generate_prompt(template, **kwargs)
+
+    monkeypatch.setattr(data_parser, "generate_prompt", counting_generate_prompt)
+    return prompts
+
+
+def test_answers_are_parsed_in_batches(parser, monkeypatch):
+    prompts = count_prompts(parser, monkeypatch)
+    parser.parse_answers_in_batches(batch_size=4)
+    parser.get_data_from_interactions()
+
+    # one prompt per 4 answers, each value back on the row of its answer
+    assert prompts == {"get_data_batch.txt": 2}
+    np.testing.assert_array_equal(parser.data_frame[OUTCOME], [1, 0, 1, 1, 0, np.nan])
+
+
+def test_answers_missing_from_a_batch_are_parsed_one_by_one(parser, monkeypatch):
+    data_many = MockLLM._data_many
+    # the response of every batch leaves out its last answer
+    monkeypatch.setattr(MockLLM, "_data_many", lambda self, p: {"answers": data_many(self, p)["answers"][:-1]})
+    prompts = count_prompts(parser, monkeypatch)
+    parser.parse_answers_in_batches(batch_size=4)
+    parser.get_data_from_interactions()
+
+    assert prompts == {"get_data_batch.txt": 2, "get_binary_data.txt": 2}
+    np.testing.assert_array_equal(parser.data_frame[OUTCOME], [1, 0, 1, 1, 0, np.nan])
+
+
+def test_batch_size_must_be_positive(parser, monkeypatch):
+    monkeypatch.setattr(data_parser_module, "PARSE_BATCH_SIZE", 0)
+    with pytest.raises(ValueError, match="batch size"):
+        parser.parse_answers_in_batches()
+
+
+def test_threaded_parse_matches_a_sequential_parse(parser, monkeypatch):
+    # one interaction after the other, as the parser did before the thread pool
+    rows = []
+    for num, interaction in parser.interaction_data.items():
+        row = {var_name: parser.exogenous_data_parse(var_name, num) for var_name in parser.attribute_value_mapping[num]}
+        row.update({var_name: parser.parse_single_question_per_measure(var_name, interaction["survey"]) for var_name in interaction["survey"]})
+        rows.append(row)
+    sequential = pd.DataFrame(rows, columns=parser.variables)
+
+    # the first interactions finish last
+    process_interaction = parser.process_interaction
+    monkeypatch.setattr(parser, "process_interaction", lambda num: time.sleep(0.01 * (6 - int(num))) or process_interaction(num))
+    parser.get_data_from_interactions(max_workers=6)
+
+    assert list(parser.data_frame.columns) == parser.variables
+    pd.testing.assert_frame_equal(parser.data_frame, sequential)
+    assert parser.data_frame[OUTCOME].isna().tolist() == [False] * 5 + [True]
+
+
+def test_exogenous_columns_are_filled_from_the_distinct_values(parser, monkeypatch):
+    for num in ("1", "4"):
+        del parser.attribute_value_mapping[num]["seller's budget"]
+    parsed = Counter()
+    exogenous_value = parser.exogenous_value
+
+    def counting_exogenous_value(var_name, raw_data):
+        parsed[var_name, raw_data] += 1
+        return exogenous_value(var_name, raw_data)
+
+    monkeypatch.setattr(parser, "exogenous_value", counting_exogenous_value)
+    columns = parser.exogenous_columns(["0", "1", "2", "3", "4", "5"])
+
+    np.testing.assert_array_equal(columns["buyer's budget"], [10, 30, 50, 10, 30, 50])
+    # NaN where the interaction doesn't set the variable
+    np.testing.assert_array_equal(columns["seller's budget"], [10, np.nan, 10, 30, np.nan, 30])
+    # each distinct attribute value is parsed once, the missing ones not at all
+    assert parsed == {("buyer's budget", "10"): 1, ("buyer's budget", "30"): 1, ("buyer's budget", "50"): 1,
+                      ("seller's budget", "10"): 1, ("seller's budget", "30"): 1}
@@ -0,0 +1,24 @@
+# tests/test_fast_parse.py
+import sys
+import math
+
+sys.path.append('./src/JudeaPearl')
+
+from FastParser import fast_parse
+
+
+def test_unambiguous_answers_are_parsed_locally():
+    assert fast_parse("continuous", "$1,250.50", {}) == 1250.5
+    assert fast_parse("count", "7", {}) == 7
+    assert math.isnan(fast_parse("continuous", "I don't know", {}))
+    assert fast_parse("binary", "Yes.", {"no": 0, "yes": 1}) == 1
+    assert fast_parse("binary", "no", {"agreement": 0, "no agreement": 1}) == 1
+    assert fast_parse("ordinal", "Somewhat satisfied", {"not satisfied": 1, "somewhat satisfied": 2, "very satisfied": 3}) == 2
+    assert fast_parse("nominal", "cash", {"cash": 1, "card": 2}) == 1
+
+
+def test_ambiguous_answers_are_escalated():
+    assert fast_parse("continuous", "between 20 and 30 dollars", {}) is None
+    assert fast_parse("count", "2.5", {}) is None
+    assert fast_parse("binary", "I think so", {"no": 0, "yes": 1}) is None
+    assert fast_parse("ordinal", "fairly happy", {"unhappy": 1, "happy": 2}) is None
@@ -0,0 +1,26 @@
+# tests/test_json_repair.py
+import sys
+
+sys.path.append('./src/LLM')
+
+from JsonRepair import repair_json, json_repair_stats
+from ResponseSchema import response_schema
+
+
+def test_local_repairs():
+    assert repair_json('```json\n{"answer": "7"}\n```') == ({"answer": "7"}, ["code_fence"])
+    assert repair_json('Sure! Here it is: {"answer": "7", "explanation": "see {below}"} Hope it helps.')[0] == {"answer": "7", "explanation": "see {below}"}
+    assert repair_json('{“answer”: “yes”}')[0] == {"answer": "yes"}
+    assert repair_json('{"answers": ["a", "b",],}')[0] == {"answers": ["a", "b"]}
+    assert repair_json("{'answer': 'the buyer's \"best\" offer'}")[0] == {"answer": 'the buyer\'s "best" offer'}
+    assert repair_json('no json here') == (None, [])
+    assert json_repair_stats()["code_fence"] >= 1
+
+
+def test_response_schema_key_fixes():
+    schema = response_schema("classify_variable_type.txt", "src/JudeaPearl/prompt_templates")
+    assert schema.keys == ["variable_type", "explanation"]
+    assert schema.missing_keys({"variable type": "binary", "explanation": ""}) == ["variable_type"]
+    assert schema.fix_keys({"variable type": "binary", "explanation": ""}) == {"variable_type": "binary", "explanation": ""}
+    assert schema.fix_keys({"response": {"variable_type": "binary", "explanation": ""}}) == {"variable_type": "binary", "explanation": ""}
+    assert response_schema("REP_prompt.txt", "src/JudeaPearl/prompt_templates") is None
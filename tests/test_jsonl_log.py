@@ -0,0 +1,32 @@
+# tests/test_jsonl_log.py
+import json
+
+from src.utils import JsonlWriter, read_jsonl, compact_jsonl, combination_key, load_completed
+
+
+def test_log_is_compacted_in_index_order(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    with JsonlWriter(path, mode='w', sync_every=2) as log:
+        for index in (2, 0, 1):
+            log.write({"index": index, "history": [{"agent": f"statement {index}"}]})
+    # a line cut short by a crash is skipped
+    with open(path, 'a') as file:
+        file.write('{"index": 3, "hist')
+
+    assert len(read_jsonl(path)) == 3
+    histories = compact_jsonl(path, "history", "histories", "history.json", str(tmp_path))
+    assert histories == [[{"agent": f"statement {index}"}] for index in range(3)]
+    with open(tmp_path / "history.json") as file:
+        assert json.load(file) == {"histories": histories}
+
+
+def test_only_results_of_the_same_inputs_are_resumed(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    combined_dicts = [{"buyer": {"budget": budget}} for budget in (5, 10, 20)]
+    keys = [combination_key(agent_dict) for agent_dict in combined_dicts]
+    with JsonlWriter(path) as log:
+        log.write({"index": 0, "key": keys[0], "history": ["done"]})
+        log.write({"index": 1, "key": combination_key({"buyer": {"budget": 99}}), "history": ["stale"]})
+        log.write({"index": 7, "key": keys[2], "history": ["out of range"]})
+
+    assert load_completed(path, "history", keys) == {0: ["done"]}
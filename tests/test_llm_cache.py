@@ -0,0 +1,47 @@
+# tests/test_llm_cache.py
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append('./src/LLM')
+
+from Cache import ResponseCache
+from SingleFlight import SingleFlight
+
+
+def test_cache_round_trip(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite"))
+    key = ResponseCache.make_key("openai", "gpt-4", 0.0, None, "", "hello")
+    assert cache.get(key) is None
+    cache.set(key, '{"answer": "7"}')
+    assert cache.get(key) == '{"answer": "7"}'
+    assert key != ResponseCache.make_key("openai", "gpt-4", 0.1, None, "", "hello")
+    assert key != ResponseCache.make_key("openai", "gpt-4", 0.0, None, "", "hello", json_mode=True)
+
+
+def test_cache_evicts_old_and_oversized_entries(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite"), max_size_mb=0.001)
+    for i in range(10):
+        cache.set(str(i), "x" * 200)
+    cache.evict()
+    assert cache.stats()["entries"] == 5
+    assert cache.get("0") is None and cache.get("9") is not None
+
+    expired = ResponseCache(path=str(tmp_path / "expired.sqlite"), max_age_days=0)
+    expired.set("key", "value")
+    assert expired.get("key") is None
+
+
+def test_single_flight_shares_concurrent_calls():
+    single_flight = SingleFlight()
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        time.sleep(0.2)
+        return "response"
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: single_flight.do("key", slow_call), range(8)))
+    assert results == ["response"] * 8
+    assert len(calls) == 1 and single_flight.shared == 7
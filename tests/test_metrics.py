@@ -0,0 +1,32 @@
+# tests/test_metrics.py
+import sys
+
+sys.path.append('./src/LLM')
+sys.path.append('./src/Serialization')
+
+from LLM import LanguageModel
+from Metrics import MetricsRegistry
+import Metrics
+
+
+def ask_goal(LLM):
+    return LLM.call_llm("what is your goal?")
+
+
+def test_calls_are_accounted_per_site(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setenv("LLM_METRICS_RUN", "test-run")
+    registry = MetricsRegistry(path=str(tmp_path / "llm_calls.jsonl"))
+    monkeypatch.setattr(Metrics, "_metrics_registry", registry)
+
+    LLM = LanguageModel(family="mock", model="gpt-4", temperature=0.7)
+    ask_goal(LLM)
+    ask_goal(LLM)
+    LLM.call_llm("hello")
+
+    summary = registry.dump(str(tmp_path), "test")
+    sites = {site["site"]: site for site in summary}
+    assert sites["test_metrics.ask_goal"]["calls"] == 2
+    assert sites["test_metrics.ask_goal"]["api_calls"] == 2
+    assert sites["test_metrics.ask_goal"]["prompt_tokens"] > 0 and sites["test_metrics.ask_goal"]["cost_usd"] > 0
+    assert (tmp_path / "llm_metrics_test.csv").exists()
@@ -0,0 +1,73 @@
+# tests/test_mock_llm.py
+import sys
+import json
+import asyncio
+
+import openai
+import pytest
+
+sys.path.append('./src/LLM')
+sys.path.append('./src/Question')
+
+from MockLLM import MockLLM
+from Prompting import PromptMixin
+from LLM import LanguageModel, set_async_concurrency
+from Metrics import MetricsRegistry
+import LLM as llm_module
+import Metrics
+
+templates_dir = './src/JudeaPearl/prompt_templates'
+
+
+def test_mock_answers_templates_with_their_schema():
+    mock = MockLLM()
+    prompt = PromptMixin().generate_prompt("create_measurement_questions.txt", template_dir=templates_dir,
+                                           scenario_description="two people bargaining over a mug", variable_name="whether or not a deal occurs",
+                                           relevant_agents=["buyer", "seller"], operationalization={}, variable_type="binary", units="yes/no", levels=["no", "yes"])
+    questions = json.loads(mock.respond(prompt))
+    assert set(questions) == {"buyer", "aggregation", "explanation"}
+    assert mock.respond(prompt) == mock.respond(prompt)
+
+    prompt = PromptMixin().generate_prompt("get_ordinal_data.txt", template_dir=templates_dir,
+                                           scenario_description="two people bargaining over a mug", variable_name="buyer's level of patience",
+                                           relevant_agents=["buyer", "seller"], agent="buyer", question="how patient were you?",
+                                           answer="I would say high", levels=["low", "high", "very high"], level_values=[1, 2, 3])
+    assert json.loads(mock.respond(prompt))["answer"] == "2"
+
+
+def test_mock_injects_faults():
+    with pytest.raises(openai.error.RateLimitError):
+        MockLLM(rate_limit_rate=1).complete("hello")
+    with pytest.raises(openai.error.Timeout):
+        MockLLM(timeout_rate=1, timeout_seconds=0).complete("hello")
+    response = MockLLM(latency="uniform:0,1").complete("hello")
+    assert response["usage"]["total_tokens"] > 0
+
+
+def test_backoff_releases_the_concurrency_slot(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setattr(Metrics, "_metrics_registry", MetricsRegistry(path=None))
+    answered = []
+
+    async def acall_mock(self, prompt, json_mode=False):
+        if prompt == "first" and not answered:
+            raise openai.error.RateLimitError("slow down")
+        answered.append(prompt)
+        return prompt
+
+    sleep = asyncio.sleep
+    monkeypatch.setattr(LanguageModel, "acall_mock", acall_mock)
+    monkeypatch.setattr(asyncio, "sleep", lambda seconds: sleep(0.05))
+    limit = llm_module.ASYNC_CONCURRENCY_LIMIT
+    set_async_concurrency(1)
+    try:
+        LLM = LanguageModel(family="mock", model="gpt-4", temperature=0.7)
+
+        async def ask_both():
+            return await asyncio.gather(LLM.acall_llm("first"), LLM.acall_llm("second"))
+
+        assert asyncio.run(ask_both()) == ["first", "second"]
+    finally:
+        set_async_concurrency(limit)
+    # the second call went through while the first one was backing off
+    assert answered == ["second", "first"]
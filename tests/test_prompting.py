@@ -0,0 +1,21 @@
+# tests/test_prompting.py
+import sys
+
+import pytest
+
+sys.path.append('./src/Question')
+
+from Prompting import PromptMixin, PromptLibrary, PromptBuilder, get_template_registry
+
+TEMPLATE_DIR = "src/JudeaPearl/prompt_templates"
+
+
+def test_generate_prompt_matches_prompt_builder():
+    template_string = PromptLibrary(TEMPLATE_DIR).get_template_string("create_levels.txt")
+    builder = PromptBuilder(template_string)
+    data = {variable: f"<{variable}>" for variable in builder.get_variables()}
+
+    assert PromptMixin().generate_prompt("create_levels.txt", template_dir=TEMPLATE_DIR, **data) == builder.build_prompt(data)
+    assert get_template_registry().get("create_levels.txt", TEMPLATE_DIR) is get_template_registry().get("create_levels.txt", TEMPLATE_DIR)
+    with pytest.raises(ValueError):
+        PromptMixin().generate_prompt("create_levels.txt", template_dir=TEMPLATE_DIR)
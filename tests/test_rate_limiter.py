@@ -0,0 +1,68 @@
+# tests/test_rate_limiter.py
+import sys
+
+import pytest
+
+sys.path.append('./src/LLM')
+
+from RateLimiter import TokenBucketRateLimiter, estimate_request_tokens
+import RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # a frozen clock that only moves when the limiter sleeps
+    now = [1000.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(RateLimiter.time, "time", lambda: now[0])
+    monkeypatch.setattr(RateLimiter.time, "sleep", sleep)
+    return sleeps
+
+
+def test_acquire_blocks_once_the_bucket_is_empty(tmp_path, clock):
+    limiter = TokenBucketRateLimiter(rpm=60, path=str(tmp_path / "rate.sqlite"))
+    limiter.acquire("gpt-4", 10)
+    limiter.acquire("gpt-4", 10)
+    assert clock == []
+
+    # the bucket holds a minute of requests, the next one waits for it to refill one request
+    for _ in range(58):
+        limiter.acquire("gpt-4", 10)
+    assert clock == []
+    limiter.acquire("gpt-4", 10)
+    assert clock == [pytest.approx(1)]
+
+
+def test_settle_corrects_the_estimate(tmp_path, clock):
+    limiter = TokenBucketRateLimiter(tpm=1000, path=str(tmp_path / "rate.sqlite"))
+    limiter.acquire("gpt-4", 600)
+    assert limiter._try_acquire("gpt-4", 900) > 0
+
+    # the call used 100 tokens instead of the 600 estimated, the other 500 go back in the bucket
+    limiter.settle("gpt-4", 600, 100)
+    assert limiter._try_acquire("gpt-4", 900) == 0
+
+    # an underestimate leaves the bucket in debt, the next request waits for the debt and its own token
+    limiter.settle("gpt-4", 0, 500)
+    assert limiter._try_acquire("gpt-4", 1) == pytest.approx(501 * 60 / 1000)
+
+
+def test_limiters_on_the_same_file_share_the_budget(tmp_path, clock):
+    path = str(tmp_path / "rate.sqlite")
+    first = TokenBucketRateLimiter(rpm=2, tpm=1000, path=path)
+    second = TokenBucketRateLimiter(rpm=2, tpm=1000, path=path)
+    assert first._try_acquire("gpt-4", 100) == 0
+    assert second._try_acquire("gpt-4", 100) == 0
+    assert first._try_acquire("gpt-4", 100) > 0
+    assert second._try_acquire("gpt-4", 100) > 0
+    # the buckets are per model
+    assert second._try_acquire("gpt-3.5-turbo", 100) == 0
+
+
+def test_requests_are_estimated_with_their_completion():
+    assert estimate_request_tokens("hello there", "You are a helpful assistant.", max_tokens=50) > 50
@@ -0,0 +1,50 @@
+# tests/test_simulation.py
+import sys
+import asyncio
+
+sys.path.append('./src/Human')
+sys.path.append('./src/LLM')
+sys.path.append('./src/Serialization')
+
+from Simulation import Simulation, LockstepRunner
+from Metrics import MetricsRegistry
+import Metrics
+
+
+def design_cell(price):
+    return {
+        "buyer": {"your name": "Ana", "your role is": "buyer", "_goal": "buy the mug", "_constraint": f"pay at most {price} dollars"},
+        "seller": {"your name": "Bo", "your role is": "seller", "_goal": "sell the mug", "_constraint": "sell above 5 dollars"},
+    }
+
+
+def test_lockstep_runner_matches_one_by_one(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setenv("LLM_FAMILY", "mock")
+    monkeypatch.setattr(Metrics, "_metrics_registry", MetricsRegistry(path=None))
+    combined_dicts = [design_cell(price) for price in (5, 10, 20, 40, 80)]
+    params = {"order_dict": {"order": ["buyer", "seller"]}, "scenario": "two people bargaining over a mug",
+              "interaction_type": "ordered", "ENDOGENOUS_VARIABLES": ["price"], "max_interactions": 8}
+
+    one_by_one = [Simulation(agentsInfo, **params).run() for agentsInfo in combined_dicts]
+    finished = []
+    lockstep = LockstepRunner(window=2).run(combined_dicts, on_done=lambda index, history: finished.append(index), **params)
+
+    assert lockstep == one_by_one
+    assert sorted(finished) == list(range(len(combined_dicts)))
+
+
+def test_lockstep_runner_awaits_async_on_done(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setenv("LLM_FAMILY", "mock")
+    monkeypatch.setattr(Metrics, "_metrics_registry", MetricsRegistry(path=None))
+    params = {"order_dict": {"order": ["buyer", "seller"]}, "scenario": "two people bargaining over a mug",
+              "interaction_type": "ordered", "ENDOGENOUS_VARIABLES": ["price"], "max_interactions": 4}
+    finished = []
+
+    async def on_done(index, history):
+        await asyncio.sleep(0)
+        finished.append(index)
+
+    LockstepRunner(window=2).run([design_cell(price) for price in (5, 10, 20)], on_done=on_done, **params)
+    assert sorted(finished) == [0, 1, 2]
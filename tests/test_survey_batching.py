@@ -0,0 +1,71 @@
+# tests/test_survey_batching.py
+import sys
+import json
+import asyncio
+
+sys.path.append('./src/LLM')
+
+from src.cli import call_measurement, acall_measurement
+from LLM import LanguageModel
+from Metrics import MetricsRegistry
+import Metrics
+
+
+def survey_args():
+    agents = {"buyer": {"your name": "Ana", "your role is": "buyer", "_goal": "buy the mug", "_constraint": "pay at most 10 dollars"},
+              "seller": {"your name": "Bo", "your role is": "seller", "_goal": "sell the mug", "_constraint": "sell above 5 dollars"}}
+    measurementsInfo = {"price": {"buyer": ["What price did you pay?", "What price did you want to pay?"],
+                                  "oracle": ["What was the final price?", "How much did the seller ask for?"]},
+                        "deal": {"buyer": "Did you reach a deal?"}}
+    history = [{"Ana": "I can offer 8 dollars."}, {"Bo": "Deal, goodbye."}]
+    return (history, measurementsInfo, agents, ["price", "deal"], "two people bargaining over a mug", ["the price in dollars"])
+
+
+def test_batched_survey_keeps_the_responses_structure(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setenv("LLM_FAMILY", "mock")
+    registry = MetricsRegistry(path=None)
+    monkeypatch.setattr(Metrics, "_metrics_registry", registry)
+    args = survey_args()
+
+    one_by_one = call_measurement(*args, batch_questions=False)
+    batched = call_measurement(*args, batch_questions=True)
+
+    assert json.dumps({variable: {agent: list(answers) for agent, answers in by_agent.items()} for variable, by_agent in batched.items()}) == \
+        json.dumps({variable: {agent: list(answers) for agent, answers in by_agent.items()} for variable, by_agent in one_by_one.items()})
+    assert all("answer" in json.loads(answer) for by_agent in batched.values() for answers in by_agent.values() for answer in answers.values())
+    # 5 prompts one question at a time, 2 prompts (the buyer and the oracle) when batched
+    assert len(registry.calls) == 5 + 2
+
+
+def test_concurrent_survey_matches_the_sequential_one(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setenv("LLM_FAMILY", "mock")
+    monkeypatch.setattr(Metrics, "_metrics_registry", MetricsRegistry(path=None))
+    in_flight = [0]
+    most_in_flight = []
+    acall_llm = LanguageModel.acall_llm
+
+    async def counting_acall_llm(self, prompt, **kwargs):
+        in_flight[0] += 1
+        most_in_flight[-1] = max(most_in_flight[-1], in_flight[0])
+        try:
+            await asyncio.sleep(0.01)
+            return await acall_llm(self, prompt, **kwargs)
+        finally:
+            in_flight[0] -= 1
+
+    monkeypatch.setattr(LanguageModel, "acall_llm", counting_acall_llm)
+
+    def survey(max_concurrency):
+        most_in_flight.append(0)
+        return asyncio.run(acall_measurement(*survey_args(), max_concurrency=max_concurrency, batch_questions=False))
+
+    sequential = survey(1)
+    concurrent = survey(2)
+
+    # {variable: {agent: {question: answer}}}, with the same answers in the same order
+    assert json.dumps(concurrent) == json.dumps(sequential)
+    assert list(concurrent["price"]["oracle"]) == ["What was the final price?", "How much did the seller ask for?"]
+    # the 5 questions are asked at most max_concurrency at a time
+    assert most_in_flight == [1, 2]
@@ -0,0 +1,24 @@
+# tests/test_transcript.py
+import sys
+import pickle
+
+sys.path.append('./src/Human')
+sys.path.append('./src/LLM')
+sys.path.append('./src/Serialization')
+
+from Transcript import Transcript
+from Human import list_to_string
+
+
+def test_transcript_renders_like_a_list():
+    history, transcript = [], Transcript()
+    for turn in range(4):
+        statement = {f"agent {turn % 2}": f"I'd offer {turn} dollars"}
+        history.append(statement)
+        transcript.append(statement)
+        assert list_to_string(transcript) == list_to_string(history)
+        assert f"{transcript}" == f"{history}"
+
+    transcript[0] = history[0] = {"seller": "no"}
+    assert str(transcript) == str(history) and transcript.text == list_to_string(history)
+    assert str(pickle.loads(pickle.dumps(transcript))) == str(history)
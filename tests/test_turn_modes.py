@@ -0,0 +1,23 @@
+# tests/test_turn_modes.py
+import sys
+
+sys.path.append('./src/Human')
+sys.path.append('./src/LLM')
+sys.path.append('./src/Serialization')
+
+from Human import Human, said_farewell
+
+
+def test_statement_and_decision_are_parsed():
+    parse = Human.parse_statement_and_decision
+    assert parse('{"statement": "Deal at 20 Dollars, goodbye!", "conversation_complete": "yes"}') == \
+        {'statement': 'Deal at 20 Dollars, goodbye!', 'conversation_complete': True}
+    assert parse('```json\n{"statement": "How about 15?", "conversation_complete": false}\n```')['conversation_complete'] is False
+    # a plain statement is kept as the statement and the conversation goes on
+    assert parse('How about 15?') == {'statement': 'How about 15?', 'conversation_complete': False}
+
+
+def test_farewell_cues():
+    assert said_farewell("Thank you for the conversation, goodbye.")
+    assert said_farewell("Great, we have a deal! Have a nice day.")
+    assert not said_farewell("I would be comfortable with 30 dollars.")